@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from io import StringIO, TextIOWrapper
 from typing import Tuple, Union, List
 
-from .utils import deserialize_val
+from .utils import ColumnSpec, deserialize_val, make_row_decoder
 
 
 def apply_transformation(val, t):
@@ -36,30 +36,34 @@ class ExperimentLine:
     ion_injection_time: Union[float, None]
 
 
+_EXPERIMENT_LINE_SPECS = [
+    ColumnSpec(int, strip="[]"),  # num
+    ColumnSpec(str),  # sequence
+    ColumnSpec(str),  # file_name
+    ColumnSpec(int),  # scan
+    ColumnSpec(int),  # cstate
+    ColumnSpec(float),  # intensity
+    ColumnSpec(int),  # corrioninjection_intensity
+    ColumnSpec(float),  # profile_score
+    ColumnSpec(float),  # mhplus
+    ColumnSpec(float),  # calc_mhplus
+    ColumnSpec(float),  # total_intensity
+    ColumnSpec(float),  # xcorr
+    ColumnSpec(float),  # delta_cn
+    ColumnSpec(float),  # dmass
+    ColumnSpec(int),  # sprank
+    ColumnSpec(float),  # sp_score
+    ColumnSpec(int),  # redundancy
+    ColumnSpec(float),  # start_range
+    ColumnSpec(float),  # end_range
+    ColumnSpec(float),  # retention_time
+    ColumnSpec(float),  # ion_injection_time
+]
+_decode_experiment_row = make_row_decoder(_EXPERIMENT_LINE_SPECS)
+
+
 def _deserialize_experiment_line(line_elems: list[str]) -> ExperimentLine:
-    return ExperimentLine(
-        num=deserialize_val(line_elems[0], lambda x: int(x.strip("[").strip("]"))),
-        sequence=deserialize_val(line_elems[1], str),
-        file_name=deserialize_val(line_elems[2], str),
-        scan=deserialize_val(line_elems[3], int),
-        cstate=deserialize_val(line_elems[4], int),
-        intensity=deserialize_val(line_elems[5], float),
-        corrioninjection_intensity=deserialize_val(line_elems[6], int),
-        profile_score=deserialize_val(line_elems[7], float),
-        mhplus=deserialize_val(line_elems[8], float),
-        calc_mhplus=deserialize_val(line_elems[9], float),
-        total_intensity=deserialize_val(line_elems[10], float),
-        xcorr=deserialize_val(line_elems[11], float),
-        delta_cn=deserialize_val(line_elems[12], float),
-        dmass=deserialize_val(line_elems[13], float),
-        sprank=deserialize_val(line_elems[14], int),
-        sp_score=deserialize_val(line_elems[15], float),
-        redundancy=deserialize_val(line_elems[16], int),
-        start_range=deserialize_val(line_elems[17], float),
-        end_range=deserialize_val(line_elems[18], float),
-        retention_time=deserialize_val(line_elems[19], float),
-        ion_injection_time=deserialize_val(line_elems[20], float),
-    )
+    return ExperimentLine(*_decode_experiment_row(line_elems))
 
 
 @dataclass
@@ -1,11 +1,18 @@
 from dataclasses import dataclass, asdict
 from enum import Enum, auto
 from io import StringIO, TextIOWrapper
-from typing import Tuple, Union, List
+from typing import Callable, Dict, Optional, Tuple, Union, List
 
+import numpy as np
 import pandas as pd
 
-from .utils import serialize_val, deserialize_val
+from .utils import (
+    ColumnSpec,
+    decode_columns,
+    line_template,
+    make_line_decoder,
+    make_line_encoder,
+)
 from collections import defaultdict
 
 
@@ -47,313 +54,184 @@ class PeptideLine:
     @property
     def file_path(self) -> Union[str, None]:
         if self.file_name:
-            return str(self.file_name.split(".")[0])
+            return str(self.file_name.rsplit(".", 3)[0])
         return None
 
     @property
     def low_scan(self) -> Union[int, None]:
         if self.file_name:
-            return int(self.file_name.split(".")[1])
+            return int(self.file_name.rsplit(".", 3)[1])
         return None
 
     @property
     def high_scan(self) -> Union[int, None]:
         if self.file_name:
-            return int(self.file_name.split(".")[2])
+            return int(self.file_name.rsplit(".", 3)[2])
         return None
 
     @property
     def charge(self) -> Union[int, None]:
         if self.file_name:
-            return int(self.file_name.split(".")[3])
+            return int(self.file_name.rsplit(".", 3)[3])
         return None
 
 
-peptide_line_V2_1_12_template = (
-    "{unique}\t{file_name}\t{x_corr}\t{delta_cn}\t{conf}\t{mass_plus_hydrogen}"
-    "\t{calc_mass_plus_hydrogen}\t{total_intensity}\t{spr}\t{prob_score}"
-    "\t{ion_proportion}\t{redundancy}\t{sequence}\n"
+_INT, _STR = ColumnSpec(int), ColumnSpec(str)
+
+
+def _float(precision: Optional[int] = None) -> ColumnSpec:
+    return ColumnSpec(float, precision=precision)
+
+
+# peptide line columns of every DTASelect-filter version, in file order
+_PEPTIDE_LINE_SCHEMAS = {
+    DtaSelectFilterVersion.V2_1_12: {
+        "unique": _STR,
+        "file_name": _STR,
+        "x_corr": _float(4),
+        "delta_cn": _float(4),
+        "conf": _float(1),
+        "mass_plus_hydrogen": _float(5),
+        "calc_mass_plus_hydrogen": _float(5),
+        "total_intensity": _float(),
+        "spr": _INT,
+        "prob_score": _float(),
+        "ion_proportion": _float(),
+        "redundancy": _INT,
+        "sequence": _STR,
+    },
+    DtaSelectFilterVersion.V2_1_12_rt: {
+        "unique": _STR,
+        "file_name": _STR,
+        "x_corr": _float(4),
+        "delta_cn": _float(4),
+        "conf": _float(1),
+        "mass_plus_hydrogen": _float(5),
+        "calc_mass_plus_hydrogen": _float(5),
+        "ppm": _float(),
+        "total_intensity": _float(),
+        "spr": _INT,
+        "prob_score": _float(),
+        "pi": _float(),
+        "ion_proportion": _float(),
+        "redundancy": _INT,
+        "sequence": _STR,
+        "ret_time": _float(),
+    },
+    DtaSelectFilterVersion.V2_1_12_paser: {
+        "unique": _STR,
+        "file_name": _STR,
+        "x_corr": _float(4),
+        "delta_cn": _float(4),
+        "conf": _float(1),
+        "mass_plus_hydrogen": _float(5),
+        "calc_mass_plus_hydrogen": _float(5),
+        "ppm": _float(1),
+        "total_intensity": _float(1),
+        "spr": _INT,
+        "prob_score": _float(7),
+        "pi": _float(2),
+        "ion_proportion": _float(2),
+        "redundancy": _INT,
+        "sequence": _STR,
+        "ret_time": _float(4),
+        "ptm_index": _STR,
+        "ptm_index_protein_list": _STR,
+    },
+    DtaSelectFilterVersion.V2_1_13: {
+        "unique": _STR,
+        "file_name": _STR,
+        "x_corr": _float(4),
+        "delta_cn": _float(4),
+        "conf": _float(14),
+        "mass_plus_hydrogen": _float(5),
+        "calc_mass_plus_hydrogen": _float(5),
+        "ppm": _float(1),
+        "total_intensity": _float(1),
+        "spr": _INT,
+        "prob_score": _float(3),
+        "pi": _float(2),
+        "ion_proportion": _float(1),
+        "redundancy": _INT,
+        "measured_im_value": _float(4),
+        "predicted_im_value": _float(16),
+        "im_score": _float(4),
+        "sequence": _STR,
+    },
+    DtaSelectFilterVersion.V2_1_13_timscore: {
+        "unique": _STR,
+        "file_name": _STR,
+        "x_corr": _float(),
+        "delta_cn": _float(),
+        "conf": _float(),
+        "mass_plus_hydrogen": _float(),
+        "calc_mass_plus_hydrogen": _float(),
+        "ppm": _float(),
+        "total_intensity": _float(),
+        "spr": _INT,
+        "prob_score": _float(),
+        "pi": _float(),
+        "ion_proportion": _float(),
+        "redundancy": _INT,
+        "measured_im_value": _float(),
+        "predicted_im_value": _float(),
+        "im_score": _float(),
+        "sequence": _STR,
+        "experimental_mz": _float(),
+        "corrected_1k0": _float(),
+        "ion_mobility": _float(),
+        "ret_time": _float(),
+        "ptm_index": _STR,
+        "ptm_index_protein_list": _STR,
+    },
+}
+# leading peptide line columns that must be present, the others may be left out
+_PEPTIDE_LINE_REQUIRED_COLUMNS = {DtaSelectFilterVersion.V2_1_13_timscore: 22}
+
+peptide_line_V2_1_12_template = line_template(
+    _PEPTIDE_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_12]
 )
-peptide_line_V2_1_12_rt_template = (
-    "{unique}\t{file_name}\t{x_corr}\t{delta_cn}\t{conf}\t{mass_plus_hydrogen}"
-    "\t{calc_mass_plus_hydrogen}\t{ppm}\t{total_intensity}\t{spr}\t{prob_score}\t{pi}"
-    "\t{ion_proportion}\t{redundancy}\t{sequence}\t{ret_time}\n"
+peptide_line_V2_1_12_rt_template = line_template(
+    _PEPTIDE_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_12_rt]
 )
-peptide_line_V2_1_12_paser_template = (
-    "{unique}\t{file_name}\t{x_corr}\t{delta_cn}\t{conf}\t{mass_plus_hydrogen}"
-    "\t{calc_mass_plus_hydrogen}\t{ppm}\t{total_intensity}\t{spr}\t{prob_score}"
-    "\t{pi}\t{ion_proportion}\t{redundancy}\t{sequence}\t{ret_time}\t{ptm_index}"
-    "\t{ptm_index_protein_list}\n"
+peptide_line_V2_1_12_paser_template = line_template(
+    _PEPTIDE_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_12_paser]
 )
-peptide_line_V2_1_13_template = (
-    "{unique}\t{file_name}\t{x_corr}\t{delta_cn}\t{conf}\t{mass_plus_hydrogen}"
-    "\t{calc_mass_plus_hydrogen}\t{ppm}\t{total_intensity}\t{spr}\t{prob_score}\t{pi}"
-    "\t{ion_proportion}\t{redundancy}\t{measured_im_value}\t{predicted_im_value}"
-    "\t{im_score}\t{sequence}\n"
+peptide_line_V2_1_13_template = line_template(
+    _PEPTIDE_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_13]
 )
-peptide_line_V2_1_13_timscore_template = (
-    "{unique}\t{file_name}\t{x_corr}\t{delta_cn}\t{conf}\t{mass_plus_hydrogen}"
-    "\t{calc_mass_plus_hydrogen}\t{ppm}\t{total_intensity}\t{spr}\t{prob_score}"
-    "\t{pi}\t{ion_proportion}\t{redundancy}\t{measured_im_value}"
-    "\t{predicted_im_value}\t{im_score}\t{sequence}\t{experimental_mz}"
-    "\t{corrected_1k0}\t{ion_mobility}\t{ret_time}\t{ptm_index}"
-    "\t{ptm_index_protein_list}\n"
+peptide_line_V2_1_13_timscore_template = line_template(
+    _PEPTIDE_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_13_timscore]
 )
 
+_PEPTIDE_LINE_DECODERS = {
+    version: make_line_decoder(
+        PeptideLine, schema, n_required=_PEPTIDE_LINE_REQUIRED_COLUMNS.get(version)
+    )
+    for version, schema in _PEPTIDE_LINE_SCHEMAS.items()
+}
+_PEPTIDE_LINE_ENCODERS = {
+    version: make_line_encoder(schema)
+    for version, schema in _PEPTIDE_LINE_SCHEMAS.items()
+}
+
+
+def _version_codec(
+    codecs: Dict[DtaSelectFilterVersion, Callable], version: DtaSelectFilterVersion
+):
+    if version not in codecs:
+        raise ValueError(f"Unsupported DtaSelectFilter Version: {version}!")
+    return codecs[version]
+
 
 def _serialize_peptide_line(line: PeptideLine, version: DtaSelectFilterVersion) -> str:
-    if version == DtaSelectFilterVersion.V2_1_12:
-        return peptide_line_V2_1_12_template.format(
-            unique=serialize_val(line.unique),
-            file_name=serialize_val(line.file_name),
-            x_corr=serialize_val(line.x_corr, 4),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            conf=serialize_val(line.conf, 1),
-            mass_plus_hydrogen=serialize_val(line.mass_plus_hydrogen, 5),
-            calc_mass_plus_hydrogen=serialize_val(line.calc_mass_plus_hydrogen, 5),
-            total_intensity=serialize_val(line.total_intensity),
-            spr=serialize_val(line.spr),
-            prob_score=serialize_val(line.prob_score),
-            ion_proportion=serialize_val(line.ion_proportion),
-            redundancy=serialize_val(line.redundancy),
-            sequence=serialize_val(line.sequence),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_12_rt:
-        return peptide_line_V2_1_12_rt_template.format(
-            unique=serialize_val(line.unique),
-            file_name=serialize_val(line.file_name),
-            x_corr=serialize_val(line.x_corr, 4),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            conf=serialize_val(line.conf, 1),
-            mass_plus_hydrogen=serialize_val(line.mass_plus_hydrogen, 5),
-            calc_mass_plus_hydrogen=serialize_val(line.calc_mass_plus_hydrogen, 5),
-            total_intensity=serialize_val(line.total_intensity),
-            spr=serialize_val(line.spr),
-            prob_score=serialize_val(line.prob_score),
-            pi=serialize_val(line.pi),
-            ion_proportion=serialize_val(line.ion_proportion),
-            redundancy=serialize_val(line.redundancy),
-            sequence=serialize_val(line.sequence),
-            ret_time=serialize_val(line.ret_time),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_12_paser:
-        return peptide_line_V2_1_12_paser_template.format(
-            unique=serialize_val(line.unique),
-            file_name=serialize_val(line.file_name),
-            x_corr=serialize_val(line.x_corr, 4),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            conf=serialize_val(line.conf, 1),
-            mass_plus_hydrogen=serialize_val(line.mass_plus_hydrogen, 5),
-            calc_mass_plus_hydrogen=serialize_val(line.calc_mass_plus_hydrogen, 5),
-            ppm=serialize_val(line.ppm, 1),
-            total_intensity=serialize_val(line.total_intensity, 1),
-            spr=serialize_val(line.spr),
-            prob_score=serialize_val(line.prob_score, 7),
-            pi=serialize_val(line.pi, 2),
-            ion_proportion=serialize_val(line.ion_proportion, 2),
-            redundancy=serialize_val(line.redundancy),
-            sequence=serialize_val(line.sequence),
-            ret_time=serialize_val(line.ret_time, 4),
-            ptm_index=serialize_val(line.ptm_index),
-            ptm_index_protein_list=serialize_val(line.ptm_index_protein_list),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13:
-        return peptide_line_V2_1_13_template.format(
-            unique=serialize_val(line.unique),
-            file_name=serialize_val(line.file_name),
-            x_corr=serialize_val(line.x_corr, 4),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            conf=serialize_val(line.conf, 14),
-            mass_plus_hydrogen=serialize_val(line.mass_plus_hydrogen, 5),
-            calc_mass_plus_hydrogen=serialize_val(line.calc_mass_plus_hydrogen, 5),
-            ppm=serialize_val(line.ppm, 1),
-            total_intensity=serialize_val(line.total_intensity, 1),
-            spr=serialize_val(line.spr),
-            prob_score=serialize_val(line.prob_score, 3),
-            pi=serialize_val(line.pi, 2),
-            ion_proportion=serialize_val(line.ion_proportion, 1),
-            redundancy=serialize_val(line.redundancy),
-            measured_im_value=serialize_val(line.measured_im_value, 4),
-            predicted_im_value=serialize_val(line.predicted_im_value, 16),
-            im_score=serialize_val(line.im_score, 4),
-            sequence=serialize_val(line.sequence),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13_timscore:
-        return peptide_line_V2_1_13_timscore_template.format(
-            unique=serialize_val(line.unique),
-            file_name=serialize_val(line.file_name),
-            x_corr=serialize_val(line.x_corr),
-            delta_cn=serialize_val(line.delta_cn),
-            conf=serialize_val(line.conf),
-            mass_plus_hydrogen=serialize_val(line.mass_plus_hydrogen),
-            calc_mass_plus_hydrogen=serialize_val(line.calc_mass_plus_hydrogen),
-            ppm=serialize_val(line.ppm),
-            total_intensity=serialize_val(line.total_intensity),
-            spr=serialize_val(line.spr),
-            prob_score=serialize_val(line.prob_score),
-            pi=serialize_val(line.pi),
-            ion_proportion=serialize_val(line.ion_proportion),
-            redundancy=serialize_val(line.redundancy),
-            measured_im_value=serialize_val(line.measured_im_value),
-            predicted_im_value=serialize_val(line.predicted_im_value),
-            im_score=serialize_val(line.im_score),
-            sequence=serialize_val(line.sequence),
-            experimental_mz=serialize_val(line.experimental_mz),
-            corrected_1k0=serialize_val(line.corrected_1k0),
-            ion_mobility=serialize_val(line.ion_mobility),
-            ret_time=serialize_val(line.ret_time),
-            ptm_index=serialize_val(line.ptm_index),
-            ptm_index_protein_list=serialize_val(line.ptm_index_protein_list),
-        )
-    else:
-        raise ValueError(f"Unsupported DtaSelectFilter Version: {version}!")
+    return _version_codec(_PEPTIDE_LINE_ENCODERS, version)(line)
 
 
 def _deserialize_peptide_line(
     line: str, version: DtaSelectFilterVersion
 ) -> PeptideLine:
-    line_elems = line.rstrip().split("\t")
-    if version == DtaSelectFilterVersion.V2_1_12:
-        return PeptideLine(
-            unique=deserialize_val(line_elems[0], str),
-            file_name=deserialize_val(line_elems[1], str),
-            x_corr=deserialize_val(line_elems[2], float),
-            delta_cn=deserialize_val(line_elems[3], float),
-            conf=deserialize_val(line_elems[4], float),
-            mass_plus_hydrogen=deserialize_val(line_elems[5], float),
-            calc_mass_plus_hydrogen=deserialize_val(line_elems[6], float),
-            total_intensity=deserialize_val(line_elems[7], float),
-            spr=deserialize_val(line_elems[8], int),
-            prob_score=deserialize_val(line_elems[9], float),
-            ion_proportion=deserialize_val(line_elems[10], float),
-            redundancy=deserialize_val(line_elems[11], int),
-            sequence=deserialize_val(line_elems[12], str),
-            corrected_1k0=None,
-            experimental_mz=None,
-            im_score=None,
-            ion_mobility=None,
-            measured_im_value=None,
-            pi=None,
-            ppm=None,
-            predicted_im_value=None,
-            ptm_index=None,
-            ptm_index_protein_list=None,
-            ret_time=None,
-        )
-    elif version == DtaSelectFilterVersion.V2_1_12_rt:
-        return PeptideLine(
-            unique=deserialize_val(line_elems[0], str),
-            file_name=deserialize_val(line_elems[1], str),
-            x_corr=deserialize_val(line_elems[2], float),
-            delta_cn=deserialize_val(line_elems[3], float),
-            conf=deserialize_val(line_elems[4], float),
-            mass_plus_hydrogen=deserialize_val(line_elems[5], float),
-            calc_mass_plus_hydrogen=deserialize_val(line_elems[6], float),
-            ppm=deserialize_val(line_elems[7], float),
-            total_intensity=deserialize_val(line_elems[8], float),
-            spr=deserialize_val(line_elems[9], int),
-            prob_score=deserialize_val(line_elems[10], float),
-            pi=deserialize_val(line_elems[11], float),
-            ion_proportion=deserialize_val(line_elems[12], float),
-            redundancy=deserialize_val(line_elems[13], int),
-            sequence=deserialize_val(line_elems[14], str),
-            ret_time=deserialize_val(line_elems[15], float),
-            corrected_1k0=None,
-            experimental_mz=None,
-            im_score=None,
-            ion_mobility=None,
-            measured_im_value=None,
-            predicted_im_value=None,
-            ptm_index=None,
-            ptm_index_protein_list=None,
-        )
-    elif version == DtaSelectFilterVersion.V2_1_12_paser:
-        return PeptideLine(
-            unique=deserialize_val(line_elems[0], str),
-            file_name=deserialize_val(line_elems[1], str),
-            x_corr=deserialize_val(line_elems[2], float),
-            delta_cn=deserialize_val(line_elems[3], float),
-            conf=deserialize_val(line_elems[4], float),
-            mass_plus_hydrogen=deserialize_val(line_elems[5], float),
-            calc_mass_plus_hydrogen=deserialize_val(line_elems[6], float),
-            ppm=deserialize_val(line_elems[7], float),
-            total_intensity=deserialize_val(line_elems[8], float),
-            spr=deserialize_val(line_elems[9], int),
-            prob_score=deserialize_val(line_elems[10], float),
-            pi=deserialize_val(line_elems[11], float),
-            ion_proportion=deserialize_val(line_elems[12], float),
-            redundancy=deserialize_val(line_elems[13], int),
-            sequence=deserialize_val(line_elems[14], str),
-            ret_time=deserialize_val(line_elems[15], float),
-            ptm_index=deserialize_val(line_elems[16], str),
-            ptm_index_protein_list=deserialize_val(line_elems[17], str),
-            corrected_1k0=None,
-            experimental_mz=None,
-            im_score=None,
-            ion_mobility=None,
-            measured_im_value=None,
-            predicted_im_value=None,
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13:
-        return PeptideLine(
-            unique=deserialize_val(line_elems[0], str),
-            file_name=deserialize_val(line_elems[1], str),
-            x_corr=deserialize_val(line_elems[2], float),
-            delta_cn=deserialize_val(line_elems[3], float),
-            conf=deserialize_val(line_elems[4], float),
-            mass_plus_hydrogen=deserialize_val(line_elems[5], float),
-            calc_mass_plus_hydrogen=deserialize_val(line_elems[6], float),
-            ppm=deserialize_val(line_elems[7], float),
-            total_intensity=deserialize_val(line_elems[8], float),
-            spr=deserialize_val(line_elems[9], int),
-            prob_score=deserialize_val(line_elems[10], float),
-            pi=deserialize_val(line_elems[11], float),
-            ion_proportion=deserialize_val(line_elems[12], float),
-            redundancy=deserialize_val(line_elems[13], int),
-            measured_im_value=deserialize_val(line_elems[14], float),
-            predicted_im_value=deserialize_val(line_elems[15], float),
-            im_score=deserialize_val(line_elems[16], float),
-            sequence=deserialize_val(line_elems[17], str),
-            experimental_mz=None,
-            corrected_1k0=None,
-            ion_mobility=None,
-            ret_time=None,
-            ptm_index=None,
-            ptm_index_protein_list=None,
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13_timscore:
-        return PeptideLine(
-            unique=deserialize_val(line_elems[0], str),
-            file_name=deserialize_val(line_elems[1], str),
-            x_corr=deserialize_val(line_elems[2], float),
-            delta_cn=deserialize_val(line_elems[3], float),
-            conf=deserialize_val(line_elems[4], float),
-            mass_plus_hydrogen=deserialize_val(line_elems[5], float),
-            calc_mass_plus_hydrogen=deserialize_val(line_elems[6], float),
-            ppm=deserialize_val(line_elems[7], float),
-            total_intensity=deserialize_val(line_elems[8], float),
-            spr=deserialize_val(line_elems[9], int),
-            prob_score=deserialize_val(line_elems[10], float),
-            pi=deserialize_val(line_elems[11], float),
-            ion_proportion=deserialize_val(line_elems[12], float),
-            redundancy=deserialize_val(line_elems[13], int),
-            measured_im_value=deserialize_val(line_elems[14], float),
-            predicted_im_value=deserialize_val(line_elems[15], float),
-            im_score=deserialize_val(line_elems[16], float),
-            sequence=deserialize_val(line_elems[17], str),
-            experimental_mz=deserialize_val(line_elems[18], float),
-            corrected_1k0=deserialize_val(line_elems[19], float),
-            ion_mobility=deserialize_val(line_elems[20], float),
-            ret_time=deserialize_val(line_elems[21], float),
-            ptm_index=(
-                None if len(line_elems) == 22 else deserialize_val(line_elems[22], str)
-            ),
-            ptm_index_protein_list=(
-                None if len(line_elems) == 22 else deserialize_val(line_elems[23], str)
-            ),
-        )
-    else:
-        raise ValueError(f"Unsupported DtaSelectFilter Version: {version}!")
+    return _version_codec(_PEPTIDE_LINE_DECODERS, version)(line)
 
 
 @dataclass
@@ -374,185 +252,69 @@ class ProteinLine:
     m_redundancy: Union[int, None] = None
 
 
-protein_line_V2_1_12_template = (
-    "{locus_name}\t{sequence_count}\t{spectrum_count}\t{sequence_coverage}"
-    "\t{length}\t{molWt}\t{pi}\t{validation_status}\t{nsaf}\t{empai}\t{description_name}\n"
+_PROTEIN_LINE_V2_1_12_SCHEMA = {
+    "locus_name": _STR,
+    "sequence_count": _INT,
+    "spectrum_count": _INT,
+    "sequence_coverage": ColumnSpec(float, strip="%", precision=1, suffix="%"),
+    "length": _INT,
+    "molWt": _float(),
+    "pi": _float(1),
+    "validation_status": _STR,
+    "nsaf": _float(10),
+    "empai": _float(8),
+    "description_name": _STR,
+}
+_PROTEIN_LINE_V2_1_12_PASER_SCHEMA = {
+    **_PROTEIN_LINE_V2_1_12_SCHEMA,
+    "h_redundancy": _INT,
+    "l_redundancy": _INT,
+    "m_redundancy": _INT,
+}
+
+# protein line columns of every DTASelect-filter version, in file order
+_PROTEIN_LINE_SCHEMAS = {
+    DtaSelectFilterVersion.V2_1_12: _PROTEIN_LINE_V2_1_12_SCHEMA,
+    DtaSelectFilterVersion.V2_1_12_rt: _PROTEIN_LINE_V2_1_12_SCHEMA,
+    DtaSelectFilterVersion.V2_1_12_paser: _PROTEIN_LINE_V2_1_12_PASER_SCHEMA,
+    DtaSelectFilterVersion.V2_1_13: _PROTEIN_LINE_V2_1_12_SCHEMA,
+    DtaSelectFilterVersion.V2_1_13_timscore: _PROTEIN_LINE_V2_1_12_PASER_SCHEMA,
+}
+
+protein_line_V2_1_12_template = line_template(
+    _PROTEIN_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_12]
 )
-protein_line_V2_1_12_rt_template = (
-    "{locus_name}\t{sequence_count}\t{spectrum_count}\t{sequence_coverage}"
-    "\t{length}\t{molWt}\t{pi}\t{validation_status}\t{nsaf}\t{empai}\t{description_name}\n"
+protein_line_V2_1_12_rt_template = line_template(
+    _PROTEIN_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_12_rt]
 )
-protein_line_V2_1_12_paser_template = (
-    "{locus_name}\t{sequence_count}\t{spectrum_count}\t{sequence_coverage}"
-    "\t{length}\t{molWt}\t{pi}\t{validation_status}\t{nsaf}\t{empai}"
-    "\t{description_name}\t{h_redundancy}\t{l_redundancy}\t{m_redundancy}\n"
+protein_line_V2_1_12_paser_template = line_template(
+    _PROTEIN_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_12_paser]
 )
-protein_line_V2_1_13_template = (
-    "{locus_name}\t{sequence_count}\t{spectrum_count}\t{sequence_coverage}"
-    "\t{length}\t{molWt}\t{pi}\t{validation_status}\t{nsaf}\t{empai}\t{description_name}\n"
+protein_line_V2_1_13_template = line_template(
+    _PROTEIN_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_13]
 )
-protein_line_V2_1_13_timscore_template = (
-    "{locus_name}\t{sequence_count}\t{spectrum_count}\t{sequence_coverage}"
-    "\t{length}\t{molWt}\t{pi}\t{validation_status}\t{nsaf}\t{empai}"
-    "\t{description_name}\t{h_redundancy}\t{l_redundancy}\t{m_redundancy}\n"
+protein_line_V2_1_13_timscore_template = line_template(
+    _PROTEIN_LINE_SCHEMAS[DtaSelectFilterVersion.V2_1_13_timscore]
 )
 
+_PROTEIN_LINE_DECODERS = {
+    version: make_line_decoder(ProteinLine, schema)
+    for version, schema in _PROTEIN_LINE_SCHEMAS.items()
+}
+_PROTEIN_LINE_ENCODERS = {
+    version: make_line_encoder(schema)
+    for version, schema in _PROTEIN_LINE_SCHEMAS.items()
+}
+
 
 def _serialize_protein_line(line: ProteinLine, version: DtaSelectFilterVersion) -> str:
-    if (
-        version == DtaSelectFilterVersion.V2_1_12
-        or version == DtaSelectFilterVersion.V2_1_12_rt
-    ):
-        return protein_line_V2_1_12_template.format(
-            locus_name=serialize_val(line.locus_name),
-            sequence_count=serialize_val(line.sequence_count),
-            spectrum_count=serialize_val(line.spectrum_count),
-            sequence_coverage=serialize_val(line.sequence_coverage, 1) + "%",
-            length=serialize_val(line.length),
-            molWt=serialize_val(line.molWt),
-            pi=serialize_val(line.pi, 1),
-            validation_status=serialize_val(line.validation_status),
-            nsaf=serialize_val(line.nsaf, 10),
-            empai=serialize_val(line.empai, 8),
-            description_name=serialize_val(line.description_name),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_12_paser:
-        return protein_line_V2_1_12_paser_template.format(
-            locus_name=serialize_val(line.locus_name),
-            sequence_count=serialize_val(line.sequence_count),
-            spectrum_count=serialize_val(line.spectrum_count),
-            sequence_coverage=serialize_val(line.sequence_coverage, 1) + "%",
-            length=serialize_val(line.length),
-            molWt=serialize_val(line.molWt),
-            pi=serialize_val(line.pi, 1),
-            validation_status=serialize_val(line.validation_status),
-            nsaf=serialize_val(line.nsaf, 10),
-            empai=serialize_val(line.empai, 8),
-            description_name=serialize_val(line.description_name),
-            h_redundancy=serialize_val(line.h_redundancy),
-            l_redundancy=serialize_val(line.l_redundancy),
-            m_redundancy=serialize_val(line.m_redundancy),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13:
-        return protein_line_V2_1_13_template.format(
-            locus_name=serialize_val(line.locus_name),
-            sequence_count=serialize_val(line.sequence_count),
-            spectrum_count=serialize_val(line.spectrum_count),
-            sequence_coverage=serialize_val(line.sequence_coverage, 1) + "%",
-            length=serialize_val(line.length),
-            molWt=serialize_val(line.molWt),
-            pi=serialize_val(line.pi, 1),
-            validation_status=serialize_val(line.validation_status),
-            nsaf=serialize_val(line.nsaf, 10),
-            empai=serialize_val(line.empai, 8),
-            description_name=serialize_val(line.description_name),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13_timscore:
-        return protein_line_V2_1_13_timscore_template.format(
-            locus_name=serialize_val(line.locus_name),
-            sequence_count=serialize_val(line.sequence_count),
-            spectrum_count=serialize_val(line.spectrum_count),
-            sequence_coverage=serialize_val(line.sequence_coverage, 1) + "%",
-            length=serialize_val(line.length),
-            molWt=serialize_val(line.molWt),
-            pi=serialize_val(line.pi, 1),
-            validation_status=serialize_val(line.validation_status),
-            nsaf=serialize_val(line.nsaf, 10),
-            empai=serialize_val(line.empai, 8),
-            description_name=serialize_val(line.description_name),
-            h_redundancy=serialize_val(line.h_redundancy),
-            l_redundancy=serialize_val(line.l_redundancy),
-            m_redundancy=serialize_val(line.m_redundancy),
-        )
-    else:
-        raise ValueError(f"Unsupported DtaSelectFilter Version: {version}!")
+    return _version_codec(_PROTEIN_LINE_ENCODERS, version)(line)
 
 
 def _deserialize_protein_line(
     line: str, version: DtaSelectFilterVersion
 ) -> ProteinLine:
-    line_elems = line.rstrip().split("\t")
-    if (
-        version == DtaSelectFilterVersion.V2_1_12
-        or version == DtaSelectFilterVersion.V2_1_12_rt
-    ):
-        return ProteinLine(
-            locus_name=deserialize_val(line_elems[0], str),
-            sequence_count=deserialize_val(line_elems[1], int),
-            spectrum_count=deserialize_val(line_elems[2], int),
-            sequence_coverage=deserialize_val(
-                line_elems[3], lambda x: float(x.rstrip("%"))
-            ),
-            length=deserialize_val(line_elems[4], int),
-            molWt=deserialize_val(line_elems[5], float),
-            pi=deserialize_val(line_elems[6], float),
-            validation_status=deserialize_val(line_elems[7], str),
-            nsaf=deserialize_val(line_elems[8], float),
-            empai=deserialize_val(line_elems[9], float),
-            description_name=deserialize_val(line_elems[10], str),
-            h_redundancy=None,
-            l_redundancy=None,
-            m_redundancy=None,
-        )
-    elif version == DtaSelectFilterVersion.V2_1_12_paser:
-        return ProteinLine(
-            locus_name=deserialize_val(line_elems[0], str),
-            sequence_count=deserialize_val(line_elems[1], int),
-            spectrum_count=deserialize_val(line_elems[2], int),
-            sequence_coverage=deserialize_val(
-                line_elems[3], lambda x: float(x.rstrip("%"))
-            ),
-            length=deserialize_val(line_elems[4], int),
-            molWt=deserialize_val(line_elems[5], float),
-            pi=deserialize_val(line_elems[6], float),
-            validation_status=deserialize_val(line_elems[7], str),
-            nsaf=deserialize_val(line_elems[8], float),
-            empai=deserialize_val(line_elems[9], float),
-            description_name=deserialize_val(line_elems[10], str),
-            h_redundancy=deserialize_val(line_elems[11], int),
-            l_redundancy=deserialize_val(line_elems[12], int),
-            m_redundancy=deserialize_val(line_elems[13], int),
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13:
-        return ProteinLine(
-            locus_name=deserialize_val(line_elems[0], str),
-            sequence_count=deserialize_val(line_elems[1], int),
-            spectrum_count=deserialize_val(line_elems[2], int),
-            sequence_coverage=deserialize_val(
-                line_elems[3], lambda x: float(x.rstrip("%"))
-            ),
-            length=deserialize_val(line_elems[4], int),
-            molWt=deserialize_val(line_elems[5], float),
-            pi=deserialize_val(line_elems[6], float),
-            validation_status=deserialize_val(line_elems[7], str),
-            nsaf=deserialize_val(line_elems[8], float),
-            empai=deserialize_val(line_elems[9], float),
-            description_name=deserialize_val(line_elems[10], str),
-            h_redundancy=None,
-            l_redundancy=None,
-            m_redundancy=None,
-        )
-    elif version == DtaSelectFilterVersion.V2_1_13_timscore:
-        return ProteinLine(
-            locus_name=deserialize_val(line_elems[0], str),
-            sequence_count=deserialize_val(line_elems[1], int),
-            spectrum_count=deserialize_val(line_elems[2], int),
-            sequence_coverage=deserialize_val(
-                line_elems[3], lambda x: float(x.rstrip("%"))
-            ),
-            length=deserialize_val(line_elems[4], int),
-            molWt=deserialize_val(line_elems[5], float),
-            pi=deserialize_val(line_elems[6], float),
-            validation_status=deserialize_val(line_elems[7], str),
-            nsaf=deserialize_val(line_elems[8], float),
-            empai=deserialize_val(line_elems[9], float),
-            description_name=deserialize_val(line_elems[10], str),
-            h_redundancy=deserialize_val(line_elems[11], int),
-            l_redundancy=deserialize_val(line_elems[12], int),
-            m_redundancy=deserialize_val(line_elems[13], int),
-        )
-    else:
-        raise ValueError(f"Unsupported DtaSelectFilter Version: {version}!")
+    return _version_codec(_PROTEIN_LINE_DECODERS, version)(line)
 
 
 @dataclass
@@ -561,11 +323,13 @@ class DTAFilterResult:
     peptide_lines: List[PeptideLine]
 
     def serialize(self, version):
+        encode_protein_line = _version_codec(_PROTEIN_LINE_ENCODERS, version)
+        encode_peptide_line = _version_codec(_PEPTIDE_LINE_ENCODERS, version)
         protein_line_strings = [
-            _serialize_protein_line(line, version) for line in self.protein_lines
+            encode_protein_line(line) for line in self.protein_lines
         ]
         peptide_line_strings = [
-            _serialize_peptide_line(line, version) for line in self.peptide_lines
+            encode_peptide_line(line) for line in self.peptide_lines
         ]
         return "".join(protein_line_strings + peptide_line_strings)
 
@@ -838,6 +602,8 @@ def from_dta_select_filter(
 
             if version is None:
                 version = determine_dta_select_filter_version(h_lines[-1])
+            decode_peptide_line = _version_codec(_PEPTIDE_LINE_DECODERS, version)
+            decode_protein_line = _version_codec(_PROTEIN_LINE_DECODERS, version)
 
             print(f"Version: {version}")
             continue
@@ -859,7 +625,7 @@ def from_dta_select_filter(
                 or "*" in line_elements[0]
                 or line_elements[0].isnumeric()
             ):
-                peptide_lines.append(_deserialize_peptide_line(line, version))
+                peptide_lines.append(decode_peptide_line(line))
             else:
                 if protein_lines and peptide_lines:
                     dta_filter_results.append(
@@ -868,7 +634,7 @@ def from_dta_select_filter(
                         )
                     )
                     peptide_lines, protein_lines = [], []
-                protein_lines.append(_deserialize_protein_line(line, version))
+                protein_lines.append(decode_protein_line(line))
 
         if file_state == FileState.INFO:
             end_lines.append(line)
@@ -876,20 +642,33 @@ def from_dta_select_filter(
     return version, h_lines, dta_filter_results, end_lines
 
 
-def convert_to_best_datatype(values):
-    for datatype in (float, int, str):
-        try:
-            converted_values = [datatype(value) for value in values]
-            return converted_values
-        except (ValueError, TypeError):
-            continue
-    raise ValueError("Unable to convert values to any datatype")
+def _lines_to_columns(
+    lines: List[str],
+    header: Optional[List[str]],
+    schema: Dict[str, ColumnSpec],
+    n_required: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """Columns of the lines named by the file header, typed by the version schema."""
+    header = header or []
+    names = header[: len(schema)] + list(schema)[len(header) :]
+    if n_required is not None:
+        # left out optional trailing columns are NA
+        lines = [line + "\tNA" * (len(schema) - 1 - line.count("\t")) for line in lines]
+    return dict(zip(names, decode_columns(lines, list(schema.values()))))
 
 
 def from_dta_select_filter_to_df(
     file_input: Union[str, TextIOWrapper, StringIO],
     version: DtaSelectFilterVersion = None,
-) -> Tuple[DtaSelectFilterVersion, List[str], List[DTAFilterResult], List[str]]:
+) -> Tuple[DtaSelectFilterVersion, List[str], pd.DataFrame, pd.DataFrame, List[str]]:
+    """
+    Parse a DTASelect-filter file into a peptide and a protein DataFrame. Columns are
+    named by the file header and typed by the column schema of the version: int
+    columns are int64 (float64 with NaN when there are NA values), float columns
+    float64 and str columns object with None. Sequence Coverage is a float without
+    the "%". FileName is split into file_name, low_scan, high_scan and charge.
+    Proteins and their peptides share a protein_group.
+    """
     if type(file_input) is str:
         lines = file_input.split("\n")
     elif type(file_input) is TextIOWrapper or type(file_input) is StringIO:
@@ -904,27 +683,20 @@ def from_dta_select_filter_to_df(
 
     file_state = FileState.HEADER
 
-    h_lines, dta_filter_results, end_lines = [], [], []
-    peptide_lines, protein_lines = [], []
-
-    peptide_data = None
-    protein_data = None
-
-    current_protein_grp = 0
-    peptide_line_cnt = 0
+    h_lines, end_lines = [], []
+    peptide_header, protein_header = None, None
+    peptide_lines, protein_lines, line_is_peptide = [], [], []
 
     for line in lines:
-        line_elements = line.rstrip().split("\t")
+        stripped_line = line.rstrip()
+        line_elements = stripped_line.split("\t", 2)
 
         if line.startswith("Locus"):
-            protein_data = {key: [] for key in line_elements}
-            protein_data["protein_group"] = []
-        if line.startswith("Unique"):
-            peptide_data = {key: [] for key in line_elements}
-            peptide_data["protein_group"] = []
+            protein_header = stripped_line.split("\t")
 
         # update file state
-        if len(line_elements) > 0 and line_elements[0] == "Unique":
+        if line_elements[0] == "Unique":
+            peptide_header = stripped_line.split("\t")
             h_lines.append(line)
             file_state = FileState.DATA
 
@@ -940,47 +712,64 @@ def from_dta_select_filter_to_df(
         if file_state == FileState.HEADER:
             h_lines.append(line)
 
-        if file_state == FileState.DATA:
+        if file_state == FileState.DATA and stripped_line:
             if (
                 line_elements[0] == ""
                 or "*" in line_elements[0]
                 or line_elements[0].isnumeric()
             ):
-                for key, value in zip(peptide_data, line_elements):
-                    peptide_data[key].append(value)
-                peptide_data["protein_group"].append(current_protein_grp)
-
-                peptide_line_cnt += 1
+                peptide_lines.append(stripped_line)
+                line_is_peptide.append(True)
             else:
-                if peptide_line_cnt != 0:
-                    current_protein_grp += 1
-                    peptide_line_cnt = 0
-
-                for key, value in zip(protein_data, line_elements):
-                    protein_data[key].append(value)
-                protein_data["protein_group"].append(current_protein_grp)
+                protein_lines.append(stripped_line)
+                line_is_peptide.append(False)
 
         if file_state == FileState.INFO:
             end_lines.append(line)
 
-    for k in peptide_data:
-        peptide_data[k] = convert_to_best_datatype(peptide_data[k])
-
-    for k in protein_data:
-        protein_data[k] = convert_to_best_datatype(protein_data[k])
-
-    peptide_df = pd.DataFrame(peptide_data).convert_dtypes()
-    protein_df = pd.DataFrame(protein_data).convert_dtypes()
-
-    file_name_components = [fn.split(".") for fn in peptide_df["FileName"]]
-
-    peptide_df["file_name"] = [comp[0] for comp in file_name_components]
-    peptide_df["low_scan"] = [comp[1] for comp in file_name_components]
-    peptide_df["high_scan"] = [comp[2] for comp in file_name_components]
-    peptide_df["charge"] = [comp[3] for comp in file_name_components]
-
-    peptide_df.drop(["FileName"], axis=1, inplace=True)
-
+    if version is None:
+        raise ValueError("Cannot find the DTASelect-filter peptide header!")
+    # only the data lines are kept while the columns are decoded
+    lines = None
+
+    # a protein line after a peptide line starts the next protein group
+    line_is_peptide = np.array(line_is_peptide, dtype=bool)
+    group_starts = np.zeros(len(line_is_peptide), dtype=np.int64)
+    group_starts[1:] = ~line_is_peptide[1:] & line_is_peptide[:-1]
+    protein_groups = np.cumsum(group_starts)
+
+    peptide_schema = _version_codec(_PEPTIDE_LINE_SCHEMAS, version)
+    peptide_data = _lines_to_columns(
+        peptide_lines,
+        peptide_header,
+        peptide_schema,
+        _PEPTIDE_LINE_REQUIRED_COLUMNS.get(version),
+    )
+    peptide_lines = None
+    peptide_data["protein_group"] = protein_groups[line_is_peptide]
+
+    # FileName is file_name.low_scan.high_scan.charge, the file name can have dots
+    file_name_column = list(peptide_data)[list(peptide_schema).index("file_name")]
+    file_name_components = (
+        pd.Series(peptide_data.pop(file_name_column), dtype=object)
+        .str.rsplit(".", n=3, expand=True)
+        .reindex(columns=range(4))
+    )
+    file_names = file_name_components[0].to_numpy(dtype=object, copy=True)
+    file_names[pd.isna(file_names)] = None
+    peptide_data["file_name"] = file_names
+    for i, column in enumerate(("low_scan", "high_scan", "charge"), 1):
+        # int64, float64 when a FileName is missing or has no scans
+        peptide_data[column] = pd.to_numeric(file_name_components[i]).to_numpy()
+    file_name_components = None
+
+    protein_data = _lines_to_columns(
+        protein_lines, protein_header, _PROTEIN_LINE_SCHEMAS[version]
+    )
+    protein_data["protein_group"] = protein_groups[~line_is_peptide]
+
+    peptide_df = pd.DataFrame(peptide_data, copy=False)
+    protein_df = pd.DataFrame(protein_data, copy=False)
     return version, h_lines, peptide_df, protein_df, end_lines
 
 
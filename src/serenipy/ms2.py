@@ -1,15 +1,62 @@
+import bz2
+import json
+import lzma
+import mmap
 import multiprocessing
+import os
+import re
+import struct
+import time
+import zlib
 from dataclasses import dataclass
 from enum import Enum
-from io import TextIOWrapper, StringIO
-from queue import Empty
-from typing import Optional, Tuple, Union, List, Dict
+import io
+from io import StringIO
+from typing import IO, Callable, Iterable, Iterator, Optional, Tuple, Union, List, Dict
+
+import numpy as np
+
+from serenipy.utils import iter_text_lines, open_file, read_bytes
 
 s_line_template = "S\t{low_scan}\t{high_scan}\t{mz}\n"
 i_line_template = "I\t{keyword}\t{value}\n"
 z_line_template = "Z\t{charge}\t{mass}\n"
 peak_line_template = "{mz} {intensity}\n"
 peak_line_charged_template = "{mz} {intensity} {charge}\n"
+_peak_line_format = "{} {}\n".format
+_peak_line_charged_format = "{} {} {}\n".format
+
+# ms2 text, a path (os.PathLike, plain or compressed) or an open text/binary handle
+Ms2Input = Union[str, bytes, os.PathLike, IO]
+
+MZ_DTYPE = np.float64
+INTENSITY_DTYPE = np.float32
+CHARGE_DTYPE = np.int8
+
+# matches every line that is not a peak line (H, S, I, Z and blank lines)
+_NON_PEAK_LINE_PATTERN = re.compile(rb"^(?![0-9])[^\n]*\n?", re.M)
+_S_OR_Z_LINE_PATTERN = re.compile(rb"^[SZ]\t[^\r\n]*", re.M)
+_S_LINE_PATTERN = re.compile(rb"^S\t", re.M)
+_S_OR_I_LINE_PATTERN = re.compile(rb"^[SI]\t[^\r\n]*", re.M)
+
+MS2_SCAN_INDEX_SUFFIX = ".scan_index.npz"
+MS2_CACHE_SUFFIX = ".cache"
+MS2_PRECURSOR_INDEX_SUFFIX = ".precursor_index.npz"
+
+# mass difference between 13C and 12C, the spacing of isotope peaks at charge 1
+ISOTOPE_MASS_DIFFERENCE = 1.0033548378
+
+# cache file layout: magic, version, metadata length, json metadata, aligned arrays
+_MS2_CACHE_MAGIC = b"SPYMS2C\0"
+_MS2_CACHE_VERSION = 1
+_MS2_CACHE_PREAMBLE = struct.Struct("<8sIQ")
+_MS2_CACHE_ALIGNMENT = 64
+_MS2_CACHE_COMPRESSORS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+_MS2_CACHE_DEFAULT_LEVELS = {"zlib": 6, "bz2": 9, "lzma": 6}
 
 
 class ILineKeywords(Enum):
@@ -30,6 +77,75 @@ class ILineKeywords(Enum):
     MZ_SPECTRA_KEYWORD = "MZ_Spectra"
 
 
+# resolved once, reading an Enum member value is slow in the property getters
+_PARENT_ID_KEYWORD = ILineKeywords.PARENT_ID_KEYWORD.value
+_PRECURSOR_ID_KEYWORD = ILineKeywords.PRECURSOR_ID_KEYWORD.value
+_OOK0_KEYWORD = ILineKeywords.OOK0_KEYWORD.value
+_CCS_KEYWORD = ILineKeywords.CCS_KEYWORD.value
+_RETENTION_TIME_KEYWORD = ILineKeywords.RETENTION_TIME_KEYWORD.value
+_COLLISION_ENERGY_KEYWORD = ILineKeywords.COLLISION_ENERGY_KEYWORD.value
+_ISOLATION_MZ_KEYWORD = ILineKeywords.ISOLATION_MZ_KEYWORD.value
+_ISOLATION_WIDTH_KEYWORD = ILineKeywords.ISOLATION_WIDTH_KEYWORD.value
+_SCAN_NUMBER_BEGIN_KEYWORD = ILineKeywords.SCAN_NUMBER_BEGIN_KEYWORD.value
+_SCAN_NUMBER_END_KEYWORD = ILineKeywords.SCAN_NUMBER_END_KEYWORD.value
+_PRECURSOR_INTENSITY_KEYWORD = ILineKeywords.PRECURSOR_INTENSITY_KEYWORD.value
+
+_OOK0_SPECTRA_KEYWORD = ILineKeywords.OOK0_SPECTRA_KEYWORD.value
+_CCS_SPECTRA_KEYWORD = ILineKeywords.CCS_SPECTRA_KEYWORD.value
+_INTENSITY_SPECTRA_KEYWORD = ILineKeywords.INTENSITY_SPECTRA_KEYWORD.value
+_MZ_SPECTRA_KEYWORD = ILineKeywords.MZ_SPECTRA_KEYWORD.value
+
+_TYPED_I_LINE_KEYWORDS = {
+    _PARENT_ID_KEYWORD: int,
+    _PRECURSOR_ID_KEYWORD: int,
+    _OOK0_KEYWORD: float,
+    _CCS_KEYWORD: float,
+    _RETENTION_TIME_KEYWORD: float,
+    _COLLISION_ENERGY_KEYWORD: float,
+    _ISOLATION_MZ_KEYWORD: float,
+    _ISOLATION_WIDTH_KEYWORD: float,
+    _SCAN_NUMBER_BEGIN_KEYWORD: int,
+    _SCAN_NUMBER_END_KEYWORD: int,
+    _PRECURSOR_INTENSITY_KEYWORD: float,
+}
+
+
+def _decode_typed_info(
+    info: Dict[str, str],
+) -> Dict[str, Tuple[str, Union[int, float]]]:
+    """Convert the known I line values once, keyed by keyword with the raw value."""
+    typed_info = {}
+    for keyword in _TYPED_I_LINE_KEYWORDS.keys() & info.keys():
+        value = info[keyword]
+        if value:
+            try:
+                typed_info[keyword] = (value, _TYPED_I_LINE_KEYWORDS[keyword](value))
+            except ValueError:
+                # left undecoded, the property raises when it is accessed
+                pass
+    return typed_info
+
+
+def _decode_info_array(value: str) -> np.ndarray:
+    """Parse an I line value holding one whitespace separated number per peak."""
+    values = np.fromstring(value, dtype=np.float64, sep=" ")
+    if len(values) != len(value.split()):
+        raise ValueError(f"Invalid numeric value in I line: {value}!")
+    return values
+
+
+def _encode_info_array(values: Union[List[float], np.ndarray]) -> str:
+    return "\t".join(_format_peak_values(values))
+
+
+def _peaks_equal(
+    peaks: Union[List[float], np.ndarray], other_peaks: Union[List[float], np.ndarray]
+) -> bool:
+    if isinstance(peaks, list) and isinstance(other_peaks, list):
+        return peaks == other_peaks
+    return np.array_equal(peaks, other_peaks)
+
+
 @dataclass
 class Ms2Spectra:
     low_scan: int
@@ -38,14 +154,68 @@ class Ms2Spectra:
     mass: float
     charge: int
     info: Dict[str, str]
-    mz_spectra: List[float]
-    intensity_spectra: List[float]
-    charge_spectra: List[int]
+    mz_spectra: Union[List[float], np.ndarray]
+    intensity_spectra: Union[List[float], np.ndarray]
+    charge_spectra: Union[List[int], np.ndarray]
+
+    def __post_init__(self):
+        self._typed_info = _decode_typed_info(self.info)
+
+    def __eq__(self, other) -> bool:
+        # peaks can be numpy arrays (array_backed), those are compared by value
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (
+            self.low_scan == other.low_scan
+            and self.high_scan == other.high_scan
+            and self.mz == other.mz
+            and self.mass == other.mass
+            and self.charge == other.charge
+            and self.info == other.info
+            and _peaks_equal(self.mz_spectra, other.mz_spectra)
+            and _peaks_equal(self.intensity_spectra, other.intensity_spectra)
+            and _peaks_equal(self.charge_spectra, other.charge_spectra)
+        )
+
+    def _get_typed_info(self, keyword: str) -> Union[int, float, None]:
+        value = self.info.get(keyword)
+        if not value:
+            return None
+        # typed values are reused as long as the info entry is the same object
+        typed_value = self._typed_info.get(keyword)
+        if typed_value is None or typed_value[0] is not value:
+            typed_value = (value, _TYPED_I_LINE_KEYWORDS[keyword](value))
+            self._typed_info[keyword] = typed_value
+        return typed_value[1]
+
+    def get_info_array(
+        self, keyword: Union[str, ILineKeywords]
+    ) -> Union[np.ndarray, None]:
+        """
+        Decode a per peak I line (OOK0_Spectra, CCS_Spectra, ...) into an array, the
+        array is cached until the info entry is replaced.
+        """
+        if isinstance(keyword, ILineKeywords):
+            keyword = keyword.value
+        value = self.info.get(keyword)
+        if value is None:
+            return None
+        typed_value = self._typed_info.get(keyword)
+        if typed_value is None or typed_value[0] is not value:
+            typed_value = (value, _decode_info_array(value))
+            self._typed_info[keyword] = typed_value
+        return typed_value[1]
+
+    def set_info_array(
+        self, keyword: Union[str, ILineKeywords], values: Union[List[float], np.ndarray]
+    ) -> None:
+        if isinstance(keyword, ILineKeywords):
+            keyword = keyword.value
+        self.info[keyword] = _encode_info_array(values)
 
     @property
     def parent_id(self) -> Union[int, None]:
-        parent_id = self.info.get(ILineKeywords.PARENT_ID_KEYWORD.value)
-        return int(parent_id) if parent_id else None
+        return self._get_typed_info(_PARENT_ID_KEYWORD)
 
     @parent_id.setter
     def parent_id(self, parent_id: Union[str, int]):
@@ -53,8 +223,7 @@ class Ms2Spectra:
 
     @property
     def precursor_id(self) -> Union[int, None]:
-        precursor_id = self.info.get(ILineKeywords.PRECURSOR_ID_KEYWORD.value)
-        return int(precursor_id) if precursor_id else None
+        return self._get_typed_info(_PRECURSOR_ID_KEYWORD)
 
     @precursor_id.setter
     def precursor_id(self, precursor_id: Union[str, int]):
@@ -62,8 +231,7 @@ class Ms2Spectra:
 
     @property
     def ook0(self) -> Union[float, None]:
-        ook0 = self.info.get(ILineKeywords.OOK0_KEYWORD.value)
-        return float(ook0) if ook0 else None
+        return self._get_typed_info(_OOK0_KEYWORD)
 
     @ook0.setter
     def ook0(self, ook0: Union[str, float]):
@@ -71,8 +239,7 @@ class Ms2Spectra:
 
     @property
     def ccs(self) -> Union[float, None]:
-        ccs = self.info.get(ILineKeywords.CCS_KEYWORD.value)
-        return float(ccs) if ccs else None
+        return self._get_typed_info(_CCS_KEYWORD)
 
     @ccs.setter
     def ccs(self, ccs: Union[str, float]):
@@ -80,8 +247,7 @@ class Ms2Spectra:
 
     @property
     def rt(self) -> Union[float, None]:
-        rt = self.info.get(ILineKeywords.RETENTION_TIME_KEYWORD.value)
-        return float(rt) if rt else None
+        return self._get_typed_info(_RETENTION_TIME_KEYWORD)
 
     @rt.setter
     def rt(self, rt: Union[str, float]):
@@ -89,8 +255,7 @@ class Ms2Spectra:
 
     @property
     def ce(self) -> Union[float, None]:
-        ce = self.info.get(ILineKeywords.COLLISION_ENERGY_KEYWORD.value)
-        return float(ce) if ce else None
+        return self._get_typed_info(_COLLISION_ENERGY_KEYWORD)
 
     @ce.setter
     def ce(self, ce: Union[str, float]):
@@ -98,8 +263,7 @@ class Ms2Spectra:
 
     @property
     def iso_mz(self) -> Union[float, None]:
-        iso_mz = self.info.get(ILineKeywords.ISOLATION_MZ_KEYWORD.value)
-        return float(iso_mz) if iso_mz else None
+        return self._get_typed_info(_ISOLATION_MZ_KEYWORD)
 
     @iso_mz.setter
     def iso_mz(self, iso_mz: Union[str, float]):
@@ -107,8 +271,7 @@ class Ms2Spectra:
 
     @property
     def iso_width(self) -> Union[float, None]:
-        iso_width = self.info.get(ILineKeywords.ISOLATION_WIDTH_KEYWORD.value)
-        return float(iso_width) if iso_width else None
+        return self._get_typed_info(_ISOLATION_WIDTH_KEYWORD)
 
     @iso_width.setter
     def iso_width(self, iso_width: Union[str, float]):
@@ -116,8 +279,7 @@ class Ms2Spectra:
 
     @property
     def scan_begin(self) -> Union[int, None]:
-        scan_begin = self.info.get(ILineKeywords.SCAN_NUMBER_BEGIN_KEYWORD.value)
-        return int(scan_begin) if scan_begin else None
+        return self._get_typed_info(_SCAN_NUMBER_BEGIN_KEYWORD)
 
     @scan_begin.setter
     def scan_begin(self, scan_begin: Union[str, int]):
@@ -125,8 +287,7 @@ class Ms2Spectra:
 
     @property
     def scan_end(self) -> Union[int, None]:
-        scan_end = self.info.get(ILineKeywords.SCAN_NUMBER_END_KEYWORD.value)
-        return int(scan_end) if scan_end else None
+        return self._get_typed_info(_SCAN_NUMBER_END_KEYWORD)
 
     @scan_end.setter
     def scan_end(self, scan_end: Union[str, int]):
@@ -134,13 +295,44 @@ class Ms2Spectra:
 
     @property
     def prec_intensity(self) -> Union[float, None]:
-        prec_intensity = self.info.get(ILineKeywords.PRECURSOR_INTENSITY_KEYWORD.value)
-        return float(prec_intensity) if prec_intensity else None
+        return self._get_typed_info(_PRECURSOR_INTENSITY_KEYWORD)
 
     @prec_intensity.setter
     def prec_intensity(self, prec_intensity: Union[str, float]):
         self.info[ILineKeywords.PRECURSOR_INTENSITY_KEYWORD.value] = prec_intensity
 
+    @property
+    def ook0_spectra(self) -> Union[np.ndarray, None]:
+        return self.get_info_array(_OOK0_SPECTRA_KEYWORD)
+
+    @ook0_spectra.setter
+    def ook0_spectra(self, ook0_spectra: Union[List[float], np.ndarray]):
+        self.set_info_array(_OOK0_SPECTRA_KEYWORD, ook0_spectra)
+
+    @property
+    def ccs_spectra(self) -> Union[np.ndarray, None]:
+        return self.get_info_array(_CCS_SPECTRA_KEYWORD)
+
+    @ccs_spectra.setter
+    def ccs_spectra(self, ccs_spectra: Union[List[float], np.ndarray]):
+        self.set_info_array(_CCS_SPECTRA_KEYWORD, ccs_spectra)
+
+    @property
+    def info_intensity_spectra(self) -> Union[np.ndarray, None]:
+        return self.get_info_array(_INTENSITY_SPECTRA_KEYWORD)
+
+    @info_intensity_spectra.setter
+    def info_intensity_spectra(self, intensity_spectra: Union[List[float], np.ndarray]):
+        self.set_info_array(_INTENSITY_SPECTRA_KEYWORD, intensity_spectra)
+
+    @property
+    def info_mz_spectra(self) -> Union[np.ndarray, None]:
+        return self.get_info_array(_MZ_SPECTRA_KEYWORD)
+
+    @info_mz_spectra.setter
+    def info_mz_spectra(self, mz_spectra: Union[List[float], np.ndarray]):
+        self.set_info_array(_MZ_SPECTRA_KEYWORD, mz_spectra)
+
     def serialize(
         self,
         mz_precision: Optional[float] = None,
@@ -155,6 +347,398 @@ class Ms2Spectra:
         return _deserialize_ms2_spectra(line)
 
 
+class LazyMs2Spectra(Ms2Spectra):
+    """
+    Ms2Spectra for which only the S, I and Z lines are parsed up front. The peak
+    block stays a byte range of the source buffer and mz_spectra, intensity_spectra
+    and charge_spectra are decoded the first time one of them is accessed.
+    """
+
+    def __init__(
+        self,
+        low_scan: int,
+        high_scan: int,
+        mz: float,
+        mass: float,
+        charge: int,
+        info: Dict[str, str],
+        peak_source,
+        peak_start: int,
+        peak_end: int,
+        array_backed=False,
+    ):
+        self.low_scan = low_scan
+        self.high_scan = high_scan
+        self.mz = mz
+        self.mass = mass
+        self.charge = charge
+        self.info = info
+        self._typed_info = _decode_typed_info(info)
+        self._peak_source = peak_source
+        self._peak_start = peak_start
+        self._peak_end = peak_end
+        self._array_backed = array_backed
+
+    def __getattr__(self, name: str):
+        if name in ("mz_spectra", "intensity_spectra", "charge_spectra"):
+            self._decode_peaks()
+            return self.__dict__[name]
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+    @property
+    def is_decoded(self) -> bool:
+        return "mz_spectra" in self.__dict__
+
+    def _decode_peaks(self) -> None:
+        peak_block = self._peak_source[self._peak_start : self._peak_end].rstrip()
+        peaks = _parse_peak_block(
+            peak_block, _count_lines(peak_block, 0, len(peak_block))
+        )
+        if self._array_backed:
+            mz_spectra, intensity_spectra, charge_spectra = _peak_arrays(peaks)
+        else:
+            mz_spectra = peaks[:, 0].tolist()
+            intensity_spectra = peaks[:, 1].tolist()
+            charge_spectra = peaks[:, 2].tolist() if peaks.shape[1] == 3 else []
+
+        self.mz_spectra = mz_spectra
+        self.intensity_spectra = intensity_spectra
+        self.charge_spectra = charge_spectra
+        self._peak_source = None
+
+
+@dataclass
+class Ms2SpectraArrays:
+    """
+    Columnar collection of ms2 spectra. The peaks of all spectra are stored in flat
+    arrays, the peaks of spectrum k are mz_spectra[offsets[k]:offsets[k + 1]].
+    """
+
+    low_scan: np.ndarray
+    high_scan: np.ndarray
+    mz: np.ndarray
+    mass: np.ndarray
+    charge: np.ndarray
+    info: List[Dict[str, str]]
+    mz_spectra: np.ndarray
+    intensity_spectra: np.ndarray
+    charge_spectra: np.ndarray
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.low_scan)
+
+    def __getitem__(self, index: int) -> Ms2Spectra:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Spectra index out of range: {index}!")
+
+        mass = self.mass[index]
+        mz_spectra, intensity_spectra, charge_spectra = self.get_peaks(index)
+        return Ms2Spectra(
+            low_scan=int(self.low_scan[index]),
+            high_scan=int(self.high_scan[index]),
+            mz=float(self.mz[index]),
+            mass=None if np.isnan(mass) else float(mass),
+            charge=None if np.isnan(mass) else int(self.charge[index]),
+            info=self.info[index],
+            mz_spectra=mz_spectra,
+            intensity_spectra=intensity_spectra,
+            charge_spectra=charge_spectra,
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def peak_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def rt(self) -> np.ndarray:
+        return self.get_info_column(ILineKeywords.RETENTION_TIME_KEYWORD)
+
+    @property
+    def ook0(self) -> np.ndarray:
+        return self.get_info_column(ILineKeywords.OOK0_KEYWORD)
+
+    @property
+    def ccs(self) -> np.ndarray:
+        return self.get_info_column(ILineKeywords.CCS_KEYWORD)
+
+    def get_info_column(
+        self, keyword: Union[str, ILineKeywords], dtype=np.float64
+    ) -> np.ndarray:
+        return _info_column(self.info, keyword, dtype)
+
+    def get_info_arrays(
+        self, keyword: Union[str, ILineKeywords]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return _info_arrays(self.info, keyword)
+
+    def to_df(self, nested_peaks=False):
+        return _ms2_spectra_arrays_to_df(self, nested_peaks)
+
+    @property
+    def peak_spectra_index(self) -> np.ndarray:
+        """Position of the spectrum every peak belongs to."""
+        return np.repeat(np.arange(len(self)), self.peak_counts)
+
+    def select_peaks(self, keep: np.ndarray) -> "Ms2SpectraArrays":
+        """New Ms2SpectraArrays with only the peaks where keep is True."""
+        kept_before = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept_before[1:])
+        return Ms2SpectraArrays(
+            low_scan=self.low_scan,
+            high_scan=self.high_scan,
+            mz=self.mz,
+            mass=self.mass,
+            charge=self.charge,
+            info=self.info,
+            mz_spectra=self.mz_spectra[keep],
+            intensity_spectra=self.intensity_spectra[keep],
+            charge_spectra=(
+                self.charge_spectra[keep]
+                if len(self.charge_spectra) > 0
+                else self.charge_spectra
+            ),
+            offsets=kept_before[self.offsets],
+        )
+
+    @staticmethod
+    def from_spectra(ms2_spectras: List[Ms2Spectra]) -> "Ms2SpectraArrays":
+        has_charge = [
+            len(spectra.charge_spectra) > 0
+            for spectra in ms2_spectras
+            if len(spectra.mz_spectra) > 0
+        ]
+        if any(has_charge) and not all(has_charge):
+            raise ValueError("Cannot combine spectra with and without peak charges!")
+
+        offsets = np.zeros(len(ms2_spectras) + 1, dtype=np.int64)
+        np.cumsum([len(s.mz_spectra) for s in ms2_spectras], out=offsets[1:])
+
+        def _concat_peaks(peaks, dtype):
+            peaks = [np.asarray(p, dtype=dtype) for p in peaks if len(p) > 0]
+            return np.concatenate(peaks) if peaks else np.empty(0, dtype=dtype)
+
+        return Ms2SpectraArrays(
+            low_scan=np.array([s.low_scan for s in ms2_spectras], dtype=np.int64),
+            high_scan=np.array([s.high_scan for s in ms2_spectras], dtype=np.int64),
+            mz=np.array([s.mz for s in ms2_spectras], dtype=np.float64),
+            mass=np.array(
+                [np.nan if s.mass is None else s.mass for s in ms2_spectras],
+                dtype=np.float64,
+            ),
+            charge=np.array([s.charge or 0 for s in ms2_spectras], dtype=np.int64),
+            info=[s.info for s in ms2_spectras],
+            mz_spectra=_concat_peaks([s.mz_spectra for s in ms2_spectras], MZ_DTYPE),
+            intensity_spectra=_concat_peaks(
+                [s.intensity_spectra for s in ms2_spectras], INTENSITY_DTYPE
+            ),
+            charge_spectra=_concat_peaks(
+                [s.charge_spectra for s in ms2_spectras], CHARGE_DTYPE
+            ),
+            offsets=offsets,
+        )
+
+    @staticmethod
+    def concat(spectra_arrays: List["Ms2SpectraArrays"]) -> "Ms2SpectraArrays":
+        if not spectra_arrays:
+            raise ValueError("Cannot concatenate an empty list of Ms2SpectraArrays!")
+
+        with_peaks = [arrays for arrays in spectra_arrays if len(arrays.mz_spectra) > 0]
+        has_charge = [len(arrays.charge_spectra) > 0 for arrays in with_peaks]
+        if any(has_charge) and not all(has_charge):
+            raise ValueError(
+                "Cannot concatenate spectra with and without peak charges!"
+            )
+
+        offsets = [np.zeros(1, dtype=np.int64)]
+        peak_count = 0
+        for arrays in spectra_arrays:
+            offsets.append(arrays.offsets[1:] + peak_count)
+            peak_count += arrays.offsets[-1]
+
+        return Ms2SpectraArrays(
+            low_scan=np.concatenate([arrays.low_scan for arrays in spectra_arrays]),
+            high_scan=np.concatenate([arrays.high_scan for arrays in spectra_arrays]),
+            mz=np.concatenate([arrays.mz for arrays in spectra_arrays]),
+            mass=np.concatenate([arrays.mass for arrays in spectra_arrays]),
+            charge=np.concatenate([arrays.charge for arrays in spectra_arrays]),
+            info=[info for arrays in spectra_arrays for info in arrays.info],
+            mz_spectra=np.concatenate([arrays.mz_spectra for arrays in spectra_arrays]),
+            intensity_spectra=np.concatenate(
+                [arrays.intensity_spectra for arrays in spectra_arrays]
+            ),
+            charge_spectra=np.concatenate(
+                [arrays.charge_spectra for arrays in spectra_arrays]
+            ),
+            offsets=np.concatenate(offsets),
+        )
+
+    def get_peaks(self, index: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        charge_spectra = (
+            self.charge_spectra[start:end]
+            if len(self.charge_spectra) > 0
+            else self.charge_spectra
+        )
+        return (
+            self.mz_spectra[start:end],
+            self.intensity_spectra[start:end],
+            charge_spectra,
+        )
+
+
+def _info_column(
+    infos: List[Dict[str, str]], keyword: Union[str, ILineKeywords], dtype=np.float64
+) -> np.ndarray:
+    if isinstance(keyword, ILineKeywords):
+        keyword = keyword.value
+    # numpy parses the strings itself, missing and empty values become nan
+    return np.array([info.get(keyword) or "nan" for info in infos], dtype=dtype)
+
+
+def get_info_column(
+    ms2_spectras: Union[Ms2SpectraArrays, Iterable[Ms2Spectra]],
+    keyword: Union[str, ILineKeywords],
+    dtype=np.float64,
+) -> np.ndarray:
+    """
+    Values of one I line keyword for a collection of spectra, nan where a spectrum
+    does not have the keyword.
+    """
+    if isinstance(ms2_spectras, Ms2SpectraArrays):
+        return ms2_spectras.get_info_column(keyword, dtype)
+    if isinstance(keyword, ILineKeywords):
+        keyword = keyword.value
+    if keyword not in _TYPED_I_LINE_KEYWORDS:
+        return _info_column([spectra.info for spectra in ms2_spectras], keyword, dtype)
+
+    # known keywords reuse the values the spectra already converted
+    values = [spectra._get_typed_info(keyword) for spectra in ms2_spectras]
+    return np.array([np.nan if value is None else value for value in values], dtype)
+
+
+def _info_arrays(
+    infos: List[Dict[str, str]], keyword: Union[str, ILineKeywords]
+) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(keyword, ILineKeywords):
+        keyword = keyword.value
+
+    values = [info.get(keyword) or "" for info in infos]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value.split()) for value in values], out=offsets[1:])
+
+    # all spectra are parsed with one numpy call, like the peak lines
+    flat_values = np.fromstring(" ".join(values), dtype=np.float64, sep=" ")
+    if len(flat_values) != offsets[-1]:
+        raise ValueError(f"Invalid numeric value in {keyword} I line!")
+    return flat_values, offsets
+
+
+def get_info_arrays(
+    ms2_spectras: Union[Ms2SpectraArrays, Iterable[Ms2Spectra]],
+    keyword: Union[str, ILineKeywords],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a per peak I line for a collection of spectra. The values of spectrum k
+    are values[offsets[k]:offsets[k + 1]], spectra without the keyword are empty.
+    """
+    if isinstance(ms2_spectras, Ms2SpectraArrays):
+        return ms2_spectras.get_info_arrays(keyword)
+    return _info_arrays([spectra.info for spectra in ms2_spectras], keyword)
+
+
+_PER_PEAK_I_LINE_KEYWORDS = (
+    _OOK0_SPECTRA_KEYWORD,
+    _CCS_SPECTRA_KEYWORD,
+    _INTENSITY_SPECTRA_KEYWORD,
+    _MZ_SPECTRA_KEYWORD,
+)
+
+
+def _arrow_list_column(values: np.ndarray, offsets: np.ndarray):
+    import pandas as pd
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("pyarrow is required for nested peak columns!")
+
+    return pd.arrays.ArrowExtensionArray(
+        pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(values))
+    )
+
+
+def _ms2_spectra_arrays_to_df(spectra_arrays: Ms2SpectraArrays, nested_peaks=False):
+    """
+    Build a spectrum table with the S, Z and I line values (one column per I line
+    keyword) and a peak table with one row per peak keyed by low_scan. With
+    nested_peaks the peaks are list columns of the spectrum table instead.
+    """
+    import pandas as pd
+
+    spectra_data = {
+        "low_scan": spectra_arrays.low_scan,
+        "high_scan": spectra_arrays.high_scan,
+        "mz": spectra_arrays.mz,
+        "mass": spectra_arrays.mass,
+        "charge": spectra_arrays.charge,
+    }
+    peak_counts = spectra_arrays.peak_counts
+    peak_data = {
+        "low_scan": np.repeat(spectra_arrays.low_scan, peak_counts),
+        "mz": spectra_arrays.mz_spectra,
+        "intensity": spectra_arrays.intensity_spectra,
+    }
+    if len(spectra_arrays.charge_spectra) > 0:
+        peak_data["charge"] = spectra_arrays.charge_spectra
+
+    keywords = dict.fromkeys(k for info in spectra_arrays.info for k in info)
+    for keyword in keywords:
+        converter = _TYPED_I_LINE_KEYWORDS.get(keyword)
+        if converter is not None:
+            column = _info_column(spectra_arrays.info, keyword)
+            if converter is int and not np.isnan(column).any():
+                column = column.astype(np.int64)
+            spectra_data[keyword] = column
+            continue
+
+        if keyword in _PER_PEAK_I_LINE_KEYWORDS:
+            # only split into peak values when there is one value for every peak
+            values, offsets = _info_arrays(spectra_arrays.info, keyword)
+            if np.array_equal(offsets, spectra_arrays.offsets):
+                if nested_peaks:
+                    spectra_data[keyword] = _arrow_list_column(values, offsets)
+                else:
+                    peak_data[keyword] = values
+                continue
+
+        spectra_data[keyword] = [info.get(keyword) for info in spectra_arrays.info]
+
+    if nested_peaks:
+        offsets = spectra_arrays.offsets
+        spectra_data["mz_spectra"] = _arrow_list_column(
+            spectra_arrays.mz_spectra, offsets
+        )
+        spectra_data["intensity_spectra"] = _arrow_list_column(
+            spectra_arrays.intensity_spectra, offsets
+        )
+        if len(spectra_arrays.charge_spectra) > 0:
+            spectra_data["charge_spectra"] = _arrow_list_column(
+                spectra_arrays.charge_spectra, offsets
+            )
+        return pd.DataFrame(spectra_data), None
+
+    return pd.DataFrame(spectra_data), pd.DataFrame(peak_data, copy=False)
+
+
 def _serialize_ms2_spectra(
     ms2_spectra: Ms2Spectra,
     mz_precision: Optional[float] = None,
@@ -171,37 +755,87 @@ def _serialize_ms2_spectra(
     ]
     z_line = z_line_template.format(charge=ms2_spectra.charge, mass=ms2_spectra.mass)
 
-    if ms2_spectra.charge_spectra:
-        peak_lines = [
-            peak_line_charged_template.format(
-                mz=m if mz_precision is None else round(m, mz_precision),
-                intensity=(
-                    i if intensity_precision is None else round(i, intensity_precision)
-                ),
-                charge=int(c),
-            )
-            for m, i, c in zip(
-                ms2_spectra.mz_spectra,
-                ms2_spectra.intensity_spectra,
-                ms2_spectra.charge_spectra,
-            )
-        ]
-    else:
-        peak_lines = [
-            peak_line_template.format(
-                mz=m if mz_precision is None else round(m, mz_precision),
-                intensity=(
-                    i if intensity_precision is None else round(i, intensity_precision)
-                ),
-            )
-            for m, i in zip(ms2_spectra.mz_spectra, ms2_spectra.intensity_spectra)
-        ]
+    peak_lines = _serialize_peaks(
+        ms2_spectra.mz_spectra,
+        ms2_spectra.intensity_spectra,
+        ms2_spectra.charge_spectra,
+        mz_precision=mz_precision,
+        intensity_precision=intensity_precision,
+    )
+
+    return "".join([s_line] + i_lines + [z_line, peak_lines])
+
+
+def _format_peak_values(
+    values: Union[List[float], np.ndarray], precision: Optional[int] = None
+) -> List[str]:
+    if isinstance(values, np.ndarray):
+        if precision is not None:
+            # np.round scales before rounding and can disagree with round() on ties
+            values = values.tolist()
+        elif values.dtype == np.float64:
+            # str of a python float is the same as str of a np.float64, but faster
+            return list(map(str, values.tolist()))
+        else:
+            return values.astype(str).tolist()
+
+    if precision is not None:
+        values = [round(value, precision) for value in values]
+    return list(map(str, values))
+
 
-    return "".join([s_line] + i_lines + [z_line] + peak_lines)
+def _format_peak_charges(values: Union[List[int], np.ndarray]) -> List[str]:
+    if isinstance(values, np.ndarray):
+        return list(map(str, values.astype(np.int64).tolist()))
+    return [str(int(value)) for value in values]
+
+
+def _serialize_peaks(
+    mz_spectra: Union[List[float], np.ndarray],
+    intensity_spectra: Union[List[float], np.ndarray],
+    charge_spectra: Union[List[int], np.ndarray],
+    mz_precision: Optional[int] = None,
+    intensity_precision: Optional[int] = None,
+) -> str:
+    """Format a whole peak block at once, column by column."""
+    mz_strs = _format_peak_values(mz_spectra, mz_precision)
+    intensity_strs = _format_peak_values(intensity_spectra, intensity_precision)
+
+    if len(charge_spectra) > 0:
+        charge_strs = _format_peak_charges(charge_spectra)
+        return "".join(
+            map(_peak_line_charged_format, mz_strs, intensity_strs, charge_strs)
+        )
+    return "".join(map(_peak_line_format, mz_strs, intensity_strs))
+
+
+def _parse_peak_block(peak_text: Union[str, bytes], n_peaks: int) -> np.ndarray:
+    """Parse whitespace separated peak lines into a (n_peaks, n_columns) array."""
+    if n_peaks == 0:
+        return np.empty((0, 2), dtype=np.float64)
+
+    values = np.fromstring(peak_text, dtype=np.float64, sep=" ")
+    n_columns, remainder = divmod(values.size, n_peaks)
+    if remainder != 0 or n_columns not in (2, 3):
+        raise ValueError("Inconsistent number of columns in peak lines!")
+
+    return values.reshape(n_peaks, n_columns)
+
+
+def _peak_arrays(
+    peaks: np.ndarray, intensity_dtype=INTENSITY_DTYPE
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    mz_spectra = np.ascontiguousarray(peaks[:, 0], dtype=MZ_DTYPE)
+    intensity_spectra = np.ascontiguousarray(peaks[:, 1], dtype=intensity_dtype)
+    if peaks.shape[1] == 3:
+        charge_spectra = np.ascontiguousarray(peaks[:, 2], dtype=CHARGE_DTYPE)
+    else:
+        charge_spectra = np.empty(0, dtype=CHARGE_DTYPE)
+    return mz_spectra, intensity_spectra, charge_spectra
 
 
 def _deserialize_ms2_spectra(
-    spectra_str: Union[str, List[str]], include_spectra=True
+    spectra_str: Union[str, List[str]], include_spectra=True, array_backed=False
 ) -> Ms2Spectra:
     if isinstance(spectra_str, str):
         lines = spectra_str.split("\n")
@@ -212,6 +846,7 @@ def _deserialize_ms2_spectra(
 
     low_scan, high_scan, mz, mass, charge = None, None, None, None, None
     info, mz_spectra, intensity_spectra, charge_spectra = {}, [], [], []
+    peak_lines = []
 
     for line in lines:
         if line.startswith("S"):
@@ -226,13 +861,20 @@ def _deserialize_ms2_spectra(
         elif line.startswith("I"):
             line_elems = line.strip().split("\t")
             info[line_elems[1]] = "\t".join(line_elems[2:])
-        elif line[0].isnumeric() and include_spectra:
+        elif line[:1].isnumeric() and include_spectra:
+            if array_backed:
+                peak_lines.append(line)
+                continue
             line_elems = line.strip().split(" ")
             mz_spectra.append(float(line_elems[0]))
             intensity_spectra.append(float(line_elems[1]))
             if len(line_elems) == 3:
                 charge_spectra.append(float(line_elems[2]))
 
+    if array_backed:
+        peaks = _parse_peak_block("\n".join(peak_lines), len(peak_lines))
+        mz_spectra, intensity_spectra, charge_spectra = _peak_arrays(peaks)
+
     return Ms2Spectra(
         low_scan=low_scan,
         high_scan=high_scan,
@@ -246,31 +888,169 @@ def _deserialize_ms2_spectra(
     )
 
 
-def ms2_spectra_consumer(queue: multiprocessing.Queue, return_dict: Dict):
-    print("Consumer: Running", flush=True)
-    # consume work
-    while True:
-        try:
-            tmp_spectra_lines = queue.get(timeout=1)
-        except Empty:
-            break
-        ms2_spectra = _deserialize_ms2_spectra(tmp_spectra_lines)
-        return_dict[ms2_spectra.low_scan] = ms2_spectra
+def _count_lines(data: bytes, start: int, end: int) -> int:
+    n_lines = data.count(b"\n", start, end)
+    if end > start and data[end - 1 : end] != b"\n":
+        n_lines += 1
+    return n_lines
 
-    print("Consumer: Stopping")
 
+def _parse_ms2_bytes(
+    data: bytes, include_spectra=True, intensity_dtype=INTENSITY_DTYPE
+) -> Tuple[List[str], Ms2SpectraArrays]:
+    """
+    Parse ms2 file contents in a single pass. Only the S, I, Z and H lines are
+    handled in python, the peak lines of all spectra are parsed with one numpy call.
+    """
+    view = memoryview(data)
 
-def get_header(ms2_input: Union[str, TextIOWrapper, StringIO]):
-    if type(ms2_input) is str:
-        lines = ms2_input.split("\n")
-    elif type(ms2_input) is TextIOWrapper or type(ms2_input) is StringIO:
-        lines = ms2_input
-    else:
-        raise ValueError(f"Unsupported input type: {type(ms2_input)}!")
+    header_lines = []
+    low_scans, high_scans, mzs, masses, charges, infos = [], [], [], [], [], []
+    peak_parts, peak_counts = [], []
+
+    prev_end = 0
+    for match in _NON_PEAK_LINE_PATTERN.finditer(data):
+        start, end = match.span()
+        if start > prev_end and low_scans and include_spectra:
+            peak_parts.append(view[prev_end:start])
+            peak_counts[-1] += _count_lines(data, prev_end, start)
+        prev_end = end
+
+        line = match.group().decode()
+        if line.startswith("H"):
+            header_lines.append(line.rstrip("\r\n"))
+            continue
+
+        line = line.strip()
+        if line.startswith("S"):
+            line_elems = line.split("\t")
+            low_scans.append(int(line_elems[1]))
+            high_scans.append(int(line_elems[2]))
+            mzs.append(float(line_elems[3]))
+            masses.append(np.nan)
+            charges.append(0)
+            infos.append({})
+            peak_counts.append(0)
+        elif line.startswith("Z") and low_scans:
+            line_elems = line.split("\t")
+            charges[-1] = int(line_elems[1])
+            masses[-1] = float(line_elems[2])
+        elif line.startswith("I") and low_scans:
+            line_elems = line.split("\t")
+            infos[-1][line_elems[1]] = "\t".join(line_elems[2:])
+
+    if len(data) > prev_end and low_scans and include_spectra:
+        peak_parts.append(view[prev_end:])
+        peak_counts[-1] += _count_lines(data, prev_end, len(data))
+
+    peaks = _parse_peak_block(b"".join(peak_parts), sum(peak_counts))
+    mz_spectra, intensity_spectra, charge_spectra = _peak_arrays(peaks, intensity_dtype)
+
+    offsets = np.zeros(len(low_scans) + 1, dtype=np.int64)
+    np.cumsum(peak_counts, out=offsets[1:])
+
+    return header_lines, Ms2SpectraArrays(
+        low_scan=np.array(low_scans, dtype=np.int64),
+        high_scan=np.array(high_scans, dtype=np.int64),
+        mz=np.array(mzs, dtype=np.float64),
+        mass=np.array(masses, dtype=np.float64),
+        charge=np.array(charges, dtype=np.int64),
+        info=infos,
+        mz_spectra=mz_spectra,
+        intensity_spectra=intensity_spectra,
+        charge_spectra=charge_spectra,
+        offsets=offsets,
+    )
+
+
+def _deserialize_lazy_ms2_spectra(
+    source, start: int, end: int, array_backed=False
+) -> LazyMs2Spectra:
+    low_scan, high_scan, mz, mass, charge = None, None, None, None, None
+    info = {}
+
+    position = start
+    while position < end and not source[position : position + 1].isdigit():
+        line_end = source.find(b"\n", position, end)
+        if line_end == -1:
+            line_end = end
+
+        line = source[position:line_end].decode().strip()
+        if line.startswith("S"):
+            line_elems = line.split("\t")
+            low_scan = int(line_elems[1])
+            high_scan = int(line_elems[2])
+            mz = float(line_elems[3])
+        elif line.startswith("Z"):
+            line_elems = line.split("\t")
+            charge = int(line_elems[1])
+            mass = float(line_elems[2])
+        elif line.startswith("I"):
+            line_elems = line.split("\t")
+            info[line_elems[1]] = "\t".join(line_elems[2:])
+
+        position = line_end + 1
+
+    return LazyMs2Spectra(
+        low_scan=low_scan,
+        high_scan=high_scan,
+        mz=mz,
+        mass=mass,
+        charge=charge,
+        info=info,
+        peak_source=source,
+        peak_start=min(position, end),
+        peak_end=end,
+        array_backed=array_backed,
+    )
+
+
+def _split_ms2_bytes(data: bytes, n_chunks: int) -> List[Tuple[int, int]]:
+    """Split ms2 file contents into byte ranges that start at S line boundaries."""
+    chunk_size = max(len(data) // max(n_chunks, 1), 1)
+
+    ranges = []
+    start = 0
+    while start < len(data):
+        end = data.find(b"\nS\t", start + chunk_size)
+        end = len(data) if end == -1 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _parse_ms2_chunk(
+    args: Tuple[bytes, bool, type],
+) -> Tuple[List[str], Ms2SpectraArrays]:
+    chunk, include_spectra, intensity_dtype = args
+    return _parse_ms2_bytes(chunk, include_spectra, intensity_dtype)
 
+
+def _parse_ms2_bytes_parallel(
+    data: bytes, processes: int, include_spectra=True, intensity_dtype=INTENSITY_DTYPE
+) -> Tuple[List[str], Ms2SpectraArrays]:
+    ranges = _split_ms2_bytes(data, processes * 4)
+    if len(ranges) <= 1:
+        # nothing to split (empty input or a single chunk)
+        return _parse_ms2_bytes(data, include_spectra, intensity_dtype)
+
+    chunks = [
+        (data[start:end], include_spectra, intensity_dtype) for start, end in ranges
+    ]
+
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(_parse_ms2_chunk, chunks)
+
+    header_lines = [
+        line for chunk_header_lines, _ in results for line in chunk_header_lines
+    ]
+    return header_lines, Ms2SpectraArrays.concat([arrays for _, arrays in results])
+
+
+def get_header(ms2_input: Ms2Input):
     header_lines = []
 
-    for line in lines:
+    for line in iter_text_lines(ms2_input):
         if line.startswith("H"):
             header_lines.append(line)
         else:
@@ -279,49 +1059,94 @@ def get_header(ms2_input: Union[str, TextIOWrapper, StringIO]):
     return header_lines
 
 
-def get_spectra(ms2_input: Union[str, TextIOWrapper, StringIO], include_spectra=True):
-    if type(ms2_input) is str:
-        lines = ms2_input.split("\n")
-    elif type(ms2_input) is TextIOWrapper or type(ms2_input) is StringIO:
-        lines = ms2_input
-    else:
-        raise ValueError(f"Unsupported input type: {type(ms2_input)}!")
+def get_spectra(
+    ms2_input: Ms2Input,
+    include_spectra=True,
+    array_backed=False,
+    follow=False,
+    poll_interval: float = 1.0,
+    idle_timeout: Optional[float] = None,
+):
+    """
+    Yield the spectra of the ms2 input one at a time. With follow the input is the
+    path of a file that is still being written (see Ms2Follower), new spectra are
+    yielded as they are completed until the file stops growing for idle_timeout.
+    array_backed spectra have float32 intensities (see from_ms2).
+    """
+    if follow:
+        with Ms2Follower(ms2_input, include_spectra, array_backed) as follower:
+            yield from follower.follow(poll_interval, idle_timeout)
+        return
 
     tmp_spectra_lines = []
 
-    for line in lines:
+    for line in iter_text_lines(ms2_input):
 
         if line.startswith("H"):
             continue
 
         elif line.startswith("S"):
             if tmp_spectra_lines:
-                spectra = _deserialize_ms2_spectra(tmp_spectra_lines, include_spectra)
+                spectra = _deserialize_ms2_spectra(
+                    tmp_spectra_lines, include_spectra, array_backed
+                )
                 yield spectra
                 tmp_spectra_lines = []
 
         if line:
             tmp_spectra_lines.append(line)
 
-    spectra = _deserialize_ms2_spectra(tmp_spectra_lines, include_spectra)
+    spectra = _deserialize_ms2_spectra(tmp_spectra_lines, include_spectra, array_backed)
     yield spectra
 
 
+def get_lazy_spectra(ms2_input: Ms2Input, array_backed=False):
+    data = read_bytes(ms2_input)
+    starts = [match.start() for match in _S_LINE_PATTERN.finditer(data)]
+    for start, end in zip(starts, starts[1:] + [len(data)]):
+        yield _deserialize_lazy_ms2_spectra(data, start, end, array_backed)
+
+
 def from_ms2(
-    ms2_input: Union[str, TextIOWrapper, StringIO], include_spectra=True
+    ms2_input: Ms2Input,
+    include_spectra=True,
+    array_backed=False,
+    processes=1,
 ) -> Tuple[List[str], List[Ms2Spectra]]:
-    if type(ms2_input) is str:
-        lines = ms2_input.split("\n")
-    elif type(ms2_input) is TextIOWrapper or type(ms2_input) is StringIO:
-        lines = ms2_input
-    else:
-        raise ValueError(f"Unsupported input type: {type(ms2_input)}!")
+    """
+    Header lines and spectra of the ms2 input. With array_backed the peaks are numpy
+    arrays and intensities are stored as float32 (INTENSITY_DTYPE), about 7
+    significant digits: serialize with intensity_precision 4 or more can write
+    a different value than the file had (12345.678 is written as 12345.6777).
+    """
+    if processes > 1 and not array_backed:
+        data = read_bytes(ms2_input)
+        if len(_split_ms2_bytes(data, processes * 4)) <= 1:
+            # a single chunk (or empty input) goes to the line parser, like processes=1
+            if not isinstance(ms2_input, (str, bytes)):
+                data = io.StringIO(data.decode())
+            return from_ms2(data, include_spectra)
+        ms2_input = data if isinstance(ms2_input, (str, bytes)) else io.BytesIO(data)
+
+    if array_backed or processes > 1:
+        # list backed spectra keep float64 intensities to match the line parser
+        header_lines, spectra_arrays = _from_ms2_arrays(
+            ms2_input,
+            include_spectra,
+            processes,
+            INTENSITY_DTYPE if array_backed else np.float64,
+        )
+        if not isinstance(ms2_input, (str, bytes)):
+            header_lines = [line + "\n" for line in header_lines]
+        if array_backed:
+            return header_lines, list(spectra_arrays)
+        return header_lines, _to_list_backed_spectra(spectra_arrays)
 
     header_lines = []
     spectra = []
     tmp_spectra_lines = []
 
-    for line in lines:
+    for line in iter_text_lines(ms2_input):
 
         if line.startswith("H"):
             header_lines.append(line)
@@ -342,15 +1167,1132 @@ def from_ms2(
     return header_lines, spectra
 
 
-def to_ms2(h_lines: List[str], ms2_spectras: List[Ms2Spectra]) -> str:
-    lines = []
-    for h_line in h_lines:
-        if h_line.endswith("\n"):
-            lines.append(h_line)
-        else:
-            lines.append(h_line + "\n")
+def _to_list_backed_spectra(spectra_arrays: Ms2SpectraArrays) -> List[Ms2Spectra]:
+    spectra = []
+    for array_spectra in spectra_arrays:
+        array_spectra.mz_spectra = array_spectra.mz_spectra.tolist()
+        array_spectra.intensity_spectra = array_spectra.intensity_spectra.tolist()
+        array_spectra.charge_spectra = array_spectra.charge_spectra.astype(
+            np.float64
+        ).tolist()
+        spectra.append(array_spectra)
+    return spectra
+
+
+def _from_ms2_arrays(
+    ms2_input: Ms2Input,
+    include_spectra=True,
+    processes=1,
+    intensity_dtype=INTENSITY_DTYPE,
+) -> Tuple[List[str], Ms2SpectraArrays]:
+    data = read_bytes(ms2_input)
+    if processes > 1:
+        return _parse_ms2_bytes_parallel(
+            data, processes, include_spectra, intensity_dtype
+        )
+    return _parse_ms2_bytes(data, include_spectra, intensity_dtype)
 
-    for ms2_spectra in ms2_spectras:
-        lines.append(_serialize_ms2_spectra(ms2_spectra))
 
-    return "".join(lines)
+def from_ms2_arrays(
+    ms2_input: Ms2Input,
+    include_spectra=True,
+    processes=1,
+) -> Tuple[List[str], Ms2SpectraArrays]:
+    return _from_ms2_arrays(ms2_input, include_spectra, processes)
+
+
+class Ms2Writer:
+    """
+    Stream header lines and spectra to an open text file handle, or to a (compressed)
+    file with Ms2Writer.open.
+
+    Serialized spectra are collected in a buffer which is written out once it holds
+    more than buffer_size characters, so memory use does not grow with the file.
+    """
+
+    def __init__(
+        self,
+        file,
+        mz_precision: Optional[int] = None,
+        intensity_precision: Optional[int] = None,
+        buffer_size: int = 1 << 20,
+    ):
+        self.file = file
+        self.mz_precision = mz_precision
+        self.intensity_precision = intensity_precision
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        self._owns_file = False
+
+    @staticmethod
+    def open(
+        ms2_path: Union[str, os.PathLike],
+        compression: Optional[str] = "infer",
+        level: Optional[int] = None,
+        threads: int = 0,
+        **kwargs,
+    ) -> "Ms2Writer":
+        """
+        Write to a file, compressed according to its suffix (.gz, .bz2, .xz, .zst)
+        unless compression is given. threads > 0 (or -1 for all cores) compresses
+        zstd output on multiple threads. The file is closed with the writer.
+        """
+        writer = Ms2Writer(
+            open_file(ms2_path, "wt", compression, level, threads), **kwargs
+        )
+        writer._owns_file = True
+        return writer
+
+    def __enter__(self) -> "Ms2Writer":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """Flush the buffer, the file is only closed when opened by the writer."""
+        self.flush()
+        if self._owns_file:
+            self.file.close()
+
+    def _write(self, text: str) -> None:
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_header(self, h_lines: List[str]) -> None:
+        for h_line in h_lines:
+            self._write(h_line if h_line.endswith("\n") else h_line + "\n")
+
+    def write_spectra(self, ms2_spectra: Ms2Spectra) -> None:
+        self._write(
+            _serialize_ms2_spectra(
+                ms2_spectra,
+                mz_precision=self.mz_precision,
+                intensity_precision=self.intensity_precision,
+            )
+        )
+
+    def write_spectras(self, ms2_spectras: Iterable[Ms2Spectra]) -> int:
+        count = 0
+        for ms2_spectra in ms2_spectras:
+            self.write_spectra(ms2_spectra)
+            count += 1
+        return count
+
+    def flush(self) -> None:
+        if self._buffer:
+            self.file.write("".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+
+def from_ms2_to_df(
+    ms2_input: Ms2Input,
+    include_spectra=True,
+    nested_peaks=False,
+    processes=1,
+):
+    h_lines, spectra_arrays = _from_ms2_arrays(ms2_input, include_spectra, processes)
+    spectra_df, peaks_df = spectra_arrays.to_df(nested_peaks)
+    return h_lines, spectra_df, peaks_df
+
+
+def to_ms2(
+    h_lines: List[str],
+    ms2_spectras: Iterable[Ms2Spectra],
+    mz_precision: Optional[int] = None,
+    intensity_precision: Optional[int] = None,
+) -> str:
+    output = StringIO()
+    with Ms2Writer(
+        output, mz_precision=mz_precision, intensity_precision=intensity_precision
+    ) as writer:
+        writer.write_header(h_lines)
+        writer.write_spectras(ms2_spectras)
+    return output.getvalue()
+
+
+@dataclass
+class Ms2ScanIndex:
+    """
+    Byte offsets of every S line in an ms2 file. The spectrum at position k spans
+    offsets[k]:offsets[k + 1], the last offset is the size of the indexed file.
+    """
+
+    offsets: np.ndarray
+    low_scan: np.ndarray
+    high_scan: np.ndarray
+    mz: np.ndarray
+    charge: np.ndarray
+    file_size: int
+    file_mtime_ns: int
+
+    def __post_init__(self):
+        # scans are usually in file order already, the stable sort is then linear
+        self._sort_order = np.argsort(self.low_scan, kind="stable")
+        self._sorted_low_scan = self.low_scan[self._sort_order]
+
+    def __len__(self) -> int:
+        return len(self.low_scan)
+
+    def find(self, low_scan: int) -> Union[int, None]:
+        sorted_low_scan = self._sorted_low_scan
+        position = np.searchsorted(sorted_low_scan, low_scan)
+        if position < len(sorted_low_scan) and sorted_low_scan[position] == low_scan:
+            return int(self._sort_order[position])
+        return None
+
+    def is_current(self, ms2_path: str) -> bool:
+        stat = os.stat(ms2_path)
+        return stat.st_size == self.file_size and stat.st_mtime_ns == self.file_mtime_ns
+
+    def save(self, index_path: str) -> None:
+        with open(index_path, "wb") as file:
+            np.savez(
+                file,
+                offsets=self.offsets,
+                low_scan=self.low_scan,
+                high_scan=self.high_scan,
+                mz=self.mz,
+                charge=self.charge,
+                file_stat=np.array(
+                    [self.file_size, self.file_mtime_ns], dtype=np.int64
+                ),
+            )
+
+    @staticmethod
+    def load(index_path: str) -> "Ms2ScanIndex":
+        with np.load(index_path) as data:
+            return Ms2ScanIndex(
+                offsets=data["offsets"],
+                low_scan=data["low_scan"],
+                high_scan=data["high_scan"],
+                mz=data["mz"],
+                charge=data["charge"],
+                file_size=int(data["file_stat"][0]),
+                file_mtime_ns=int(data["file_stat"][1]),
+            )
+
+
+def _index_ms2_buffer(buffer, start: int = 0) -> Tuple[np.ndarray, ...]:
+    offsets, low_scans, high_scans, mzs, charges = [], [], [], [], []
+    for match in _S_OR_Z_LINE_PATTERN.finditer(buffer, start):
+        line_elems = match.group().decode().split("\t")
+        if line_elems[0] == "S":
+            offsets.append(match.start())
+            low_scans.append(int(line_elems[1]))
+            high_scans.append(int(line_elems[2]))
+            mzs.append(float(line_elems[3]))
+            charges.append(0)
+        elif offsets:
+            charges[-1] = int(line_elems[1])
+
+    return (
+        np.array(offsets, dtype=np.int64),
+        np.array(low_scans, dtype=np.int64),
+        np.array(high_scans, dtype=np.int64),
+        np.array(mzs, dtype=np.float64),
+        np.array(charges, dtype=np.int64),
+    )
+
+
+def build_ms2_scan_index(ms2_path: str) -> Ms2ScanIndex:
+    stat = os.stat(ms2_path)
+    if stat.st_size == 0:
+        offsets, low_scan, high_scan, mz, charge = (np.empty(0, dtype=np.int64),) * 5
+    else:
+        with open(ms2_path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                offsets, low_scan, high_scan, mz, charge = _index_ms2_buffer(buffer)
+
+    return Ms2ScanIndex(
+        offsets=np.append(offsets, stat.st_size),
+        low_scan=low_scan,
+        high_scan=high_scan,
+        mz=mz,
+        charge=charge,
+        file_size=stat.st_size,
+        file_mtime_ns=stat.st_mtime_ns,
+    )
+
+
+def get_ms2_scan_index(ms2_path: str, rebuild=False, save=True) -> Ms2ScanIndex:
+    """
+    Load the scan index stored next to the ms2 file, the index is rebuilt (and saved)
+    when it is missing or the ms2 file changed since it was built.
+    """
+    index_path = os.fspath(ms2_path) + MS2_SCAN_INDEX_SUFFIX
+    if not rebuild and os.path.exists(index_path):
+        index = Ms2ScanIndex.load(index_path)
+        if index.is_current(ms2_path):
+            return index
+
+    index = build_ms2_scan_index(ms2_path)
+    if save:
+        index.save(index_path)
+    return index
+
+
+@dataclass
+class Ms2PrecursorIndex:
+    """
+    Precursor mz, retention time and 1/K0 of every spectrum, for range queries. Each
+    dimension is searched in a sorted copy of its values which is built on first use.
+    offsets are the S line byte offsets (plus the file size) when built from a file.
+    """
+
+    low_scan: np.ndarray
+    mz: np.ndarray
+    rt: np.ndarray
+    ook0: np.ndarray
+    offsets: Optional[np.ndarray] = None
+    file_size: int = -1
+    file_mtime_ns: int = -1
+
+    def __post_init__(self):
+        # dimension -> (sort order, sorted values)
+        self._sorted = {}
+
+    def __len__(self) -> int:
+        return len(self.low_scan)
+
+    def _sorted_dimension(self, dimension: str) -> Tuple[np.ndarray, np.ndarray]:
+        sorted_dimension = self._sorted.get(dimension)
+        if sorted_dimension is None:
+            # nan sorts last, so it never falls inside a window
+            values = getattr(self, dimension)
+            sort_order = np.argsort(values, kind="stable")
+            sorted_dimension = (sort_order, values[sort_order])
+            self._sorted[dimension] = sorted_dimension
+        return sorted_dimension
+
+    def _range(self, dimension: str, low: float, high: float) -> np.ndarray:
+        sort_order, values = self._sorted_dimension(dimension)
+        start = np.searchsorted(values, low, side="left")
+        end = np.searchsorted(values, high, side="right")
+        return sort_order[start:end]
+
+    def _extend_sorted(self, previous_index: "Ms2PrecursorIndex", keep: int) -> None:
+        """
+        Merge the sorted dimensions of previous_index, whose first keep spectra are
+        the first spectra of this index, with the spectra after them.
+        """
+        for dimension, (sort_order, values) in previous_index._sorted.items():
+            kept = sort_order < keep
+            sort_order, values = sort_order[kept], values[kept]
+            new_values = getattr(self, dimension)[keep:]
+            new_sort_order = np.argsort(new_values, kind="stable")
+            new_values = new_values[new_sort_order]
+            # after equal values, like a stable sort of all spectra
+            insert_at = np.searchsorted(values, new_values, side="right")
+            self._sorted[dimension] = (
+                np.insert(sort_order, insert_at, new_sort_order + keep),
+                np.insert(values, insert_at, new_values),
+            )
+
+    def query(
+        self,
+        mz: Optional[Tuple[float, float]] = None,
+        rt: Optional[Tuple[float, float]] = None,
+        ook0: Optional[Tuple[float, float]] = None,
+    ) -> np.ndarray:
+        """
+        Positions (in file order) of the spectra inside all of the given inclusive
+        windows. Candidates come from the narrowest window and are then filtered by
+        the others.
+        """
+        windows = {
+            dimension: window
+            for dimension, window in (("mz", mz), ("rt", rt), ("ook0", ook0))
+            if window is not None
+        }
+        if not windows:
+            return np.arange(len(self))
+
+        candidates = None
+        for dimension, (low, high) in windows.items():
+            positions = self._range(dimension, low, high)
+            if candidates is None or len(positions) < len(candidates[1]):
+                candidates = (dimension, positions)
+
+        candidate_dimension, positions = candidates
+        mask = np.ones(len(positions), dtype=bool)
+        for dimension, (low, high) in windows.items():
+            if dimension != candidate_dimension:
+                values = getattr(self, dimension)[positions]
+                mask &= (values >= low) & (values <= high)
+        return np.sort(positions[mask])
+
+    def query_low_scans(
+        self,
+        mz: Optional[Tuple[float, float]] = None,
+        rt: Optional[Tuple[float, float]] = None,
+        ook0: Optional[Tuple[float, float]] = None,
+    ) -> np.ndarray:
+        return self.low_scan[self.query(mz, rt, ook0)]
+
+    def is_current(self, ms2_path: str) -> bool:
+        stat = os.stat(ms2_path)
+        return stat.st_size == self.file_size and stat.st_mtime_ns == self.file_mtime_ns
+
+    def save(self, index_path: str) -> None:
+        if self.offsets is None:
+            raise ValueError("Only precursor indexes built from a file can be saved!")
+        with open(index_path, "wb") as file:
+            np.savez(
+                file,
+                low_scan=self.low_scan,
+                mz=self.mz,
+                rt=self.rt,
+                ook0=self.ook0,
+                offsets=self.offsets,
+                file_stat=np.array(
+                    [self.file_size, self.file_mtime_ns], dtype=np.int64
+                ),
+            )
+
+    @staticmethod
+    def load(index_path: str) -> "Ms2PrecursorIndex":
+        with np.load(index_path) as data:
+            return Ms2PrecursorIndex(
+                low_scan=data["low_scan"],
+                mz=data["mz"],
+                rt=data["rt"],
+                ook0=data["ook0"],
+                offsets=data["offsets"],
+                file_size=int(data["file_stat"][0]),
+                file_mtime_ns=int(data["file_stat"][1]),
+            )
+
+    @staticmethod
+    def from_spectra(
+        ms2_spectras: Union[Ms2SpectraArrays, List[Ms2Spectra]],
+    ) -> "Ms2PrecursorIndex":
+        if isinstance(ms2_spectras, Ms2SpectraArrays):
+            return Ms2PrecursorIndex(
+                low_scan=ms2_spectras.low_scan,
+                mz=ms2_spectras.mz,
+                rt=ms2_spectras.rt,
+                ook0=ms2_spectras.ook0,
+            )
+
+        return Ms2PrecursorIndex(
+            low_scan=np.array([s.low_scan for s in ms2_spectras], dtype=np.int64),
+            mz=np.array([s.mz for s in ms2_spectras], dtype=np.float64),
+            rt=get_info_column(ms2_spectras, _RETENTION_TIME_KEYWORD),
+            ook0=get_info_column(ms2_spectras, _OOK0_KEYWORD),
+        )
+
+
+def _index_ms2_precursors(buffer, start: int = 0) -> Tuple[np.ndarray, ...]:
+    offsets, low_scans, mzs, rts, ook0s = [], [], [], [], []
+    for match in _S_OR_I_LINE_PATTERN.finditer(buffer, start):
+        line_elems = match.group().decode().split("\t")
+        if line_elems[0] == "S":
+            offsets.append(match.start())
+            low_scans.append(int(line_elems[1]))
+            mzs.append(float(line_elems[3]))
+            rts.append(np.nan)
+            ook0s.append(np.nan)
+        elif offsets and len(line_elems) > 2 and line_elems[2]:
+            if line_elems[1] == _RETENTION_TIME_KEYWORD:
+                rts[-1] = float(line_elems[2])
+            elif line_elems[1] == _OOK0_KEYWORD:
+                ook0s[-1] = float(line_elems[2])
+
+    return (
+        np.array(offsets, dtype=np.int64),
+        np.array(low_scans, dtype=np.int64),
+        np.array(mzs, dtype=np.float64),
+        np.array(rts, dtype=np.float64),
+        np.array(ook0s, dtype=np.float64),
+    )
+
+
+def build_ms2_precursor_index(
+    ms2_path: str, previous_index: Optional[Ms2PrecursorIndex] = None
+) -> Ms2PrecursorIndex:
+    """
+    Index the precursors of an ms2 file. When previous_index was built from an
+    earlier, shorter version of the same file (spectra only appended) only the last
+    indexed spectrum and everything after it are read again.
+    """
+    stat = os.stat(ms2_path)
+    columns = [np.empty(0, dtype=np.int64)] * 2 + [np.empty(0, dtype=np.float64)] * 3
+    start, keep = 0, 0
+    if stat.st_size > 0:
+        with open(ms2_path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if (
+                    previous_index is not None
+                    and previous_index.offsets is not None
+                    and len(previous_index) > 0
+                    and stat.st_size > previous_index.file_size
+                ):
+                    last_start = int(previous_index.offsets[-2])
+                    line_end = buffer.find(b"\n", last_start)
+                    s_line = buffer[last_start : line_end if line_end != -1 else None]
+                    s_line_elems = s_line.split(b"\t")
+                    if (
+                        s_line_elems[0] == b"S"
+                        and len(s_line_elems) > 1
+                        and int(s_line_elems[1]) == previous_index.low_scan[-1]
+                    ):
+                        start, keep = last_start, len(previous_index) - 1
+
+                columns = _index_ms2_precursors(buffer, start)
+                if keep > 0:
+                    previous_columns = (
+                        previous_index.offsets[:-1],
+                        previous_index.low_scan,
+                        previous_index.mz,
+                        previous_index.rt,
+                        previous_index.ook0,
+                    )
+                    columns = [
+                        np.concatenate([previous[:keep], column])
+                        for previous, column in zip(previous_columns, columns)
+                    ]
+
+    offsets, low_scan, mz, rt, ook0 = columns
+    index = Ms2PrecursorIndex(
+        low_scan=low_scan,
+        mz=mz,
+        rt=rt,
+        ook0=ook0,
+        offsets=np.append(offsets, stat.st_size),
+        file_size=stat.st_size,
+        file_mtime_ns=stat.st_mtime_ns,
+    )
+    if keep > 0:
+        index._extend_sorted(previous_index, keep)
+    return index
+
+
+def get_ms2_precursor_index(
+    ms2_path: str, rebuild=False, save=True
+) -> Ms2PrecursorIndex:
+    """
+    Load the precursor index stored next to the ms2 file. A missing index is built,
+    an index of a file which has since grown is extended with the new spectra.
+    """
+    index_path = os.fspath(ms2_path) + MS2_PRECURSOR_INDEX_SUFFIX
+    previous_index = None
+    if not rebuild and os.path.exists(index_path):
+        previous_index = Ms2PrecursorIndex.load(index_path)
+        if previous_index.is_current(ms2_path):
+            return previous_index
+
+    index = build_ms2_precursor_index(ms2_path, previous_index)
+    if save:
+        index.save(index_path)
+    return index
+
+
+class Ms2ScanReader:
+    """
+    Random access to the spectra of an ms2 file by low_scan. The file is memory
+    mapped and only the requested spectra are deserialized.
+    """
+
+    def __init__(self, ms2_path: str, index: Optional[Ms2ScanIndex] = None):
+        self.ms2_path = ms2_path
+        self.index = index if index is not None else get_ms2_scan_index(ms2_path)
+        self._file = open(ms2_path, "rb")
+        self._buffer = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.index.file_size > 0
+            else b""
+        )
+
+    def __enter__(self) -> "Ms2ScanReader":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, low_scan: int) -> bool:
+        return self.index.find(low_scan) is not None
+
+    def close(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
+
+    def _find(self, low_scan: int) -> int:
+        position = self.index.find(low_scan)
+        if position is None:
+            raise ValueError(f"Scan {low_scan} not found in {self.ms2_path}!")
+        return position
+
+    def get_spectra_bytes(self, low_scan: int) -> bytes:
+        position = self._find(low_scan)
+        start, end = self.index.offsets[position], self.index.offsets[position + 1]
+        return self._buffer[start:end]
+
+    def get_spectra(
+        self, low_scan: int, include_spectra=True, lazy=False
+    ) -> Ms2Spectra:
+        if lazy:
+            position = self._find(low_scan)
+            return self._get_lazy_spectra(position)
+        return _deserialize_ms2_spectra(
+            self.get_spectra_bytes(low_scan).decode(), include_spectra
+        )
+
+    def get_spectras(
+        self, low_scans: List[int], include_spectra=True, lazy=False
+    ) -> List[Ms2Spectra]:
+        return [
+            self.get_spectra(low_scan, include_spectra, lazy) for low_scan in low_scans
+        ]
+
+    def get_lazy_spectra(self, array_backed=False):
+        """Yield every spectrum of the file in file order as a LazyMs2Spectra."""
+        for position in range(len(self.index)):
+            yield self._get_lazy_spectra(position, array_backed)
+
+    def _get_lazy_spectra(self, position: int, array_backed=False) -> LazyMs2Spectra:
+        start, end = self.index.offsets[position], self.index.offsets[position + 1]
+        return _deserialize_lazy_ms2_spectra(
+            self._buffer, int(start), int(end), array_backed
+        )
+
+
+class Ms2Follower:
+    """
+    Read the spectra of an ms2 file that is still being written. Every poll returns
+    the spectra completed since the previous poll, only data after offset (the start
+    of the first spectrum not returned yet) is read. The last spectrum of the file is
+    only complete once the next S line is written, or when polling with final=True.
+    """
+
+    def __init__(
+        self,
+        ms2_path: Union[str, os.PathLike],
+        include_spectra=True,
+        array_backed=False,
+        offset: int = 0,
+    ):
+        self.ms2_path = ms2_path
+        self.include_spectra = include_spectra
+        self.array_backed = array_backed
+        self.offset = offset
+        self.header = []
+        self._file = open(ms2_path, "rb")
+
+    def __enter__(self) -> "Ms2Follower":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def poll(self, final=False) -> List[Ms2Spectra]:
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self.offset:
+            # the file was truncated or rewritten, start over
+            self.offset = 0
+            self.header = []
+
+        self._file.seek(self.offset)
+        data = self._file.read(size - self.offset)
+        if not final:
+            # a partially written last line is left for the next poll
+            data = data[: data.rfind(b"\n") + 1]
+
+        starts = [match.start() for match in _S_LINE_PATTERN.finditer(data)]
+        if not starts:
+            return []
+
+        if self.offset == 0:
+            self.header = [
+                line
+                for line in data[: starts[0]].decode().splitlines(keepends=True)
+                if line.startswith("H")
+            ]
+
+        ends = starts[1:] + [len(data)] if final else starts[1:]
+        ms2_spectras = [
+            _deserialize_ms2_spectra(
+                data[start:end].decode(), self.include_spectra, self.array_backed
+            )
+            for start, end in zip(starts, ends)
+        ]
+        self.offset += ends[-1] if ends else starts[0]
+        return ms2_spectras
+
+    def follow(
+        self, poll_interval: float = 1.0, idle_timeout: Optional[float] = None
+    ) -> Iterator[Ms2Spectra]:
+        """
+        Yield spectra as they are completed. Stops (after yielding the last spectrum)
+        once the file did not grow for idle_timeout seconds, never when it is None.
+        """
+        last_size, last_growth = -1, time.monotonic()
+        while True:
+            yield from self.poll()
+
+            size = os.fstat(self._file.fileno()).st_size
+            if size != last_size:
+                last_size, last_growth = size, time.monotonic()
+            elif (
+                idle_timeout is not None
+                and time.monotonic() - last_growth >= idle_timeout
+            ):
+                yield from self.poll(final=True)
+                return
+            time.sleep(poll_interval)
+
+
+def _pack_ms2_info(
+    infos: List[Dict[str, str]],
+) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Store the I line dicts as a keyword table, a keyword id per entry (with per
+    spectrum offsets) and the newline joined values.
+    """
+    keywords, keyword_ids, values = {}, [], []
+    info_offsets = np.zeros(len(infos) + 1, dtype=np.int64)
+    for i, info in enumerate(infos):
+        for keyword, value in info.items():
+            keyword_ids.append(keywords.setdefault(keyword, len(keywords)))
+            values.append(value)
+        info_offsets[i + 1] = len(values)
+
+    value_blob = "\n".join(values)
+    if value_blob.count("\n") != max(len(values) - 1, 0):
+        raise ValueError("Cannot cache I line values which contain newlines!")
+
+    return (
+        list(keywords),
+        info_offsets,
+        np.array(keyword_ids, dtype=np.int32),
+        np.frombuffer(value_blob.encode(), dtype=np.uint8),
+    )
+
+
+def _unpack_ms2_info(
+    keywords: List[str],
+    info_offsets: np.ndarray,
+    keyword_ids: np.ndarray,
+    value_blob: np.ndarray,
+) -> List[Dict[str, str]]:
+    if len(keyword_ids) == 0:
+        return [{} for _ in range(len(info_offsets) - 1)]
+
+    entry_keywords = [keywords[keyword_id] for keyword_id in keyword_ids.tolist()]
+    values = value_blob.tobytes().decode().split("\n")
+    bounds = info_offsets.tolist()
+    return [
+        dict(zip(entry_keywords[start:end], values[start:end]))
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+@dataclass
+class Ms2Cache:
+    """
+    Parsed contents of an ms2 file stored in a single binary file. Arrays of an
+    uncompressed cache are memory mapped on load, so reloading does not copy peaks.
+    """
+
+    h_lines: List[str]
+    spectra_arrays: Ms2SpectraArrays
+    file_size: int = -1
+    file_mtime_ns: int = -1
+
+    def is_current(self, ms2_path: str) -> bool:
+        stat = os.stat(ms2_path)
+        return stat.st_size == self.file_size and stat.st_mtime_ns == self.file_mtime_ns
+
+    def save(
+        self,
+        cache_path: str,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+    ) -> None:
+        if compression is not None and compression not in _MS2_CACHE_COMPRESSORS:
+            raise ValueError(f"Unsupported cache compression: {compression}!")
+
+        spectra_arrays = self.spectra_arrays
+        keywords, info_offsets, keyword_ids, value_blob = _pack_ms2_info(
+            spectra_arrays.info
+        )
+        arrays = {
+            "low_scan": spectra_arrays.low_scan,
+            "high_scan": spectra_arrays.high_scan,
+            "mz": spectra_arrays.mz,
+            "mass": spectra_arrays.mass,
+            "charge": spectra_arrays.charge,
+            "mz_spectra": spectra_arrays.mz_spectra,
+            "intensity_spectra": spectra_arrays.intensity_spectra,
+            "charge_spectra": spectra_arrays.charge_spectra,
+            "offsets": spectra_arrays.offsets,
+            "info_offsets": info_offsets,
+            "info_keyword_ids": keyword_ids,
+            "info_values": value_blob,
+        }
+
+        if compression is not None:
+            compress, _ = _MS2_CACHE_COMPRESSORS[compression]
+            if compression_level is None:
+                compression_level = _MS2_CACHE_DEFAULT_LEVELS[compression]
+
+        blocks, array_metadata, position = [], {}, 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            data = array.tobytes()
+            if compression is not None:
+                data = compress(data, compression_level)
+            array_metadata[name] = {
+                "dtype": array.dtype.str,
+                "length": len(array),
+                "offset": position,
+                "nbytes": len(data),
+            }
+            blocks.append(data)
+            position += -(-len(data) // _MS2_CACHE_ALIGNMENT) * _MS2_CACHE_ALIGNMENT
+
+        metadata = json.dumps(
+            {
+                "h_lines": list(self.h_lines),
+                "info_keywords": keywords,
+                "compression": compression,
+                "file_size": self.file_size,
+                "file_mtime_ns": self.file_mtime_ns,
+                "arrays": array_metadata,
+            }
+        ).encode()
+
+        with open(cache_path, "wb") as file:
+            file.write(
+                _MS2_CACHE_PREAMBLE.pack(
+                    _MS2_CACHE_MAGIC, _MS2_CACHE_VERSION, len(metadata)
+                )
+            )
+            file.write(metadata)
+            for data in blocks:
+                file.write(b"\0" * (-file.tell() % _MS2_CACHE_ALIGNMENT))
+                file.write(data)
+
+    @staticmethod
+    def load(cache_path: str) -> "Ms2Cache":
+        with open(cache_path, "rb") as file:
+            preamble = file.read(_MS2_CACHE_PREAMBLE.size)
+            if len(preamble) != _MS2_CACHE_PREAMBLE.size:
+                raise ValueError(f"Invalid ms2 cache file: {cache_path}!")
+            magic, version, metadata_size = _MS2_CACHE_PREAMBLE.unpack(preamble)
+            if magic != _MS2_CACHE_MAGIC:
+                raise ValueError(f"Invalid ms2 cache file: {cache_path}!")
+            if version != _MS2_CACHE_VERSION:
+                raise ValueError(f"Unsupported ms2 cache version: {version}!")
+
+            metadata = json.loads(file.read(metadata_size).decode())
+            data_start = file.tell()
+            data_start += -data_start % _MS2_CACHE_ALIGNMENT
+
+            compression = metadata["compression"]
+            if compression is None:
+                # arrays are views of the map, it is closed once they are released
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                _, decompress = _MS2_CACHE_COMPRESSORS[compression]
+                file.seek(0)
+                buffer = file.read()
+
+        arrays = {}
+        for name, array_metadata in metadata["arrays"].items():
+            dtype = np.dtype(array_metadata["dtype"])
+            if array_metadata["length"] == 0:
+                arrays[name] = np.empty(0, dtype=dtype)
+                continue
+
+            start = data_start + array_metadata["offset"]
+            if compression is None:
+                arrays[name] = np.frombuffer(
+                    buffer, dtype=dtype, count=array_metadata["length"], offset=start
+                )
+            else:
+                data = decompress(buffer[start : start + array_metadata["nbytes"]])
+                arrays[name] = np.frombuffer(data, dtype=dtype)
+
+        info = _unpack_ms2_info(
+            metadata["info_keywords"],
+            arrays["info_offsets"],
+            arrays["info_keyword_ids"],
+            arrays["info_values"],
+        )
+
+        return Ms2Cache(
+            h_lines=metadata["h_lines"],
+            spectra_arrays=Ms2SpectraArrays(
+                low_scan=arrays["low_scan"],
+                high_scan=arrays["high_scan"],
+                mz=arrays["mz"],
+                mass=arrays["mass"],
+                charge=arrays["charge"],
+                info=info,
+                mz_spectra=arrays["mz_spectra"],
+                intensity_spectra=arrays["intensity_spectra"],
+                charge_spectra=arrays["charge_spectra"],
+                offsets=arrays["offsets"],
+            ),
+            file_size=metadata["file_size"],
+            file_mtime_ns=metadata["file_mtime_ns"],
+        )
+
+
+def build_ms2_cache(ms2_path: str, processes=1, intensity_dtype=np.float64) -> Ms2Cache:
+    """
+    Parse an ms2 file into a cache. Intensities are float64 by default so to_ms2 of
+    the cache writes the same values as the file, float32 halves their size.
+    """
+    stat = os.stat(ms2_path)
+    with open(ms2_path, "rb") as file:
+        h_lines, spectra_arrays = _from_ms2_arrays(
+            file.read(), True, processes, intensity_dtype
+        )
+
+    return Ms2Cache(
+        h_lines=h_lines,
+        spectra_arrays=spectra_arrays,
+        file_size=stat.st_size,
+        file_mtime_ns=stat.st_mtime_ns,
+    )
+
+
+def get_ms2_cache(
+    ms2_path: str,
+    rebuild=False,
+    save=True,
+    compression: Optional[str] = None,
+    processes=1,
+    intensity_dtype=np.float64,
+) -> Ms2Cache:
+    """
+    Load the binary cache stored next to the ms2 file, the cache is rebuilt (and
+    saved) when it is missing, the ms2 file changed since it was built or its
+    intensities are not intensity_dtype (see build_ms2_cache).
+    """
+    cache_path = os.fspath(ms2_path) + MS2_CACHE_SUFFIX
+    if not rebuild and os.path.exists(cache_path):
+        cache = Ms2Cache.load(cache_path)
+        if (
+            cache.is_current(ms2_path)
+            and cache.spectra_arrays.intensity_spectra.dtype == intensity_dtype
+        ):
+            return cache
+
+    cache = build_ms2_cache(ms2_path, processes, intensity_dtype)
+    if save:
+        cache.save(cache_path, compression)
+    return cache
+
+
+def to_ms2_cache(
+    cache_path: str,
+    h_lines: List[str],
+    spectra_arrays: Ms2SpectraArrays,
+    compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+) -> None:
+    Ms2Cache(h_lines, spectra_arrays).save(cache_path, compression, compression_level)
+
+
+def from_ms2_cache(cache_path: str) -> Tuple[List[str], Ms2SpectraArrays]:
+    cache = Ms2Cache.load(cache_path)
+    return cache.h_lines, cache.spectra_arrays
+
+
+def _peak_order(
+    spectra_arrays: Ms2SpectraArrays, spectra_index: np.ndarray
+) -> Union[np.ndarray, None]:
+    """
+    Peak order sorting by spectrum and then by mz, None when the peaks of every
+    spectrum are already in mz order (as in ms2 files).
+    """
+    mz_spectra = spectra_arrays.mz_spectra
+    in_order = (np.diff(mz_spectra) >= 0) | (np.diff(spectra_index) != 0)
+    if in_order.all():
+        return None
+    return np.lexsort((mz_spectra, spectra_index))
+
+
+def _descending_intensity_order(
+    spectra_arrays: Ms2SpectraArrays, spectra_index: np.ndarray
+) -> np.ndarray:
+    """Peak order sorting by spectrum and then by decreasing intensity."""
+    intensity_spectra = spectra_arrays.intensity_spectra
+    if intensity_spectra.dtype != np.float32:
+        return np.lexsort((-intensity_spectra, spectra_index))
+
+    # float32 bits mapped to integers in the same order, one int64 key sorts faster
+    bits = intensity_spectra.view(np.uint32).astype(np.int64)
+    sortable_bits = bits ^ np.where(bits >> 31, 0xFFFFFFFF, 0x80000000)
+    keys = (spectra_index.astype(np.int64) << 32) | (0xFFFFFFFF - sortable_bits)
+    return np.argsort(keys, kind="stable")
+
+
+def filter_top_n(spectra_arrays: Ms2SpectraArrays, n: int) -> Ms2SpectraArrays:
+    """Keep the n most intense peaks of every spectrum, peaks stay in their order."""
+    spectra_index = spectra_arrays.peak_spectra_index
+    order = _descending_intensity_order(spectra_arrays, spectra_index)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - spectra_arrays.offsets[spectra_index[order]]
+    return spectra_arrays.select_peaks(rank < n)
+
+
+def filter_relative_intensity(
+    spectra_arrays: Ms2SpectraArrays, min_relative_intensity: float
+) -> Ms2SpectraArrays:
+    """Keep peaks with at least min_relative_intensity times the spectrum maximum."""
+    max_intensity = np.zeros(len(spectra_arrays), dtype=np.float64)
+    has_peaks = spectra_arrays.peak_counts > 0
+    if has_peaks.any():
+        max_intensity[has_peaks] = np.maximum.reduceat(
+            spectra_arrays.intensity_spectra, spectra_arrays.offsets[:-1][has_peaks]
+        )
+    threshold = np.repeat(
+        max_intensity * min_relative_intensity, spectra_arrays.peak_counts
+    )
+    return spectra_arrays.select_peaks(spectra_arrays.intensity_spectra >= threshold)
+
+
+def merge_peaks(spectra_arrays: Ms2SpectraArrays, ppm: float) -> Ms2SpectraArrays:
+    """
+    Merge consecutive peaks (in mz order) that are within ppm of each other into one
+    peak with the summed intensity at the intensity weighted mean mz. A merged peak
+    keeps the highest charge of its peaks.
+    """
+    spectra_index = spectra_arrays.peak_spectra_index
+    order = _peak_order(spectra_arrays, spectra_index)
+    if order is None:
+        order = slice(None)
+    mz_spectra = spectra_arrays.mz_spectra[order]
+    intensity_spectra = spectra_arrays.intensity_spectra[order].astype(np.float64)
+    spectra_index = spectra_index[order]
+
+    group_start = np.ones(len(mz_spectra), dtype=bool)
+    group_start[1:] = (spectra_index[1:] != spectra_index[:-1]) | (
+        np.diff(mz_spectra) > mz_spectra[:-1] * ppm * 1e-6
+    )
+    starts = np.flatnonzero(group_start)
+
+    intensity_sum = (
+        np.add.reduceat(intensity_spectra, starts) if len(starts) else intensity_spectra
+    )
+    weighted_mz = (
+        np.add.reduceat(mz_spectra * intensity_spectra, starts)
+        if len(starts)
+        else mz_spectra
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        merged_mz = np.where(
+            intensity_sum > 0, weighted_mz / intensity_sum, mz_spectra[starts]
+        )
+
+    charge_spectra = spectra_arrays.charge_spectra
+    if len(charge_spectra) > 0 and len(starts):
+        charge_spectra = np.maximum.reduceat(charge_spectra[order], starts)
+
+    offsets = np.zeros(len(spectra_arrays) + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(spectra_index[starts], minlength=len(spectra_arrays)),
+        out=offsets[1:],
+    )
+
+    return Ms2SpectraArrays(
+        low_scan=spectra_arrays.low_scan,
+        high_scan=spectra_arrays.high_scan,
+        mz=spectra_arrays.mz,
+        mass=spectra_arrays.mass,
+        charge=spectra_arrays.charge,
+        info=spectra_arrays.info,
+        mz_spectra=merged_mz.astype(spectra_arrays.mz_spectra.dtype),
+        intensity_spectra=intensity_sum.astype(spectra_arrays.intensity_spectra.dtype),
+        charge_spectra=charge_spectra,
+        offsets=offsets,
+    )
+
+
+def deisotope(spectra_arrays: Ms2SpectraArrays, ppm: float = 10.0) -> Ms2SpectraArrays:
+    """
+    Remove isotope peaks using the peak charges: a peak with charge z is dropped when
+    the same spectrum has a peak of charge z ISOTOPE_MASS_DIFFERENCE / z below it.
+    Spectra without peak charges are returned unchanged.
+    """
+    charge_spectra = spectra_arrays.charge_spectra
+    if len(charge_spectra) == 0 or len(spectra_arrays.mz_spectra) == 0:
+        return spectra_arrays
+
+    spectra_index = spectra_arrays.peak_spectra_index
+    order = _peak_order(spectra_arrays, spectra_index)
+    if order is None:
+        order = np.arange(len(spectra_index))
+    mz_spectra = spectra_arrays.mz_spectra[order]
+    charges = charge_spectra[order].astype(np.int64)
+    spectra_index = spectra_index[order]
+
+    # look up mz in all spectra at once by shifting every spectrum to its own range
+    span = np.ceil(mz_spectra.max()) + 2 * ISOTOPE_MASS_DIFFERENCE
+    keys = mz_spectra + spectra_index * span
+
+    charged = np.flatnonzero(charges > 0)
+    targets = keys[charged] - ISOTOPE_MASS_DIFFERENCE / charges[charged]
+    tolerance = mz_spectra[charged] * ppm * 1e-6
+
+    is_isotope = np.zeros(len(mz_spectra), dtype=bool)
+    position = np.searchsorted(keys, targets)
+    for candidate in (position - 1, position):
+        valid = (candidate >= 0) & (candidate < len(keys))
+        candidate = np.where(valid, candidate, 0)
+        is_isotope[charged] |= (
+            valid
+            & (np.abs(keys[candidate] - targets) <= tolerance)
+            & (charges[candidate] == charges[charged])
+        )
+
+    keep = np.empty(len(order), dtype=bool)
+    keep[order] = ~is_isotope
+    return spectra_arrays.select_peaks(keep)
+
+
+def preprocess(
+    spectra_arrays: Ms2SpectraArrays,
+    steps: List[Callable[[Ms2SpectraArrays], Ms2SpectraArrays]],
+) -> Ms2SpectraArrays:
+    """
+    Apply preprocessing steps in order, e.g.
+    [partial(merge_peaks, ppm=10), deisotope, partial(filter_top_n, n=150)].
+    """
+    for step in steps:
+        spectra_arrays = step(spectra_arrays)
+    return spectra_arrays
+
+
+def preprocess_spectra(
+    ms2_spectras: Iterable[Ms2Spectra],
+    steps: List[Callable[[Ms2SpectraArrays], Ms2SpectraArrays]],
+    batch_size: int = 1000,
+) -> Iterator[Ms2Spectra]:
+    """
+    Streaming version of preprocess (e.g. over get_spectra), spectra are collected
+    into batches of batch_size and every batch is processed at once.
+    """
+    batch = []
+    for ms2_spectra in ms2_spectras:
+        batch.append(ms2_spectra)
+        if len(batch) == batch_size:
+            yield from preprocess(Ms2SpectraArrays.from_spectra(batch), steps)
+            batch = []
+    if batch:
+        yield from preprocess(Ms2SpectraArrays.from_spectra(batch), steps)
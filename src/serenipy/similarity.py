@@ -0,0 +1,375 @@
+import multiprocessing
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from serenipy.ms2 import Ms2Spectra, Ms2SpectraArrays
+
+# state of the pool workers, set once per worker by _init_worker
+_worker_state = {}
+
+
+@dataclass
+class BinnedSpectra:
+    """
+    Spectra as sparse vectors of binned peak intensities (CSR layout): the bins and
+    weights of spectrum k are bins[offsets[k]:offsets[k + 1]], bins are increasing.
+    """
+
+    offsets: np.ndarray
+    bins: np.ndarray
+    weights: np.ndarray
+    precursor_mass: np.ndarray
+    bin_width: float
+
+    def __len__(self) -> int:
+        return len(self.precursor_mass)
+
+    @property
+    def n_bins(self) -> int:
+        return int(self.bins.max()) + 1 if len(self.bins) > 0 else 0
+
+    def take(self, indices: np.ndarray) -> "BinnedSpectra":
+        counts = np.diff(self.offsets)[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        entries = np.repeat(self.offsets[indices] - offsets[:-1], counts) + np.arange(
+            offsets[-1]
+        )
+        return BinnedSpectra(
+            offsets=offsets,
+            bins=self.bins[entries],
+            weights=self.weights[entries],
+            precursor_mass=self.precursor_mass[indices],
+            bin_width=self.bin_width,
+        )
+
+    def to_sparse_matrix(self, n_bins: Optional[int] = None):
+        """Spectra by bins scipy.sparse.csr_matrix (requires scipy)."""
+        try:
+            from scipy.sparse import csr_matrix
+        except ImportError:
+            raise ImportError("scipy is required for sparse matrices!")
+
+        return csr_matrix(
+            (self.weights, self.bins, self.offsets),
+            shape=(len(self), self.n_bins if n_bins is None else n_bins),
+        )
+
+
+def bin_spectra(
+    ms2_spectras: Union[Ms2SpectraArrays, List[Ms2Spectra]],
+    bin_width: float = 0.02,
+    intensity_power: float = 0.5,
+    min_mz: float = 0.0,
+    max_mz: Optional[float] = None,
+    normalize=True,
+) -> BinnedSpectra:
+    """
+    Bin the peaks of every spectrum, peak intensities are raised to intensity_power
+    and summed per bin. With normalize the vectors have unit length, so dot products
+    are cosine similarities. The precursor mass is the Z line mass (mz when missing).
+    """
+    if not isinstance(ms2_spectras, Ms2SpectraArrays):
+        ms2_spectras = Ms2SpectraArrays.from_spectra(ms2_spectras)
+
+    spectra_index = ms2_spectras.peak_spectra_index
+    mz_spectra = ms2_spectras.mz_spectra
+    keep = mz_spectra >= min_mz
+    if max_mz is not None:
+        keep &= mz_spectra <= max_mz
+
+    spectra_index = spectra_index[keep]
+    bins = np.floor(mz_spectra[keep] / bin_width).astype(np.int64)
+    weights = ms2_spectras.intensity_spectra[keep].astype(np.float64) ** intensity_power
+
+    # peaks of a spectrum are normally mz sorted already, then no sort is needed
+    keys = spectra_index * (int(bins.max()) + 1 if len(bins) else 1) + bins
+    if np.any(np.diff(keys) < 0):
+        order = np.argsort(keys, kind="stable")
+        keys, spectra_index, bins, weights = (
+            keys[order],
+            spectra_index[order],
+            bins[order],
+            weights[order],
+        )
+
+    starts = np.flatnonzero(np.diff(keys, prepend=-1) != 0)
+    bins = bins[starts]
+    weights = np.add.reduceat(weights, starts) if len(starts) else weights
+    spectra_index = spectra_index[starts]
+
+    offsets = np.zeros(len(ms2_spectras) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(spectra_index, minlength=len(ms2_spectras)), out=offsets[1:])
+
+    if normalize and len(weights):
+        norms = np.sqrt(
+            np.bincount(spectra_index, weights=weights**2, minlength=len(ms2_spectras))
+        )
+        weights = weights / norms[spectra_index]
+
+    mass = ms2_spectras.mass
+    return BinnedSpectra(
+        offsets=offsets,
+        bins=bins,
+        weights=weights.astype(np.float32),
+        precursor_mass=np.where(np.isnan(mass), ms2_spectras.mz, mass),
+        bin_width=bin_width,
+    )
+
+
+def _inverted_index(spectra: BinnedSpectra) -> Tuple[np.ndarray, ...]:
+    """Entries of a block sorted by bin, with the (block) spectrum of each entry."""
+    spectra_index = np.repeat(np.arange(len(spectra)), np.diff(spectra.offsets))
+    order = np.argsort(spectra.bins, kind="stable")
+    return spectra.bins[order], spectra_index[order], spectra.weights[order]
+
+
+def _score_blocks(
+    query: BinnedSpectra,
+    library_index: Tuple[np.ndarray, ...],
+    library_mass: np.ndarray,
+    precursor_tolerance: Optional[float],
+    min_score: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Scores of one query block against one library block above min_score."""
+    library_bins, library_spectra, library_weights = library_index
+    n_query, n_library = len(query), len(library_mass)
+
+    start = np.searchsorted(library_bins, query.bins, side="left")
+    end = np.searchsorted(library_bins, query.bins, side="right")
+    counts = end - start
+
+    # one row per (query entry, library entry) pair sharing a bin
+    query_entries = np.repeat(np.arange(len(query.bins)), counts)
+    pair_offsets = np.cumsum(counts) - counts
+    library_entries = np.repeat(start - pair_offsets, counts) + np.arange(counts.sum())
+
+    query_spectra = np.repeat(np.arange(n_query), np.diff(query.offsets))
+    pair_keys = (
+        query_spectra[query_entries] * n_library + library_spectra[library_entries]
+    )
+    scores = np.bincount(
+        pair_keys,
+        weights=query.weights[query_entries] * library_weights[library_entries],
+        minlength=n_query * n_library,
+    ).reshape(n_query, n_library)
+
+    keep = scores > min_score
+    if precursor_tolerance is not None:
+        keep &= (
+            np.abs(query.precursor_mass[:, None] - library_mass[None, :])
+            <= precursor_tolerance
+        )
+    query_positions, library_positions = np.nonzero(keep)
+    return query_positions, library_positions, scores[keep]
+
+
+def _top_k(
+    query_index: np.ndarray, library_index: np.ndarray, scores: np.ndarray, top_k: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    order = np.lexsort((-scores, query_index))
+    query_index, library_index, scores = (
+        query_index[order],
+        library_index[order],
+        scores[order],
+    )
+    group_start = np.flatnonzero(np.diff(query_index, prepend=-1) != 0)
+    rank = np.arange(len(query_index)) - np.repeat(
+        group_start, np.diff(np.append(group_start, len(query_index)))
+    )
+    keep = rank < top_k
+    return query_index[keep], library_index[keep], scores[keep]
+
+
+def _score_query_block(
+    query: BinnedSpectra,
+    query_start: int,
+    library_blocks: List[Tuple[int, Tuple[np.ndarray, ...], np.ndarray]],
+    precursor_tolerance: Optional[float],
+    min_score: float,
+    upper_triangle: bool,
+    top_k: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scores of one query block against all library blocks, with top_k only the best
+    pairs of every query spectrum of the block are returned. All-vs-all (upper
+    triangle) blocks keep the pairs with a higher library position, with top_k the
+    pairs with any other spectrum so every spectrum gets its own top_k.
+    """
+    low_mass = query.precursor_mass.min() if len(query) else np.inf
+    high_mass = query.precursor_mass.max() if len(query) else -np.inf
+    triangle = upper_triangle and top_k is None
+
+    results = []
+    for library_start, library_index, library_mass in library_blocks:
+        if triangle and library_start + len(library_mass) <= query_start:
+            continue
+        if precursor_tolerance is not None and (
+            library_mass[-1] < low_mass - precursor_tolerance
+            or library_mass[0] > high_mass + precursor_tolerance
+        ):
+            continue
+
+        query_positions, library_positions, scores = _score_blocks(
+            query, library_index, library_mass, precursor_tolerance, min_score
+        )
+        query_positions = query_positions + query_start
+        library_positions = library_positions + library_start
+        if upper_triangle:
+            if triangle:
+                keep = query_positions < library_positions
+            else:
+                keep = query_positions != library_positions
+            query_positions = query_positions[keep]
+            library_positions = library_positions[keep]
+            scores = scores[keep]
+        results.append((query_positions, library_positions, scores))
+
+    if not results:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+    query_positions, library_positions, scores = (
+        np.concatenate(columns) for columns in zip(*results)
+    )
+    if top_k is not None:
+        # pruned per block, so only top_k pairs per query spectrum are ever collected
+        return _top_k(query_positions, library_positions, scores, top_k)
+    return query_positions, library_positions, scores
+
+
+def _init_worker(
+    query, library_blocks, precursor_tolerance, min_score, upper_triangle, top_k
+):
+    _worker_state.update(
+        query=query,
+        library_blocks=library_blocks,
+        precursor_tolerance=precursor_tolerance,
+        min_score=min_score,
+        upper_triangle=upper_triangle,
+        top_k=top_k,
+    )
+
+
+def _score_query_block_worker(
+    query_range: Tuple[int, int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    start, end = query_range
+    return _score_query_block(
+        _worker_state["query"].take(np.arange(start, end)),
+        start,
+        _worker_state["library_blocks"],
+        _worker_state["precursor_tolerance"],
+        _worker_state["min_score"],
+        _worker_state["upper_triangle"],
+        _worker_state["top_k"],
+    )
+
+
+def score_spectra(
+    query: BinnedSpectra,
+    library: Optional[BinnedSpectra] = None,
+    precursor_tolerance: Optional[float] = None,
+    min_score: float = 0.0,
+    top_k: Optional[int] = None,
+    block_size: int = 1000,
+    processes: int = 1,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Dot products (cosine similarities for normalized spectra) of query against library
+    spectra, returned as (query_index, library_index, score) arrays sorted by query
+    index and decreasing score. Without a library all query spectra are compared with
+    each other and every pair is reported once, with query_index < library_index.
+
+    Only pairs with a score above min_score (and precursor masses within
+    precursor_tolerance Da) are kept, top_k keeps the best pairs of every query
+    spectrum and is applied per query block, so memory stays bounded. Without a
+    library top_k gives the top_k neighbours of every spectrum (query_index is the
+    spectrum), a pair kept by both of its spectra is reported in both orientations.
+    Spectra are scored in blocks of block_size by block_size, query blocks are scored
+    in a process pool when processes > 1.
+    """
+    if block_size < 1:
+        raise ValueError(f"block_size must be positive: {block_size}!")
+
+    upper_triangle = library is None
+    if upper_triangle:
+        library = query
+
+    # mass sorted blocks have narrow mass ranges, so most of them can be skipped
+    query_order = np.argsort(query.precursor_mass, kind="stable")
+    library_order = (
+        query_order
+        if upper_triangle
+        else np.argsort(library.precursor_mass, kind="stable")
+    )
+    sorted_query = query.take(query_order)
+    sorted_library = sorted_query if upper_triangle else library.take(library_order)
+
+    library_blocks = []
+    for start in range(0, len(sorted_library), block_size):
+        block = sorted_library.take(
+            np.arange(start, min(start + block_size, len(sorted_library)))
+        )
+        library_blocks.append((start, _inverted_index(block), block.precursor_mass))
+
+    query_ranges = [
+        (start, min(start + block_size, len(sorted_query)))
+        for start in range(0, len(sorted_query), block_size)
+    ]
+    state = (
+        sorted_query,
+        library_blocks,
+        precursor_tolerance,
+        min_score,
+        upper_triangle,
+        top_k,
+    )
+    if processes > 1:
+        with multiprocessing.Pool(
+            processes, initializer=_init_worker, initargs=state
+        ) as pool:
+            results = pool.map(_score_query_block_worker, query_ranges)
+    else:
+        results = [
+            _score_query_block(
+                sorted_query.take(np.arange(start, end)), start, *state[1:]
+            )
+            for start, end in query_ranges
+        ]
+
+    if results:
+        query_index, library_index, scores = (
+            np.concatenate(columns) for columns in zip(*results)
+        )
+    else:
+        query_index = library_index = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float64)
+
+    query_index = query_order[query_index]
+    library_index = library_order[library_index]
+    if upper_triangle and top_k is None:
+        query_index, library_index = (
+            np.minimum(query_index, library_index),
+            np.maximum(query_index, library_index),
+        )
+
+    order = np.lexsort((-scores, query_index))
+    return query_index[order], library_index[order], scores[order]
+
+
+def cosine_similarity(
+    query_spectras: Union[Ms2SpectraArrays, List[Ms2Spectra]],
+    library_spectras: Union[Ms2SpectraArrays, List[Ms2Spectra], None] = None,
+    bin_width: float = 0.02,
+    intensity_power: float = 0.5,
+    **kwargs,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Bin the spectra and score them with score_spectra (kwargs are passed on)."""
+    query = bin_spectra(query_spectras, bin_width, intensity_power)
+    library = (
+        None
+        if library_spectras is None
+        else bin_spectra(library_spectras, bin_width, intensity_power)
+    )
+    return score_spectra(query, library, **kwargs)
@@ -1,9 +1,31 @@
-from io import StringIO, TextIOWrapper
-from dataclasses import dataclass, field
+import multiprocessing
+import os
+import time
+from io import StringIO
+from operator import attrgetter
+from pathlib import Path
+from dataclasses import MISSING, dataclass, field
 from enum import Enum, auto
-from typing import List, Tuple, Union
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from .utils import serialize_val, deserialize_val
+import numpy as np
+
+from .ms2 import Ms2ScanReader, Ms2Spectra, get_ms2_scan_index
+from .project.file_types import Ip2FileType
+from .utils import (
+    ColumnSpec,
+    decode_columns,
+    iter_text_lines,
+    line_template,
+    make_column_encoder,
+    make_line_decoder,
+    make_line_encoder,
+    open_file,
+    read_text,
+)
+
+# sqt text, a path (os.PathLike, plain or compressed) or an open text/binary handle
+SqtInput = Union[str, bytes, os.PathLike, IO]
 
 
 class SqtVersion(Enum):
@@ -20,85 +42,54 @@ class LLine:
     peptide_sequence: str
 
 
-l_line_V1_4_0_template = (
-    "L\t{locus_name}\t{peptide_index_in_protein_sequence}\t{peptide_sequence}\n"
-)
-l_line_V2_1_0_template = (
-    "L\t{locus_name}\t{peptide_index_in_protein_sequence}\t{peptide_sequence}\n"
-)
-l_line_V2_1_0_ext_template = (
-    "L\t{locus_name}\t{peptide_index_in_protein_sequence}\t{peptide_sequence}\n"
+_INT, _STR = ColumnSpec(int), ColumnSpec(str)
+
+
+def _float(precision: Optional[int] = None) -> ColumnSpec:
+    return ColumnSpec(float, precision=precision)
+
+
+# L line columns (after the line type) of every sqt version
+_L_LINE_SCHEMAS = {
+    version: {
+        "locus_name": _STR,
+        "peptide_index_in_protein_sequence": _INT,
+        "peptide_sequence": _STR,
+    }
+    for version in SqtVersion
+}
+
+l_line_V1_4_0_template = line_template(_L_LINE_SCHEMAS[SqtVersion.V1_4_0], "L\t")
+l_line_V2_1_0_template = line_template(_L_LINE_SCHEMAS[SqtVersion.V2_1_0], "L\t")
+l_line_V2_1_0_ext_template = line_template(
+    _L_LINE_SCHEMAS[SqtVersion.V2_1_0_ext], "L\t"
 )
-l_line_V2_1_0_robin_random_template = (
-    "L\t{locus_name}\t{peptide_index_in_protein_sequence}\t{peptide_sequence}\n"
+l_line_V2_1_0_robin_random_template = line_template(
+    _L_LINE_SCHEMAS[SqtVersion.V2_1_0_robin_random], "L\t"
 )
 
+_L_LINE_DECODERS = {
+    version: make_line_decoder(LLine, schema, skip=1)
+    for version, schema in _L_LINE_SCHEMAS.items()
+}
+_L_LINE_ENCODERS = {
+    version: make_line_encoder(schema, "L\t")
+    for version, schema in _L_LINE_SCHEMAS.items()
+}
 
-def _deserialize_l_line(line: str, sqt_version: SqtVersion) -> LLine:
-    line_elems = line.rstrip().split("\t")
-    if sqt_version == SqtVersion.V1_4_0:
-        return LLine(
-            locus_name=deserialize_val(line_elems[1], str),
-            peptide_index_in_protein_sequence=deserialize_val(line_elems[2], int),
-            peptide_sequence=deserialize_val(line_elems[3], str),
-        )
-    elif sqt_version == SqtVersion.V2_1_0:
-        return LLine(
-            locus_name=deserialize_val(line_elems[1], str),
-            peptide_index_in_protein_sequence=deserialize_val(line_elems[2], int),
-            peptide_sequence=deserialize_val(line_elems[3], str),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_ext:
-        return LLine(
-            locus_name=deserialize_val(line_elems[1], str),
-            peptide_index_in_protein_sequence=deserialize_val(line_elems[2], int),
-            peptide_sequence=deserialize_val(line_elems[3], str),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_robin_random:
-        return LLine(
-            locus_name=deserialize_val(line_elems[1], str),
-            peptide_index_in_protein_sequence=deserialize_val(line_elems[2], int),
-            peptide_sequence=deserialize_val(line_elems[3], str),
-        )
-    else:
+
+def _version_codec(codecs: Dict[SqtVersion, Callable], sqt_version: SqtVersion):
+    if sqt_version not in codecs:
         raise ValueError(f"Unsupported Sqt Version: {sqt_version}!")
+    return codecs[sqt_version]
+
+
+def _deserialize_l_line(line: str, sqt_version: SqtVersion) -> LLine:
+    return _version_codec(_L_LINE_DECODERS, sqt_version)(line)
 
 
 def _serialize_l_line(line: LLine, sqt_version: SqtVersion) -> str:
-    if sqt_version == SqtVersion.V1_4_0:
-        return l_line_V1_4_0_template.format(
-            locus_name=serialize_val(line.locus_name),
-            peptide_index_in_protein_sequence=serialize_val(
-                line.peptide_index_in_protein_sequence
-            ),
-            peptide_sequence=serialize_val(line.peptide_sequence),
-        )
-    elif sqt_version == SqtVersion.V2_1_0:
-        return l_line_V2_1_0_template.format(
-            locus_name=serialize_val(line.locus_name),
-            peptide_index_in_protein_sequence=serialize_val(
-                line.peptide_index_in_protein_sequence
-            ),
-            peptide_sequence=serialize_val(line.peptide_sequence),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_ext:
-        return l_line_V2_1_0_ext_template.format(
-            locus_name=serialize_val(line.locus_name),
-            peptide_index_in_protein_sequence=serialize_val(
-                line.peptide_index_in_protein_sequence
-            ),
-            peptide_sequence=serialize_val(line.peptide_sequence),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_robin_random:
-        return l_line_V2_1_0_robin_random_template.format(
-            locus_name=serialize_val(line.locus_name),
-            peptide_index_in_protein_sequence=serialize_val(
-                line.peptide_index_in_protein_sequence
-            ),
-            peptide_sequence=serialize_val(line.peptide_sequence),
-        )
-    else:
-        raise ValueError(f"Unsupported Sqt Version: {sqt_version}!")
+    return _version_codec(_L_LINE_ENCODERS, sqt_version)(line)
 
 
 @dataclass
@@ -121,163 +112,62 @@ class MLine:
     l_lines: List[LLine] = field(default_factory=list)
 
 
-m_line_V1_4_0_template = (
-    "M\t{xcorr_rank}\t{sp_rank}\t{calculated_mass}\t{delta_cn}\t{xcorr}\t{sp}\t{matched_ions}"
-    "\t{expected_ions}\t{sequence}\t{validation_status}\n"
-)
-m_line_V2_1_0_template = (
-    "M\t{xcorr_rank}\t{sp_rank}\t{calculated_mass}\t{delta_cn}\t{xcorr}\t{sp}\t{matched_ions}"
-    "\t{expected_ions}\t{sequence}\t{validation_status}\t{predicted_ook0}\t{tims_score}\n"
-)
-m_line_V2_1_0_ext_template = (
-    "M\t{xcorr_rank}\t{sp_rank}\t{calculated_mass}\t{delta_cn}\t{xcorr}\t{sp}"
-    "\t{matched_ions}\t{expected_ions}\t{sequence}\t{validation_status}\t{predicted_ook0}"
-    "\t{tims_score}\t{tims_b_score_m2}\t{tims_b_score_best_m}\n"
+_M_LINE_V1_4_0_SCHEMA = {
+    "xcorr_rank": _INT,
+    "sp_rank": _INT,
+    "calculated_mass": _float(5),
+    "delta_cn": _float(4),
+    "xcorr": _float(4),
+    "sp": _float(),
+    "matched_ions": _INT,
+    "expected_ions": _INT,
+    "sequence": _STR,
+    "validation_status": _STR,
+}
+_M_LINE_V2_1_0_SCHEMA = {
+    **_M_LINE_V1_4_0_SCHEMA,
+    "sp": _float(3),
+    "predicted_ook0": _float(4),
+    "tims_score": _float(4),
+}
+
+# M line columns (after the line type) of every sqt version
+_M_LINE_SCHEMAS = {
+    SqtVersion.V1_4_0: _M_LINE_V1_4_0_SCHEMA,
+    SqtVersion.V2_1_0: _M_LINE_V2_1_0_SCHEMA,
+    SqtVersion.V2_1_0_ext: {
+        **_M_LINE_V2_1_0_SCHEMA,
+        "tims_b_score_m2": _float(4),
+        "tims_b_score_best_m": _float(4),
+    },
+    SqtVersion.V2_1_0_robin_random: _M_LINE_V2_1_0_SCHEMA,
+}
+
+m_line_V1_4_0_template = line_template(_M_LINE_SCHEMAS[SqtVersion.V1_4_0], "M\t")
+m_line_V2_1_0_template = line_template(_M_LINE_SCHEMAS[SqtVersion.V2_1_0], "M\t")
+m_line_V2_1_0_ext_template = line_template(
+    _M_LINE_SCHEMAS[SqtVersion.V2_1_0_ext], "M\t"
 )
-m_line_V2_1_0_robin_random_template = (
-    "M\t{xcorr_rank}\t{sp_rank}\t{calculated_mass}\t{delta_cn}\t{xcorr}\t{sp}"
-    "\t{matched_ions}\t{expected_ions}\t{sequence}\t{validation_status}\t{predicted_ook0}"
-    "\t{tims_score}\n"
+m_line_V2_1_0_robin_random_template = line_template(
+    _M_LINE_SCHEMAS[SqtVersion.V2_1_0_robin_random], "M\t"
 )
 
+_M_LINE_DECODERS = {
+    version: make_line_decoder(MLine, schema, skip=1)
+    for version, schema in _M_LINE_SCHEMAS.items()
+}
+_M_LINE_ENCODERS = {
+    version: make_line_encoder(schema, "M\t")
+    for version, schema in _M_LINE_SCHEMAS.items()
+}
+
 
 def _deserialize_m_line(line: str, sqt_version: SqtVersion) -> MLine:
-    line_elems = line.rstrip().split("\t")
-    if sqt_version == SqtVersion.V1_4_0:
-        return MLine(
-            xcorr_rank=deserialize_val(line_elems[1], int),
-            sp_rank=deserialize_val(line_elems[2], int),
-            calculated_mass=deserialize_val(line_elems[3], float),
-            delta_cn=deserialize_val(line_elems[4], float),
-            xcorr=deserialize_val(line_elems[5], float),
-            sp=deserialize_val(line_elems[6], float),
-            matched_ions=deserialize_val(line_elems[7], int),
-            expected_ions=deserialize_val(line_elems[8], int),
-            sequence=deserialize_val(line_elems[9], str),
-            validation_status=deserialize_val(line_elems[10], str),
-            predicted_ook0=None,
-            tims_score=None,
-            tims_b_score_m2=None,
-            tims_b_score_best_m=None,
-        )
-    elif sqt_version == SqtVersion.V2_1_0:
-        return MLine(
-            xcorr_rank=deserialize_val(line_elems[1], int),
-            sp_rank=deserialize_val(line_elems[2], int),
-            calculated_mass=deserialize_val(line_elems[3], float),
-            delta_cn=deserialize_val(line_elems[4], float),
-            xcorr=deserialize_val(line_elems[5], float),
-            sp=deserialize_val(line_elems[6], float),
-            matched_ions=deserialize_val(line_elems[7], int),
-            expected_ions=deserialize_val(line_elems[8], int),
-            sequence=deserialize_val(line_elems[9], str),
-            validation_status=deserialize_val(line_elems[10], str),
-            predicted_ook0=deserialize_val(line_elems[11], float),
-            tims_score=deserialize_val(line_elems[12], float),
-            tims_b_score_m2=None,
-            tims_b_score_best_m=None,
-        )
-    elif sqt_version == SqtVersion.V2_1_0_ext:
-        return MLine(
-            xcorr_rank=deserialize_val(line_elems[1], int),
-            sp_rank=deserialize_val(line_elems[2], int),
-            calculated_mass=deserialize_val(line_elems[3], float),
-            delta_cn=deserialize_val(line_elems[4], float),
-            xcorr=deserialize_val(line_elems[5], float),
-            sp=deserialize_val(line_elems[6], float),
-            matched_ions=deserialize_val(line_elems[7], int),
-            expected_ions=deserialize_val(line_elems[8], int),
-            sequence=deserialize_val(line_elems[9], str),
-            validation_status=deserialize_val(line_elems[10], str),
-            predicted_ook0=deserialize_val(line_elems[11], float),
-            tims_score=deserialize_val(line_elems[12], float),
-            tims_b_score_m2=deserialize_val(line_elems[13], float),
-            tims_b_score_best_m=deserialize_val(line_elems[14], float),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_robin_random:
-        return MLine(
-            xcorr_rank=deserialize_val(line_elems[1], int),
-            sp_rank=deserialize_val(line_elems[2], int),
-            calculated_mass=deserialize_val(line_elems[3], float),
-            delta_cn=deserialize_val(line_elems[4], float),
-            xcorr=deserialize_val(line_elems[5], float),
-            sp=deserialize_val(line_elems[6], float),
-            matched_ions=deserialize_val(line_elems[7], int),
-            expected_ions=deserialize_val(line_elems[8], int),
-            sequence=deserialize_val(line_elems[9], str),
-            validation_status=deserialize_val(line_elems[10], str),
-            predicted_ook0=deserialize_val(line_elems[11], float),
-            tims_score=deserialize_val(line_elems[12], float),
-            tims_b_score_m2=None,
-            tims_b_score_best_m=None,
-        )
-    else:
-        raise ValueError(f"Unsupported Sqt Version: {sqt_version}!")
+    return _version_codec(_M_LINE_DECODERS, sqt_version)(line)
 
 
 def _serialize_m_line(line: MLine, sqt_version: SqtVersion) -> str:
-    if sqt_version == SqtVersion.V1_4_0:
-        return m_line_V1_4_0_template.format(
-            xcorr_rank=serialize_val(line.xcorr_rank),
-            sp_rank=serialize_val(line.sp_rank),
-            calculated_mass=serialize_val(line.calculated_mass, 5),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            xcorr=serialize_val(line.xcorr, 4),
-            sp=serialize_val(line.sp),
-            matched_ions=serialize_val(line.matched_ions),
-            expected_ions=serialize_val(line.expected_ions),
-            sequence=serialize_val(line.sequence),
-            validation_status=serialize_val(line.validation_status),
-        )
-    elif sqt_version == SqtVersion.V2_1_0:
-        return m_line_V2_1_0_template.format(
-            xcorr_rank=serialize_val(line.xcorr_rank),
-            sp_rank=serialize_val(line.sp_rank),
-            calculated_mass=serialize_val(line.calculated_mass, 5),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            xcorr=serialize_val(line.xcorr, 4),
-            sp=serialize_val(line.sp, 3),
-            matched_ions=serialize_val(line.matched_ions),
-            expected_ions=serialize_val(line.expected_ions),
-            sequence=serialize_val(line.sequence),
-            validation_status=serialize_val(line.validation_status),
-            predicted_ook0=serialize_val(line.predicted_ook0, 4),
-            tims_score=serialize_val(line.tims_score, 4),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_ext:
-        return m_line_V2_1_0_ext_template.format(
-            xcorr_rank=serialize_val(line.xcorr_rank),
-            sp_rank=serialize_val(line.sp_rank),
-            calculated_mass=serialize_val(line.calculated_mass, 5),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            xcorr=serialize_val(line.xcorr, 4),
-            sp=serialize_val(line.sp, 3),
-            matched_ions=serialize_val(line.matched_ions),
-            expected_ions=serialize_val(line.expected_ions),
-            sequence=serialize_val(line.sequence),
-            validation_status=serialize_val(line.validation_status),
-            predicted_ook0=serialize_val(line.predicted_ook0, 4),
-            tims_score=serialize_val(line.tims_score, 4),
-            tims_b_score_m2=serialize_val(line.tims_b_score_m2, 4),
-            tims_b_score_best_m=serialize_val(line.tims_b_score_best_m, 4),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_robin_random:
-        return m_line_V2_1_0_robin_random_template.format(
-            xcorr_rank=serialize_val(line.xcorr_rank),
-            sp_rank=serialize_val(line.sp_rank),
-            calculated_mass=serialize_val(line.calculated_mass, 5),
-            delta_cn=serialize_val(line.delta_cn, 4),
-            xcorr=serialize_val(line.xcorr, 4),
-            sp=serialize_val(line.sp, 3),
-            matched_ions=serialize_val(line.matched_ions),
-            expected_ions=serialize_val(line.expected_ions),
-            sequence=serialize_val(line.sequence),
-            validation_status=serialize_val(line.validation_status),
-            predicted_ook0=serialize_val(line.predicted_ook0, 4),
-            tims_score=serialize_val(line.tims_score, 4),
-        )
-    else:
-        raise ValueError(f"Unsupported Sqt Version: {sqt_version}!")
+    return _version_codec(_M_LINE_ENCODERS, sqt_version)(line)
 
 
 @dataclass
@@ -298,149 +188,60 @@ class SLine:
     m_lines: List[MLine] = field(default_factory=list)
 
 
-s_line_V1_4_0_template = (
-    "S\t{low_scan}\t{high_scan}\t{charge}\t{process_time}\t{server}\t{experimental_mass}"
-    "\t{total_ion_intensity}\t{lowest_sp}\t{number_matches}\n"
-)
-s_line_V2_1_0_template = (
-    "S\t{low_scan}\t{high_scan}\t{charge}\t{process_time}\t{server}\t{experimental_mass}"
-    "\t{total_ion_intensity}\t{lowest_sp}\t{number_matches}\t{experimental_ook0}\n"
-)
-s_line_V2_1_0_ext_template = (
-    "S\t{low_scan}\t{high_scan}\t{charge}\t{process_time}\t{server}\t{experimental_mass}"
-    "\t{total_ion_intensity}\t{lowest_sp}\t{number_matches}\t{experimental_ook0}"
-    "\t{experimental_mz}\t{corrected_ook0}\n"
+_S_LINE_V1_4_0_SCHEMA = {
+    "low_scan": _INT,
+    "high_scan": _INT,
+    "charge": _INT,
+    "process_time": _INT,
+    "server": _STR,
+    "experimental_mass": _float(5),
+    "total_ion_intensity": _float(2),
+    "lowest_sp": _float(4),
+    "number_matches": _INT,
+}
+
+# S line columns (after the line type) of every sqt version
+_S_LINE_SCHEMAS = {
+    SqtVersion.V1_4_0: _S_LINE_V1_4_0_SCHEMA,
+    SqtVersion.V2_1_0: {**_S_LINE_V1_4_0_SCHEMA, "experimental_ook0": _float(4)},
+    SqtVersion.V2_1_0_ext: {
+        **_S_LINE_V1_4_0_SCHEMA,
+        "experimental_ook0": _float(4),
+        "experimental_mz": _float(4),
+        "corrected_ook0": _float(4),
+    },
+    SqtVersion.V2_1_0_robin_random: {
+        **_S_LINE_V1_4_0_SCHEMA,
+        "experimental_ook0": _float(4),
+        "experimental_mz": _float(4),
+    },
+}
+
+s_line_V1_4_0_template = line_template(_S_LINE_SCHEMAS[SqtVersion.V1_4_0], "S\t")
+s_line_V2_1_0_template = line_template(_S_LINE_SCHEMAS[SqtVersion.V2_1_0], "S\t")
+s_line_V2_1_0_ext_template = line_template(
+    _S_LINE_SCHEMAS[SqtVersion.V2_1_0_ext], "S\t"
 )
-s_line_V2_1_0_robin_random_template = (
-    "S\t{low_scan}\t{high_scan}\t{charge}\t{process_time}\t{server}\t{experimental_mass}"
-    "\t{total_ion_intensity}\t{lowest_sp}\t{number_matches}\t{experimental_ook0}"
-    "\t{experimental_mz}\n"
+s_line_V2_1_0_robin_random_template = line_template(
+    _S_LINE_SCHEMAS[SqtVersion.V2_1_0_robin_random], "S\t"
 )
 
+_S_LINE_DECODERS = {
+    version: make_line_decoder(SLine, schema, skip=1)
+    for version, schema in _S_LINE_SCHEMAS.items()
+}
+_S_LINE_ENCODERS = {
+    version: make_line_encoder(schema, "S\t")
+    for version, schema in _S_LINE_SCHEMAS.items()
+}
+
 
 def _deserialize_s_line(line: str, sqt_version: SqtVersion) -> SLine:
-    line_elems = line.rstrip().split("\t")
-    if sqt_version == SqtVersion.V1_4_0:
-        return SLine(
-            low_scan=deserialize_val(line_elems[1], int),
-            high_scan=deserialize_val(line_elems[2], int),
-            charge=deserialize_val(line_elems[3], int),
-            process_time=deserialize_val(line_elems[4], int),
-            server=deserialize_val(line_elems[5], str),
-            experimental_mass=deserialize_val(line_elems[6], float),
-            total_ion_intensity=deserialize_val(line_elems[7], float),
-            lowest_sp=deserialize_val(line_elems[8], float),
-            number_matches=deserialize_val(line_elems[9], int),
-            experimental_ook0=None,
-            experimental_mz=None,
-            corrected_ook0=None,
-        )
-    elif sqt_version == SqtVersion.V2_1_0:
-        return SLine(
-            low_scan=deserialize_val(line_elems[1], int),
-            high_scan=deserialize_val(line_elems[2], int),
-            charge=deserialize_val(line_elems[3], int),
-            process_time=deserialize_val(line_elems[4], int),
-            server=deserialize_val(line_elems[5], str),
-            experimental_mass=deserialize_val(line_elems[6], float),
-            total_ion_intensity=deserialize_val(line_elems[7], float),
-            lowest_sp=deserialize_val(line_elems[8], float),
-            number_matches=deserialize_val(line_elems[9], int),
-            experimental_ook0=deserialize_val(line_elems[10], float),
-            experimental_mz=None,
-            corrected_ook0=None,
-        )
-    elif sqt_version == SqtVersion.V2_1_0_ext:
-        return SLine(
-            low_scan=deserialize_val(line_elems[1], int),
-            high_scan=deserialize_val(line_elems[2], int),
-            charge=deserialize_val(line_elems[3], int),
-            process_time=deserialize_val(line_elems[4], int),
-            server=deserialize_val(line_elems[5], str),
-            experimental_mass=deserialize_val(line_elems[6], float),
-            total_ion_intensity=deserialize_val(line_elems[7], float),
-            lowest_sp=deserialize_val(line_elems[8], float),
-            number_matches=deserialize_val(line_elems[9], int),
-            experimental_ook0=deserialize_val(line_elems[10], float),
-            experimental_mz=deserialize_val(line_elems[11], float),
-            corrected_ook0=deserialize_val(line_elems[12], float),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_robin_random:
-        return SLine(
-            low_scan=deserialize_val(line_elems[1], int),
-            high_scan=deserialize_val(line_elems[2], int),
-            charge=deserialize_val(line_elems[3], int),
-            process_time=deserialize_val(line_elems[4], int),
-            server=deserialize_val(line_elems[5], str),
-            experimental_mass=deserialize_val(line_elems[6], float),
-            total_ion_intensity=deserialize_val(line_elems[7], float),
-            lowest_sp=deserialize_val(line_elems[8], float),
-            number_matches=deserialize_val(line_elems[9], int),
-            experimental_ook0=deserialize_val(line_elems[10], float),
-            experimental_mz=deserialize_val(line_elems[11], float),
-            corrected_ook0=None,
-        )
-    else:
-        raise ValueError(f"Unsupported Sqt Version: {sqt_version}!")
+    return _version_codec(_S_LINE_DECODERS, sqt_version)(line)
 
 
 def _serialize_s_line(line: SLine, sqt_version: SqtVersion) -> str:
-    if sqt_version == SqtVersion.V1_4_0:
-        return s_line_V1_4_0_template.format(
-            low_scan=serialize_val(line.low_scan),
-            high_scan=serialize_val(line.high_scan),
-            charge=serialize_val(line.charge),
-            process_time=serialize_val(line.process_time),
-            server=serialize_val(line.server),
-            experimental_mass=serialize_val(line.experimental_mass, 5),
-            total_ion_intensity=serialize_val(line.total_ion_intensity, 2),
-            lowest_sp=serialize_val(line.lowest_sp, 4),
-            number_matches=serialize_val(line.number_matches),
-        )
-    elif sqt_version == SqtVersion.V2_1_0:
-        return s_line_V2_1_0_template.format(
-            low_scan=serialize_val(line.low_scan),
-            high_scan=serialize_val(line.high_scan),
-            charge=serialize_val(line.charge),
-            process_time=serialize_val(line.process_time),
-            server=serialize_val(line.server),
-            experimental_mass=serialize_val(line.experimental_mass, 5),
-            total_ion_intensity=serialize_val(line.total_ion_intensity, 2),
-            lowest_sp=serialize_val(line.lowest_sp, 4),
-            number_matches=serialize_val(line.number_matches),
-            experimental_ook0=serialize_val(line.experimental_ook0, 4),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_ext:
-        return s_line_V2_1_0_ext_template.format(
-            low_scan=serialize_val(line.low_scan),
-            high_scan=serialize_val(line.high_scan),
-            charge=serialize_val(line.charge),
-            process_time=serialize_val(line.process_time),
-            server=serialize_val(line.server),
-            experimental_mass=serialize_val(line.experimental_mass, 5),
-            total_ion_intensity=serialize_val(line.total_ion_intensity, 2),
-            lowest_sp=serialize_val(line.lowest_sp, 4),
-            number_matches=serialize_val(line.number_matches),
-            experimental_ook0=serialize_val(line.experimental_ook0, 4),
-            experimental_mz=serialize_val(line.experimental_mz, 4),
-            corrected_ook0=serialize_val(line.corrected_ook0, 4),
-        )
-    elif sqt_version == SqtVersion.V2_1_0_robin_random:
-        return s_line_V2_1_0_robin_random_template.format(
-            low_scan=serialize_val(line.low_scan),
-            high_scan=serialize_val(line.high_scan),
-            charge=serialize_val(line.charge),
-            process_time=serialize_val(line.process_time),
-            server=serialize_val(line.server),
-            experimental_mass=serialize_val(line.experimental_mass, 5),
-            total_ion_intensity=serialize_val(line.total_ion_intensity, 2),
-            lowest_sp=serialize_val(line.lowest_sp, 4),
-            number_matches=serialize_val(line.number_matches),
-            experimental_ook0=serialize_val(line.experimental_ook0, 4),
-            experimental_mz=serialize_val(line.experimental_mz, 4),
-        )
-    else:
-        raise ValueError(f"Unsupported Sqt Version: {sqt_version}!")
+    return _version_codec(_S_LINE_ENCODERS, sqt_version)(line)
 
 
 def determine_sqt_version(s_line: str) -> SqtVersion:
@@ -458,50 +259,856 @@ def determine_sqt_version(s_line: str) -> SqtVersion:
         raise ValueError(f"Cannot parse version from s_line: {s_line}!")
 
 
-def from_sqt(
-    sqt_input: Union[str, TextIOWrapper, StringIO],
-) -> Tuple[SqtVersion, List[str], List[SLine]]:
-    if type(sqt_input) is str:
-        lines = sqt_input.split("\n")
-    elif type(sqt_input) is TextIOWrapper or type(sqt_input) is StringIO:
-        lines = sqt_input
-    else:
-        raise ValueError(f"Unsupported input type: {type(sqt_input)}!")
+def _m_line_rank_above(line: str, max_rank: int) -> bool:
+    # only the xcorr_rank token is converted, short lines are left to the decoder
+    tokens = line.split("\t", 2)
+    if len(tokens) < 2:
+        return False
+    rank = tokens[1].strip()
+    return rank != "NA" and int(rank) > max_rank
 
-    version = None
-    h_lines, s_lines = [], []
+
+def _check_m_line_columns(m_line_columns: Iterable[str]) -> None:
+    for column in m_line_columns:
+        if column not in MLine.__dataclass_fields__ or column == "l_lines":
+            raise ValueError(f"Unknown M line column: {column}!")
+
+
+def _m_line_decoder(
+    sqt_version: SqtVersion, m_line_columns: Optional[Iterable[str]] = None
+) -> Callable[[str], MLine]:
+    """M line decoder converting only m_line_columns, the other fields are None."""
+    schema = _version_codec(_M_LINE_SCHEMAS, sqt_version)
+    if m_line_columns is None:
+        return _M_LINE_DECODERS[sqt_version]
+
+    m_line_columns = set(m_line_columns)
+    return make_line_decoder(
+        MLine,
+        {
+            column: spec if column in m_line_columns else None
+            for column, spec in schema.items()
+        },
+        skip=1,
+    )
+
+
+def _parse_s_lines(
+    lines: Iterable[str],
+    h_lines: Optional[List[str]] = None,
+    sqt_version: Optional[SqtVersion] = None,
+    max_rank: Optional[int] = None,
+    include_l_lines=True,
+    m_line_columns: Optional[Iterable[str]] = None,
+) -> Iterator[Tuple[SqtVersion, SLine]]:
+    """
+    Yield every SLine (with its M and L lines) once the next S line or the end of
+    the input is reached. H lines are appended to h_lines when given.
+
+    M lines with a xcorr_rank above max_rank (and their L lines) and, without
+    include_l_lines, all L lines are skipped without being converted.
+    m_line_columns limits the converted M line fields, the others are None.
+    """
+    if m_line_columns is not None:
+        m_line_columns = list(m_line_columns)
+        _check_m_line_columns(m_line_columns)
+
+    s_line = None
+    decode_s_line = decode_m_line = decode_l_line = None
+    skip_l_lines = not include_l_lines
     for line in lines:
 
         if line == "" or line == "\n":
             continue
 
-        if line.startswith("H"):
-            h_lines.append(line)
-        elif line.startswith("S"):
-            if version is None:
-                version = determine_sqt_version(line)
-                print(f"Version: {version}")
-            s_lines.append(_deserialize_s_line(line, version))
+        if line.startswith("L"):
+            if skip_l_lines:
+                continue
+            if s_line is None or not s_line.m_lines:
+                raise ValueError(f"L line without an M line: {line}!")
+            s_line.m_lines[-1].l_lines.append(decode_l_line(line))
         elif line.startswith("M"):
-            s_lines[-1].m_lines.append(_deserialize_m_line(line, version))
-        elif line.startswith("L"):
-            s_lines[-1].m_lines[-1].l_lines.append(_deserialize_l_line(line, version))
+            if s_line is None:
+                raise ValueError(f"M line before the first S line: {line}!")
+            if max_rank is not None and _m_line_rank_above(line, max_rank):
+                skip_l_lines = True
+                continue
+            skip_l_lines = not include_l_lines
+            s_line.m_lines.append(decode_m_line(line))
+        elif line.startswith("S"):
+            if s_line is not None:
+                yield sqt_version, s_line
+            if sqt_version is None:
+                sqt_version = determine_sqt_version(line)
+            if decode_s_line is None:
+                # the line decoders are compiled once for the version
+                decode_s_line = _version_codec(_S_LINE_DECODERS, sqt_version)
+                decode_m_line = _m_line_decoder(sqt_version, m_line_columns)
+                decode_l_line = _L_LINE_DECODERS[sqt_version]
+            s_line = decode_s_line(line)
+            skip_l_lines = not include_l_lines
+        elif line.startswith("H"):
+            if h_lines is not None:
+                h_lines.append(line)
+
+    if s_line is not None:
+        yield sqt_version, s_line
+
+
+def get_header(sqt_input: SqtInput) -> List[str]:
+    header_lines = []
+
+    for line in iter_text_lines(sqt_input):
+        if line.startswith("H"):
+            header_lines.append(line)
+        elif line and line != "\n":
+            break
+
+    return header_lines
+
+
+def get_sqt_version(sqt_input: SqtInput) -> Union[SqtVersion, None]:
+    """Version of the first S line, None if there are no S lines."""
+    for line in iter_text_lines(sqt_input):
+        if line.startswith("S"):
+            return determine_sqt_version(line)
+    return None
+
+
+def get_s_lines(
+    sqt_input: SqtInput,
+    sqt_version: Optional[SqtVersion] = None,
+    max_rank: Optional[int] = None,
+    include_l_lines=True,
+    m_line_columns: Optional[Iterable[str]] = None,
+) -> Iterator[SLine]:
+    """
+    Yield the SLines of the sqt input one at a time, each with its M and L lines, so
+    only one S line block is held in memory. The version is determined from the
+    first S line unless given.
+
+    max_rank keeps only M lines with xcorr_rank <= max_rank, include_l_lines=False
+    drops the L lines and m_line_columns converts only the listed M line fields
+    (the others are None). Skipped lines are never split or converted.
+    """
+    for _, s_line in _parse_s_lines(
+        iter_text_lines(sqt_input),
+        None,
+        sqt_version,
+        max_rank,
+        include_l_lines,
+        m_line_columns,
+    ):
+        yield s_line
+
+
+def from_sqt(
+    sqt_input: SqtInput,
+    max_rank: Optional[int] = None,
+    include_l_lines=True,
+    m_line_columns: Optional[Iterable[str]] = None,
+) -> Tuple[SqtVersion, List[str], List[SLine]]:
+    version = None
+    h_lines, s_lines = [], []
+    for version, s_line in _parse_s_lines(
+        iter_text_lines(sqt_input),
+        h_lines,
+        None,
+        max_rank,
+        include_l_lines,
+        m_line_columns,
+    ):
+        if not s_lines:
+            print(f"Version: {version}")
+        s_lines.append(s_line)
     return version, h_lines, s_lines
 
 
-def to_sqt(version: SqtVersion, h_lines: List[str], s_lines: List[SLine]) -> str:
-    lines = []
-    for h_line in h_lines:
-        if h_line.endswith("\n"):
-            lines.append(h_line)
+# array dtype of every sqt column, the same in all versions
+_SQT_COLUMN_DTYPES = {
+    column: {int: np.int64, float: np.float64, str: object}[spec.dtype]
+    for schemas in (_S_LINE_SCHEMAS, _M_LINE_SCHEMAS, _L_LINE_SCHEMAS)
+    for schema in schemas.values()
+    for column, spec in schema.items()
+}
+
+# column names of the S, M and L lines, in file order, for every sqt version
+_S_LINE_COLUMNS = {
+    version: tuple(schema) for version, schema in _S_LINE_SCHEMAS.items()
+}
+_M_LINE_COLUMNS = {
+    version: tuple(schema) for version, schema in _M_LINE_SCHEMAS.items()
+}
+_L_LINE_COLUMNS = {
+    version: tuple(schema) for version, schema in _L_LINE_SCHEMAS.items()
+}
+
+
+@dataclass
+class SqtTables:
+    """
+    Columnar sqt content as three flat tables of numpy arrays. Match k belongs to
+    spectrum matches["spectrum_index"][k] and locus j to match loci["match_index"][j].
+    Integer columns containing NA are float64 with NaN, NA strings are None.
+    """
+
+    version: SqtVersion
+    h_lines: List[str]
+    spectra: Dict[str, np.ndarray]
+    matches: Dict[str, np.ndarray]
+    loci: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.spectra["low_scan"])
+
+    def to_df(self):
+        """spectra, matches and loci as pandas DataFrames."""
+        import pandas as pd
+
+        return (
+            pd.DataFrame(self.spectra, copy=False),
+            pd.DataFrame(self.matches, copy=False),
+            pd.DataFrame(self.loci, copy=False),
+        )
+
+    @staticmethod
+    def concat(sqt_tables: List["SqtTables"]) -> "SqtTables":
+        """Concatenate tables of one sqt version, h_lines are those of the first."""
+        if not sqt_tables:
+            raise ValueError("Cannot concatenate an empty list of SqtTables!")
+        versions = {tables.version for tables in sqt_tables}
+        if len(versions) > 1:
+            raise ValueError(f"Cannot concatenate different sqt versions: {versions}!")
+
+        spectra_offsets = np.cumsum([0] + [len(tables) for tables in sqt_tables])
+        match_offsets = np.cumsum(
+            [0] + [len(tables.matches["spectrum_index"]) for tables in sqt_tables]
+        )
+
+        def _concat(name: str, index_column: str, offsets: np.ndarray):
+            columns = {}
+            for column in getattr(sqt_tables[0], name):
+                arrays = [getattr(tables, name)[column] for tables in sqt_tables]
+                if column == index_column:
+                    arrays = [array + offset for array, offset in zip(arrays, offsets)]
+                columns[column] = np.concatenate(arrays)
+            return columns
+
+        return SqtTables(
+            version=sqt_tables[0].version,
+            h_lines=sqt_tables[0].h_lines,
+            spectra=_concat("spectra", None, spectra_offsets),
+            matches=_concat("matches", "spectrum_index", spectra_offsets),
+            loci=_concat("loci", "match_index", match_offsets),
+        )
+
+    def to_s_lines(self) -> List[SLine]:
+        """Rebuild the SLine/MLine/LLine objects of from_sqt."""
+        s_lines = [
+            SLine(**row, **_missing_fields(SLine, row))
+            for row in _table_rows(self.spectra, _S_LINE_COLUMNS[self.version])
+        ]
+
+        m_lines = []
+        m_rows = _table_rows(self.matches, _M_LINE_COLUMNS[self.version])
+        for spectrum_index, row in zip(self.matches["spectrum_index"].tolist(), m_rows):
+            m_line = MLine(**row, **_missing_fields(MLine, row))
+            s_lines[spectrum_index].m_lines.append(m_line)
+            m_lines.append(m_line)
+
+        l_rows = _table_rows(self.loci, _L_LINE_COLUMNS[self.version])
+        for match_index, row in zip(self.loci["match_index"].tolist(), l_rows):
+            m_lines[match_index].l_lines.append(LLine(**row))
+        return s_lines
+
+
+def _column_values(array: np.ndarray, column: str) -> List:
+    if array.dtype == np.float64:
+        # NaN back to None, int columns with NA are float64
+        convert = int if _SQT_COLUMN_DTYPES[column] is np.int64 else float
+        return [None if v != v else convert(v) for v in array.tolist()]
+    return array.tolist()
+
+
+def _table_rows(
+    table: Dict[str, np.ndarray], columns: Tuple[str, ...]
+) -> List[Dict[str, Union[int, float, str, None]]]:
+    columns = [column for column in columns if column in table]
+    values = [_column_values(table[column], column) for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def _missing_fields(line_class, row: Dict) -> Dict[str, None]:
+    return {
+        name: None
+        for name, line_field in line_class.__dataclass_fields__.items()
+        if name not in row and line_field.default_factory is MISSING
+    }
+
+
+def _lines_to_columns(
+    lines: List[str],
+    schema: Dict[str, ColumnSpec],
+    selected_columns: Optional[Iterable[str]] = None,
+) -> Dict[str, np.ndarray]:
+    columns = list(schema)
+    if selected_columns is not None:
+        selected_columns = set(selected_columns)
+        columns = [column if column in selected_columns else None for column in columns]
+    # the first token is the line type
+    specs = [None] + [None if column is None else schema[column] for column in columns]
+    arrays = decode_columns(lines, specs)
+    return {
+        column: array
+        for column, array in zip(columns, arrays[1:])
+        if column is not None
+    }
+
+
+def from_sqt_to_tables(
+    sqt_input: SqtInput,
+    max_rank: Optional[int] = None,
+    include_l_lines=True,
+    m_line_columns: Optional[Iterable[str]] = None,
+) -> SqtTables:
+    """
+    Parse a sqt file into flat spectra, matches and loci tables (SqtTables) instead
+    of SLine/MLine/LLine objects. The column types are fixed by the sqt version.
+
+    max_rank, include_l_lines and m_line_columns project the matches and loci like
+    in get_s_lines, unselected M line columns are left out of the matches table.
+    """
+    if m_line_columns is not None:
+        m_line_columns = list(m_line_columns)
+        _check_m_line_columns(m_line_columns)
+
+    h_lines, s_lines, m_lines, l_lines = [], [], [], []
+    line_types = []
+    skip_l_lines = not include_l_lines
+    for line in read_text(sqt_input).split("\n"):
+        line_type = line[:1]
+        if line_type == "L":
+            if skip_l_lines:
+                continue
+            l_lines.append(line.rstrip())
+        elif line_type == "M":
+            if max_rank is not None and _m_line_rank_above(line, max_rank):
+                skip_l_lines = True
+                continue
+            skip_l_lines = not include_l_lines
+            m_lines.append(line.rstrip())
+        elif line_type == "S":
+            s_lines.append(line.rstrip())
+        elif line_type == "H":
+            h_lines.append(line)
+            continue
         else:
-            lines.append(h_line + "\n")
-
-    for s_line in s_lines:
-        lines.append(_serialize_s_line(s_line, version))
-        for m_line in s_line.m_lines:
-            lines.append(_serialize_m_line(m_line, version))
-            for l_line in m_line.l_lines:
-                lines.append(_serialize_l_line(l_line, version))
-        lines.append("\n")
-    return "".join(lines[:-1]).rstrip("\n")
+            continue
+        line_types.append(line_type)
+
+    version = determine_sqt_version(s_lines[0]) if s_lines else SqtVersion.V1_4_0
+
+    # the parent of every M (L) line is the last S (M) line before it
+    line_types = np.array(line_types)
+    is_s, is_m = line_types == "S", line_types == "M"
+    spectrum_index = (np.cumsum(is_s) - 1)[is_m]
+    match_index = (np.cumsum(is_m) - 1)[line_types == "L"]
+    if (len(spectrum_index) > 0 and spectrum_index[0] < 0) or (
+        len(match_index) > 0 and match_index[0] < 0
+    ):
+        raise ValueError("Sqt M and L lines must follow an S line!")
+
+    spectra = _lines_to_columns(s_lines, _S_LINE_SCHEMAS[version])
+    matches = _lines_to_columns(m_lines, _M_LINE_SCHEMAS[version], m_line_columns)
+    matches["spectrum_index"] = spectrum_index.astype(np.int64)
+    loci = _lines_to_columns(l_lines, _L_LINE_SCHEMAS[version])
+    loci["match_index"] = match_index.astype(np.int64)
+    return SqtTables(version, h_lines, spectra, matches, loci)
+
+
+@dataclass
+class SqtFileInfo:
+    path: str
+    version: SqtVersion
+    h_lines: List[str]
+    n_spectra: int
+    n_matches: int
+    n_loci: int
+    parse_time: float
+
+
+def _parse_sqt_file(
+    args: Tuple[str, Optional[int], bool, Optional[List[str]]],
+) -> Tuple[SqtTables, float]:
+    sqt_path, max_rank, include_l_lines, m_line_columns = args
+    start_time = time.perf_counter()
+    sqt_tables = from_sqt_to_tables(
+        Path(sqt_path), max_rank, include_l_lines, m_line_columns
+    )
+    return sqt_tables, time.perf_counter() - start_time
+
+
+def from_sqt_files(
+    sqt_paths: Union[str, os.PathLike, Iterable[Union[str, os.PathLike]]],
+    processes: int = 1,
+    max_rank: Optional[int] = None,
+    include_l_lines=True,
+    m_line_columns: Optional[Iterable[str]] = None,
+) -> Tuple[SqtTables, List[SqtFileInfo]]:
+    """
+    Parse many sqt files (a search directory, all *.sqt files in it are used, or a
+    list of paths) into one SqtTables, in a process pool when processes > 1. Workers
+    only return the column arrays. spectra["file_index"] is the position of the file
+    in the returned SqtFileInfo list, which also holds the headers and parse times.
+    """
+    if isinstance(sqt_paths, (str, os.PathLike)) and os.path.isdir(sqt_paths):
+        sqt_paths = sorted(Path(sqt_paths).glob(Ip2FileType.SQT.value))
+    elif isinstance(sqt_paths, (str, os.PathLike)):
+        sqt_paths = [sqt_paths]
+    sqt_paths = [os.fspath(sqt_path) for sqt_path in sqt_paths]
+    if not sqt_paths:
+        raise ValueError("No sqt files to parse!")
+
+    if m_line_columns is not None:
+        m_line_columns = list(m_line_columns)
+        _check_m_line_columns(m_line_columns)
+    args = [
+        (sqt_path, max_rank, include_l_lines, m_line_columns) for sqt_path in sqt_paths
+    ]
+
+    if processes > 1 and len(sqt_paths) > 1:
+        with multiprocessing.Pool(min(processes, len(sqt_paths))) as pool:
+            results = pool.map(_parse_sqt_file, args)
+    else:
+        results = [_parse_sqt_file(arg) for arg in args]
+
+    file_infos = []
+    for file_index, (sqt_path, (sqt_tables, parse_time)) in enumerate(
+        zip(sqt_paths, results)
+    ):
+        sqt_tables.spectra["file_index"] = np.full(
+            len(sqt_tables), file_index, dtype=np.int64
+        )
+        file_infos.append(
+            SqtFileInfo(
+                path=sqt_path,
+                version=sqt_tables.version,
+                h_lines=sqt_tables.h_lines,
+                n_spectra=len(sqt_tables),
+                n_matches=len(sqt_tables.matches["spectrum_index"]),
+                n_loci=len(sqt_tables.loci["match_index"]),
+                parse_time=parse_time,
+            )
+        )
+
+    return SqtTables.concat([sqt_tables for sqt_tables, _ in results]), file_infos
+
+
+def _line_formatter(
+    line_type: str, schema: Dict[str, ColumnSpec]
+) -> Callable[[List[List]], List[str]]:
+    """
+    Format the value lists of all columns at once into lines, the same text as the
+    line encoders (make_column_encoder of every column spec).
+    """
+    encoders = [make_column_encoder(spec) for spec in schema.values()]
+    prefix = line_type + "\t"
+
+    def format_lines(column_values: List[List]) -> List[str]:
+        formatted = [f(values) for f, values in zip(encoders, column_values)]
+        return [prefix + "\t".join(row) + "\n" for row in zip(*formatted)]
+
+    return format_lines
+
+
+class SqtWriter:
+    """
+    Stream header lines and S lines (with their M and L lines) of one sqt version to
+    an open text file handle, or to a (compressed) file with SqtWriter.open.
+
+    The line formatters are built once for the version and S lines are formatted
+    column-wise in batches of batch_size. The output is the same as to_sqt, blank
+    lines between S line blocks and no trailing newline.
+    """
+
+    def __init__(
+        self,
+        file,
+        sqt_version: SqtVersion,
+        buffer_size: int = 1 << 20,
+        batch_size: int = 1024,
+    ):
+        self.file = file
+        self.sqt_version = sqt_version
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self._s_columns = _S_LINE_COLUMNS[sqt_version]
+        self._m_columns = _M_LINE_COLUMNS[sqt_version]
+        self._l_columns = _L_LINE_COLUMNS[sqt_version]
+        self._format_s_lines = _line_formatter("S", _S_LINE_SCHEMAS[sqt_version])
+        self._format_m_lines = _line_formatter("M", _M_LINE_SCHEMAS[sqt_version])
+        self._format_l_lines = _line_formatter("L", _L_LINE_SCHEMAS[sqt_version])
+        self._batch = []
+        self._buffer = []
+        self._buffered = 0
+        # trailing newlines are only written once more text follows
+        self._newlines = ""
+        self._owns_file = False
+
+    @staticmethod
+    def open(
+        sqt_path: Union[str, os.PathLike],
+        sqt_version: SqtVersion,
+        compression: Optional[str] = "infer",
+        level: Optional[int] = None,
+        threads: int = 0,
+        **kwargs,
+    ) -> "SqtWriter":
+        """
+        Write to a file, compressed according to its suffix (.gz, .bz2, .xz, .zst)
+        unless compression is given. The file is closed with the writer.
+        """
+        writer = SqtWriter(
+            open_file(sqt_path, "wt", compression, level, threads),
+            sqt_version,
+            **kwargs,
+        )
+        writer._owns_file = True
+        return writer
+
+    def __enter__(self) -> "SqtWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """Flush the buffer, the file is only closed when opened by the writer."""
+        self.flush()
+        if self._owns_file:
+            self.file.close()
+
+    def _write(self, text: str) -> None:
+        stripped = text.rstrip("\n")
+        if not stripped:
+            self._newlines += text
+            return
+        self._buffer.append(self._newlines + stripped)
+        self._buffered += len(stripped)
+        self._newlines = text[len(stripped) :]
+        if self._buffered >= self.buffer_size:
+            self._flush_buffer()
+
+    def _write_blocks(
+        self,
+        s_texts: List[str],
+        m_texts: List[str],
+        l_texts: List[str],
+        m_counts: List[int],
+        l_counts: List[int],
+    ) -> None:
+        lines = []
+        m_index = l_index = 0
+        for s_text, m_count in zip(s_texts, m_counts):
+            lines.append(s_text)
+            for _ in range(m_count):
+                lines.append(m_texts[m_index])
+                l_count = l_counts[m_index]
+                lines.extend(l_texts[l_index : l_index + l_count])
+                l_index += l_count
+                m_index += 1
+            lines.append("\n")
+        self._write("".join(lines))
+
+    def _write_batch(self) -> None:
+        s_lines, self._batch = self._batch, []
+        if not s_lines:
+            return
+
+        m_lines = [m_line for s_line in s_lines for m_line in s_line.m_lines]
+        l_lines = [l_line for m_line in m_lines for l_line in m_line.l_lines]
+
+        def _columns(lines, columns):
+            if not lines:
+                return [[] for _ in columns]
+            return list(zip(*map(attrgetter(*columns), lines)))
+
+        self._write_blocks(
+            self._format_s_lines(_columns(s_lines, self._s_columns)),
+            self._format_m_lines(_columns(m_lines, self._m_columns)),
+            self._format_l_lines(_columns(l_lines, self._l_columns)),
+            [len(s_line.m_lines) for s_line in s_lines],
+            [len(m_line.l_lines) for m_line in m_lines],
+        )
+
+    def write_header(self, h_lines: List[str]) -> None:
+        self._write_batch()
+        for h_line in h_lines:
+            self._write(h_line if h_line.endswith("\n") else h_line + "\n")
+
+    def write_s_line(self, s_line: SLine) -> None:
+        self._batch.append(s_line)
+        if len(self._batch) >= self.batch_size:
+            self._write_batch()
+
+    def write_s_lines(self, s_lines: Iterable[SLine]) -> int:
+        count = 0
+        for s_line in s_lines:
+            self.write_s_line(s_line)
+            count += 1
+        return count
+
+    def write_tables(self, sqt_tables: SqtTables) -> None:
+        """
+        Write the S, M and L lines of SqtTables (header lines are not written).
+        Columns missing from the tables are written as NA.
+        """
+        if sqt_tables.version != self.sqt_version:
+            raise ValueError(
+                f"Cannot write {sqt_tables.version} tables as {self.sqt_version}!"
+            )
+        self._write_batch()
+
+        spectra, matches, loci = sqt_tables.spectra, sqt_tables.matches, sqt_tables.loci
+        spectrum_index, match_index = matches["spectrum_index"], loci["match_index"]
+        if np.any(np.diff(spectrum_index) < 0) or np.any(np.diff(match_index) < 0):
+            raise ValueError("SqtTables matches and loci must be in file order!")
+
+        m_counts = np.bincount(spectrum_index, minlength=len(sqt_tables))
+        l_counts = np.bincount(match_index, minlength=len(spectrum_index))
+        m_offsets = np.concatenate([[0], np.cumsum(m_counts)])
+        l_offsets = np.concatenate([[0], np.cumsum(l_counts)])
+
+        def _columns(table, columns, start, end):
+            return [
+                (
+                    _column_values(table[column][start:end], column)
+                    if column in table
+                    else [None] * (end - start)
+                )
+                for column in columns
+            ]
+
+        for start in range(0, len(sqt_tables), self.batch_size):
+            end = min(start + self.batch_size, len(sqt_tables))
+            m_start, m_end = m_offsets[start], m_offsets[end]
+            l_start, l_end = l_offsets[m_start], l_offsets[m_end]
+            self._write_blocks(
+                self._format_s_lines(_columns(spectra, self._s_columns, start, end)),
+                self._format_m_lines(
+                    _columns(matches, self._m_columns, m_start, m_end)
+                ),
+                self._format_l_lines(_columns(loci, self._l_columns, l_start, l_end)),
+                m_counts[start:end].tolist(),
+                l_counts[m_start:m_end].tolist(),
+            )
+
+    def _flush_buffer(self) -> None:
+        if self._buffer:
+            self.file.write("".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def flush(self) -> None:
+        self._write_batch()
+        self._flush_buffer()
+
+
+def to_sqt(version: SqtVersion, h_lines: List[str], s_lines: List[SLine]) -> str:
+    output = StringIO()
+    with SqtWriter(output, version) as writer:
+        writer.write_header(h_lines)
+        writer.write_s_lines(s_lines)
+    return output.getvalue()
+
+
+def join_sqt_ms2(
+    sqt_input: SqtInput,
+    ms2: Union[str, os.PathLike, Ms2ScanReader],
+    include_spectra=True,
+    lazy=False,
+    skip_missing=False,
+    match_charge=False,
+    max_rank: Optional[int] = None,
+    include_l_lines=True,
+    m_line_columns: Optional[Iterable[str]] = None,
+    save_index=False,
+) -> Iterator[Tuple[Ms2Spectra, SLine]]:
+    """
+    Stream the S lines of the sqt input and yield (spectrum, s_line) pairs, the
+    spectrum is read from the ms2 file (a path or an open Ms2ScanReader) by its scan
+    index, so only one S line block and one spectrum are held in memory.
+
+    Spectra are matched on low_scan and high_scan, with match_charge also on the
+    charge of the spectrum (when it has one). A missing spectrum raises a ValueError
+    unless skip_missing. max_rank, include_l_lines and m_line_columns are passed to
+    get_s_lines.
+
+    Given a path, the scan index of the ms2 file is built in memory (or loaded when
+    it was saved before), with save_index it is also saved next to the ms2 file
+    (.scan_index.npz) like Ms2ScanReader does by default.
+    """
+    if isinstance(ms2, Ms2ScanReader):
+        reader = ms2
+    else:
+        reader = Ms2ScanReader(ms2, get_ms2_scan_index(ms2, save=save_index))
+    try:
+        spectra = None
+        for s_line in get_s_lines(
+            sqt_input,
+            max_rank=max_rank,
+            include_l_lines=include_l_lines,
+            m_line_columns=m_line_columns,
+        ):
+            # consecutive S lines of one scan (other charges) share the spectrum
+            if spectra is None or spectra.low_scan != s_line.low_scan:
+                if s_line.low_scan in reader:
+                    spectra = reader.get_spectra(s_line.low_scan, include_spectra, lazy)
+                else:
+                    spectra = None
+
+            if (
+                spectra is None
+                or spectra.high_scan != s_line.high_scan
+                or (
+                    match_charge
+                    and spectra.charge is not None
+                    and spectra.charge != s_line.charge
+                )
+            ):
+                if skip_missing:
+                    continue
+                raise ValueError(
+                    f"No spectrum for scan {s_line.low_scan}-{s_line.high_scan} "
+                    f"charge {s_line.charge} in {reader.ms2_path}!"
+                )
+            yield spectra, s_line
+    finally:
+        if reader is not ms2:
+            reader.close()
+
+
+DECOY_PREFIX = "Reverse_"
+
+
+def get_decoy_matches(
+    sqt_tables: SqtTables, decoy_prefix: str = DECOY_PREFIX
+) -> np.ndarray:
+    """
+    True for the matches whose loci are all decoys (locus_name starts with
+    decoy_prefix), matches with at least one target locus or no loci are targets.
+    """
+    n_matches = len(sqt_tables.matches["spectrum_index"])
+    if "locus_name" not in sqt_tables.loci:
+        raise ValueError("Decoy matches need the L lines (locus_name)!")
+    if n_matches > 0 and len(sqt_tables.loci["match_index"]) == 0:
+        raise ValueError("Decoy matches need the L lines, the sqt has none!")
+
+    locus_names = sqt_tables.loci["locus_name"].tolist()
+    is_decoy_locus = np.fromiter(
+        (name is not None and name.startswith(decoy_prefix) for name in locus_names),
+        dtype=bool,
+        count=len(locus_names),
+    )
+    match_index = sqt_tables.loci["match_index"]
+    n_loci = np.bincount(match_index, minlength=n_matches)
+    n_decoy_loci = np.bincount(match_index[is_decoy_locus], minlength=n_matches)
+    return (n_loci > 0) & (n_decoy_loci == n_loci)
+
+
+def compute_q_values(
+    scores: np.ndarray,
+    decoys: np.ndarray,
+    groups: Optional[np.ndarray] = None,
+    higher_is_better=True,
+) -> np.ndarray:
+    """
+    Target-decoy q-values, the lowest decoy/target ratio of all score thresholds
+    that accept the psm, computed separately for every value of groups (e.g. the
+    charge). Tied scores share a q-value, psms with a NaN score get NaN.
+    Sorts once, O(n log n).
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    decoys = np.asarray(decoys, dtype=bool)
+    if groups is None:
+        groups = np.zeros(len(scores), dtype=np.int64)
+    groups = np.asarray(groups)
+    if not len(scores) == len(decoys) == len(groups):
+        raise ValueError("scores, decoys and groups must have the same length!")
+
+    q_values = np.full(len(scores), np.nan)
+    valid = np.flatnonzero(~np.isnan(scores))
+    if len(valid) == 0:
+        return q_values
+
+    # best score first within every group
+    valid_scores = scores[valid] if higher_is_better else -scores[valid]
+    order = valid[np.lexsort((-valid_scores, groups[valid]))]
+    sorted_scores, sorted_groups = scores[order], groups[order]
+    sorted_decoys = decoys[order]
+
+    n = len(order)
+    group_start = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_end = np.r_[group_start[1:], n]
+    group_id = np.repeat(np.arange(len(group_start)), group_end - group_start)
+
+    n_decoys = np.cumsum(sorted_decoys)
+    n_targets = np.arange(1, n + 1) - n_decoys
+    before_group = group_start[group_id] - 1
+    n_decoys_before = np.where(before_group >= 0, n_decoys[before_group], 0)
+    n_targets_before = np.where(before_group >= 0, n_targets[before_group], 0)
+    n_decoys = n_decoys - n_decoys_before
+    n_targets = n_targets - n_targets_before
+
+    # tied psms use the counts at the last psm of their tie
+    is_last = np.r_[
+        (sorted_scores[1:] != sorted_scores[:-1])
+        | (sorted_groups[1:] != sorted_groups[:-1]),
+        True,
+    ]
+    last = np.flatnonzero(is_last)
+    tie_last = last[np.searchsorted(last, np.arange(n))]
+    fdr = np.minimum(n_decoys[tie_last] / np.maximum(n_targets[tie_last], 1), 1.0)
+
+    # q-value: minimum fdr at this or any lower score in the group
+    group_fdr = fdr.copy()
+    for start, end in zip(group_start.tolist(), group_end.tolist()):
+        group_fdr[start:end] = np.minimum.accumulate(fdr[start:end][::-1])[::-1]
+    q_values[order] = group_fdr
+    return q_values
+
+
+def get_q_values(
+    sqt_tables: SqtTables,
+    score: Union[str, np.ndarray] = "xcorr",
+    decoy_prefix: str = DECOY_PREFIX,
+    by_charge=True,
+    max_rank: Optional[int] = 1,
+    higher_is_better=True,
+) -> np.ndarray:
+    """
+    q-values of the sqt matches, score is a matches column (xcorr, delta_cn,
+    tims_score, ...) or an array with one score per match. Only matches with
+    xcorr_rank <= max_rank are scored (NaN otherwise), with by_charge the q-values
+    are computed per spectrum charge.
+    """
+    if isinstance(score, str):
+        if score not in sqt_tables.matches:
+            raise ValueError(f"Score column {score} is not in the matches!")
+        scores = sqt_tables.matches[score].astype(np.float64)
+    else:
+        scores = np.asarray(score, dtype=np.float64).copy()
+    if len(scores) != len(sqt_tables.matches["spectrum_index"]):
+        raise ValueError("score must have one value per match!")
+
+    if max_rank is not None:
+        if "xcorr_rank" not in sqt_tables.matches:
+            raise ValueError("max_rank needs the xcorr_rank column, use max_rank=None!")
+        scores[~(sqt_tables.matches["xcorr_rank"] <= max_rank)] = np.nan
+
+    groups = None
+    if by_charge:
+        groups = sqt_tables.spectra["charge"][sqt_tables.matches["spectrum_index"]]
+    return compute_q_values(
+        scores, get_decoy_matches(sqt_tables, decoy_prefix), groups, higher_is_better
+    )
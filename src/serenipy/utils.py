@@ -1,4 +1,27 @@
-from typing import Callable, Any
+import bz2
+import csv
+import gzip
+import io
+import lzma
+import os
+from dataclasses import MISSING, dataclass, fields
+from operator import attrgetter, itemgetter
+from typing import (
+    IO,
+    Callable,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
 
 
 def serialize_val(val: Any, precision=None) -> str:
@@ -13,3 +36,425 @@ def deserialize_val(val: str, f: Callable) -> Any:
     if val == "NA":
         return None
     return f(val)
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    """
+    How a text column is decoded: dtype is int, float or str, tokens equal to na are
+    missing (None, NaN in float arrays) and strip characters are removed from both
+    ends of the other tokens before conversion (e.g. "%" or "[]").
+
+    When encoding, values are rounded to precision and suffix is appended (also to
+    missing values, like serialize_val(val, precision) + suffix).
+    """
+
+    dtype: Callable = str
+    na: Optional[str] = "NA"
+    strip: Optional[str] = None
+    precision: Optional[int] = None
+    suffix: str = ""
+
+
+_COLUMN_ARRAY_DTYPES = {int: np.int64, float: np.float64, str: object}
+
+
+def _value_converter(spec: ColumnSpec) -> Callable[[str], Any]:
+    dtype, strip = spec.dtype, spec.strip
+    if strip is None:
+        return dtype
+
+    def convert(value: str) -> Any:
+        return dtype(value.strip(strip))
+
+    return convert
+
+
+def decode_column(tokens: Sequence[str], spec: ColumnSpec) -> np.ndarray:
+    """
+    Decode all tokens of a column at once. int columns are int64 (float64 with NaN
+    when there are missing values), float columns float64 and str columns object
+    arrays with None for missing values.
+    """
+    dtype = _COLUMN_ARRAY_DTYPES[spec.dtype]
+    if spec.strip is not None:
+        tokens = [
+            token if token == spec.na else token.strip(spec.strip) for token in tokens
+        ]
+
+    if dtype is object:
+        column = np.array(tokens, dtype=object)
+        if spec.na is not None:
+            column[column == spec.na] = None
+        return column
+
+    if spec.na is not None and spec.na in tokens:
+        tokens = ["nan" if token == spec.na else token for token in tokens]
+        dtype = np.float64
+    convert = int if dtype is np.int64 else float
+    return np.fromiter(map(convert, tokens), dtype, len(tokens))
+
+
+# below this many lines the pandas tokenizer setup costs more than it saves
+_MIN_TOKENIZER_LINES = 5000
+
+
+def decode_columns(
+    lines: Sequence[str], specs: Sequence[Optional[ColumnSpec]], sep: str = "\t"
+) -> List[Optional[np.ndarray]]:
+    """
+    Decode the columns of many lines at once (None skips the column), the values are
+    the same as decode_column gives. Every line must have exactly one token per spec.
+
+    Large batches of numeric columns (sqt M lines) are parsed by the pandas C
+    tokenizer with round trip float precision, columns with strip characters are
+    converted by decode_column. Small batches, where the tokenizer setup dominates,
+    are split once and decoded by decode_column. String heavy lines (DTASelect) are
+    not faster than decoding line by line, only lighter in memory.
+    """
+    n_columns = len(specs)
+    text = "\n".join(lines)
+    if text.count(sep) != len(lines) * (n_columns - 1) or "\r" in text:
+        for line in lines:
+            if line.count(sep) + 1 != n_columns or "\r" in line:
+                raise ValueError(f"Expected {n_columns} columns in line: {line}!")
+
+    used = [i for i, spec in enumerate(specs) if spec is not None]
+    if not lines or not used:
+        return [None if spec is None else decode_column([], spec) for spec in specs]
+
+    if len(lines) < _MIN_TOKENIZER_LINES:
+        tokens = sep.join(lines).split(sep)
+        return [
+            None if spec is None else decode_column(tokens[i::n_columns], spec)
+            for i, spec in enumerate(specs)
+        ]
+
+    import pandas as pd
+
+    # the tokenizer reads utf-8 bytes, a StringIO would hold 4 bytes per character
+    buffer = io.BytesIO(text.encode())
+    text = None
+
+    # strip columns are converted from text, the rest is left to the tokenizer
+    as_text = {i for i in used if specs[i].strip is not None}
+    dtypes = {int: None, float: np.float64, str: object}
+    df = pd.read_csv(
+        buffer,
+        sep=sep,
+        header=None,
+        names=range(n_columns),
+        usecols=used,
+        dtype={
+            i: object if i in as_text else dtypes[specs[i].dtype]
+            for i in used
+            if i in as_text or specs[i].dtype is not int
+        },
+        na_values={
+            i: [specs[i].na]
+            for i in used
+            if specs[i].na is not None and i not in as_text
+        },
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE,
+        skip_blank_lines=False,
+        float_precision="round_trip",
+        engine="c",
+    )
+    buffer = None
+
+    columns = []
+    for i, spec in enumerate(specs):
+        if spec is None:
+            columns.append(None)
+            continue
+        if i in as_text:
+            columns.append(decode_column(df[i].tolist(), spec))
+            continue
+
+        column = df[i].to_numpy(copy=True)
+        if spec.dtype is str:
+            column[pd.isna(column)] = None
+        elif spec.dtype is int and column.dtype != np.int64:
+            # int columns with missing values are float64, anything else is invalid
+            if column.dtype != np.float64 or not np.isnan(column).any():
+                raise ValueError(f"Cannot decode column {i} as {spec.dtype}!")
+        columns.append(column)
+    return columns
+
+
+def make_row_decoder(
+    specs: Sequence[ColumnSpec],
+) -> Callable[[Sequence[str]], Tuple[Any, ...]]:
+    """
+    Build a decoder for the tokens of one line, the converters are set up once.
+    Gives the same values as deserialize_val, None for missing values.
+    """
+    n_columns = len(specs)
+    nas = [spec.na for spec in specs]
+    converters = [_value_converter(spec) for spec in specs]
+
+    def decode_row(tokens: Sequence[str]) -> Tuple[Any, ...]:
+        if len(tokens) < n_columns:
+            raise ValueError(f"Expected {n_columns} columns: {tokens}!")
+        return tuple(
+            [
+                None if token == na else convert(token)
+                for token, na, convert in zip(tokens, nas, converters)
+            ]
+        )
+
+    return decode_row
+
+
+def make_value_encoder(spec: ColumnSpec) -> Callable[[Any], str]:
+    """Encoder of one value, the same text as serialize_val(val, precision) + suffix."""
+    na = "NA" if spec.na is None else spec.na
+    precision, suffix = spec.precision, spec.suffix
+
+    if precision is None:
+
+        def encode(val: Any) -> str:
+            return na if val is None else str(val)
+
+    else:
+
+        def encode(val: Any) -> str:
+            return na if val is None else str(round(val, precision))
+
+    if not suffix:
+        return encode
+
+    def encode_with_suffix(val: Any) -> str:
+        return encode(val) + suffix
+
+    return encode_with_suffix
+
+
+def make_column_encoder(spec: ColumnSpec) -> Callable[[Sequence[Any]], List[str]]:
+    """
+    Encoder of all values of a column at once, the same text as make_value_encoder
+    gives for every value.
+    """
+    na = "NA" if spec.na is None else spec.na
+    precision, suffix = spec.precision, spec.suffix
+    if suffix:
+        encode = make_value_encoder(spec)
+
+        def encode_column(values: Sequence[Any]) -> List[str]:
+            return list(map(encode, values))
+
+    elif precision is None:
+
+        def encode_column(values: Sequence[Any]) -> List[str]:
+            return [na if val is None else str(val) for val in values]
+
+    else:
+
+        def encode_column(values: Sequence[Any]) -> List[str]:
+            return [na if val is None else str(round(val, precision)) for val in values]
+
+    return encode_column
+
+
+def line_template(columns: Sequence[str], prefix: str = "", sep: str = "\t") -> str:
+    """str.format template of a line with the columns in order."""
+    return prefix + sep.join(f"{{{column}}}" for column in columns) + "\n"
+
+
+_NA_TOKEN_SPEC = ColumnSpec(str)
+
+
+def make_line_decoder(
+    line_class,
+    columns: Dict[str, Optional[ColumnSpec]],
+    skip: int = 0,
+    n_required: Optional[int] = None,
+    sep: str = "\t",
+) -> Callable[[str], Any]:
+    """
+    Compile a decoder of one text line into a line_class dataclass, set up once per
+    schema. columns maps the tokens after the first skip tokens, in order, to fields
+    of line_class. Columns with a None spec are ignored and the fields missing from
+    columns are None. Only the first n_required columns must be present, the other
+    trailing columns are None when missing.
+    """
+    args = []
+    for line_field in fields(line_class):
+        if not line_field.init:
+            continue
+        if line_field.default_factory is not MISSING:
+            # left to their factory, the fields after them cannot be positional
+            break
+        args.append(line_field.name)
+    unknown = [column for column in columns if column not in args]
+    if unknown:
+        raise ValueError(f"Unknown {line_class.__name__} columns: {unknown}!")
+
+    names = list(columns)
+    n_tokens = skip + len(names)
+    n_required = n_tokens if n_required is None else skip + n_required
+    padding = [spec.na if spec is not None else "NA" for spec in columns.values()]
+    if None in padding[n_required - skip :]:
+        raise ValueError("Optional columns need a na token!")
+
+    # tokens in argument order, arguments without a column get the appended NA token
+    token_indices = [
+        skip + names.index(name) if columns.get(name) is not None else n_tokens
+        for name in args
+    ]
+    if len(token_indices) == 1:
+        token_index = token_indices[0]
+
+        def get_tokens(tokens: List[str]) -> Tuple[str]:
+            return (tokens[token_index],)
+
+    else:
+        get_tokens = itemgetter(*token_indices)
+    decode_row = make_row_decoder(
+        [columns.get(name) or _NA_TOKEN_SPEC for name in args]
+    )
+
+    def decode(line: str):
+        tokens = line.rstrip().split(sep)
+        if len(tokens) != n_tokens:
+            if len(tokens) < n_required:
+                raise ValueError(f"Expected {n_tokens} columns in line: {line}!")
+            tokens = tokens[:n_tokens] + padding[len(tokens) - skip :]
+        tokens.append("NA")
+        return line_class(*decode_row(get_tokens(tokens)))
+
+    return decode
+
+
+def make_line_encoder(
+    columns: Dict[str, ColumnSpec], prefix: str = "", sep: str = "\t"
+) -> Callable[[Any], str]:
+    """
+    Compile an encoder of a line object (the attributes named by columns) into one
+    text line, the same text as line_template(columns, prefix).format with
+    serialize_val of every column.
+    """
+    get_values = attrgetter(*columns)
+    encoders = [make_value_encoder(spec) for spec in columns.values()]
+    if len(encoders) == 1:
+        encode_value = encoders[0]
+
+        def encode_single(line) -> str:
+            return prefix + encode_value(get_values(line)) + "\n"
+
+        return encode_single
+
+    def encode(line) -> str:
+        values = get_values(line)
+        return prefix + sep.join([f(val) for f, val in zip(encoders, values)]) + "\n"
+
+    return encode
+
+
+def infer_compression(path: Union[str, os.PathLike]) -> Optional[str]:
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(os.fspath(path))[1].lower())
+
+
+def open_file(
+    path: Union[str, os.PathLike],
+    mode: str = "rt",
+    compression: Optional[str] = "infer",
+    level: Optional[int] = None,
+    threads: int = 0,
+):
+    """
+    Open a plain or compressed (gzip, bz2, xz, zstd) file, by default the compression
+    is inferred from the file suffix. Compressed files are decoded while reading.
+
+    level is the compression level of the codec. threads is only supported by zstd
+    (needs the zstandard package), 0 compresses in the calling thread and -1 uses
+    all cores.
+    """
+    if compression == "infer":
+        compression = infer_compression(path)
+
+    if compression is None:
+        return open(path, mode)
+    elif compression == "gzip":
+        return gzip.open(path, mode, compresslevel=9 if level is None else level)
+    elif compression == "bz2":
+        return bz2.open(path, mode, compresslevel=9 if level is None else level)
+    elif compression == "xz":
+        return lzma.open(
+            path, mode, preset=level if "w" in mode or "a" in mode else None
+        )
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is required for zstd compressed files!")
+
+        compressor = None
+        if "w" in mode or "a" in mode:
+            compressor = zstandard.ZstdCompressor(
+                level=3 if level is None else level, threads=threads
+            )
+        return zstandard.open(path, mode, cctx=compressor)
+    else:
+        raise ValueError(f"Unsupported compression: {compression}!")
+
+
+# text, a path (os.PathLike, plain or compressed) or an open text/binary handle
+TextInput = Union[str, bytes, os.PathLike, IO]
+
+
+def iter_text_lines(text_input: TextInput) -> Iterator[str]:
+    """Lines of the input, compressed files and binary handles are decoded."""
+    if isinstance(text_input, str):
+        yield from text_input.split("\n")
+    elif isinstance(text_input, bytes):
+        yield from text_input.decode().split("\n")
+    elif isinstance(text_input, os.PathLike):
+        with open_file(text_input, "rt") as file:
+            yield from file
+    elif isinstance(text_input, io.TextIOBase):
+        yield from text_input
+    elif hasattr(text_input, "read"):
+        text_file = io.TextIOWrapper(text_input)
+        try:
+            yield from text_file
+        finally:
+            # leave the callers handle open
+            text_file.detach()
+    else:
+        raise ValueError(f"Unsupported input type: {type(text_input)}!")
+
+
+def read_text(text_input: TextInput) -> str:
+    """All text of the input, see iter_text_lines."""
+    if isinstance(text_input, str):
+        return text_input
+    elif isinstance(text_input, bytes):
+        return text_input.decode()
+    elif isinstance(text_input, os.PathLike):
+        with open_file(text_input, "rt") as file:
+            return file.read()
+    elif isinstance(text_input, io.TextIOBase):
+        return text_input.read()
+    elif hasattr(text_input, "read"):
+        return text_input.read().decode()
+    else:
+        raise ValueError(f"Unsupported input type: {type(text_input)}!")
+
+
+def read_bytes(text_input: TextInput) -> bytes:
+    """All utf-8 bytes of the input, see iter_text_lines."""
+    if isinstance(text_input, bytes):
+        return text_input
+    elif isinstance(text_input, str):
+        return text_input.encode()
+    elif isinstance(text_input, os.PathLike):
+        with open_file(text_input, "rb") as file:
+            return file.read()
+    elif isinstance(text_input, io.TextIOBase):
+        return text_input.read().encode()
+    elif hasattr(text_input, "read"):
+        return text_input.read()
+    else:
+        raise ValueError(f"Unsupported input type: {type(text_input)}!")
@@ -1,6 +1,11 @@
 import unittest
+from dataclasses import replace
 
-from serenipy.dtaselectfilter import from_dta_select_filter, to_dta_select_filter, DTAFilterResult, PeptideLine
+import numpy as np
+
+from serenipy.dtaselectfilter import from_dta_select_filter, to_dta_select_filter, DTAFilterResult, PeptideLine, \
+    from_dta_select_filter_to_df, \
+    DtaSelectFilterVersion, _serialize_peptide_line, _deserialize_peptide_line
 
 
 class TestDtaSelectFilter(unittest.TestCase):
@@ -195,4 +200,103 @@ class TestDtaSelectFilter(unittest.TestCase):
         self.assertEqual(3, len(result.peptide_lines))
 
         result.filter(level=2) # seq, charge
-        self.assertEqual(2, len(result.peptide_lines))
\ No newline at end of file
+        self.assertEqual(2, len(result.peptide_lines))
+
+    def test_peptide_line_versions(self):
+        peptide_line = PeptideLine(unique='*', file_name='file1.10.10.2', x_corr=2.5, delta_cn=0.25, conf=99.5,
+                                   mass_plus_hydrogen=1000.5, calc_mass_plus_hydrogen=1000.25, ppm=-1.5,
+                                   total_intensity=100.0, spr=1, prob_score=0.5, pi=4.5, ion_proportion=50.0,
+                                   redundancy=2, sequence='K.PEPTIDE.R', ret_time=10.5)
+
+        line = _serialize_peptide_line(peptide_line, DtaSelectFilterVersion.V2_1_12_rt)
+        self.assertEqual(line.count('\t'), 15)
+        self.assertEqual(_deserialize_peptide_line(line, DtaSelectFilterVersion.V2_1_12_rt), peptide_line)
+
+        # the ptm columns of V2_1_13_timscore peptide lines are optional
+        line = _serialize_peptide_line(peptide_line, DtaSelectFilterVersion.V2_1_13_timscore)
+        short_line = line.rsplit('\t', 2)[0]
+        self.assertEqual(_deserialize_peptide_line(short_line, DtaSelectFilterVersion.V2_1_13_timscore),
+                         _deserialize_peptide_line(line, DtaSelectFilterVersion.V2_1_13_timscore))
+        self.assertEqual(_deserialize_peptide_line(line, DtaSelectFilterVersion.V2_1_13_timscore).ret_time, 10.5)
+
+        with self.assertRaises(ValueError):
+            _deserialize_peptide_line(short_line.rsplit('\t', 1)[0], DtaSelectFilterVersion.V2_1_13_timscore)
+
+    def test_to_from_dta_select_filter_V2_1_12_rt(self):
+        with open('data/DTASelect-filter_V2_1_13.txt', 'r') as file:
+            _, head_lines, dta_select_filter_results, tail_lines = from_dta_select_filter(file)
+
+        rt_header = 'Unique\tFileName\tXCorr\tDeltCN\tConf%\tM+H+\tCalcM+H+\tPPM\tTotalIntensity\tSpR\t' \
+                    'Prob Score\tpI\tIonProportion\tRedundancy\tSequence\tRetTime'
+        head_lines = [rt_header if line.startswith('Unique\t') else line for line in head_lines]
+        for result in dta_select_filter_results:
+            result.peptide_lines = [replace(line, measured_im_value=None, predicted_im_value=None, im_score=None,
+                                            ret_time=10.25 + k) for k, line in enumerate(result.peptide_lines)]
+
+        dta_select_filter_str = to_dta_select_filter(DtaSelectFilterVersion.V2_1_12_rt, head_lines,
+                                                     dta_select_filter_results, tail_lines)
+        version, rt_head_lines, rt_results, rt_tail_lines = from_dta_select_filter(dta_select_filter_str)
+        self.assertEqual(version, DtaSelectFilterVersion.V2_1_12_rt)
+        # the columns are written with the precision of the version, conf has one decimal
+        for result, rt_result in zip(dta_select_filter_results, rt_results):
+            self.assertEqual([(line.file_name, line.x_corr, line.ppm, line.pi, line.sequence, line.ret_time)
+                              for line in rt_result.peptide_lines],
+                             [(line.file_name, line.x_corr, line.ppm, line.pi, line.sequence, line.ret_time)
+                              for line in result.peptide_lines])
+        self.assertEqual(rt_results[0].peptide_lines[1].ret_time, 11.25)
+        self.assertEqual(rt_results[0].peptide_lines[0].ppm, -9.1)
+        # parsing a str keeps the empty last line as an end line
+        self.assertEqual(to_dta_select_filter(version, rt_head_lines, rt_results, rt_tail_lines).rstrip('\n'),
+                         dta_select_filter_str.rstrip('\n'))
+
+    def test_dta_select_filter_to_df(self):
+        with open('data/DTASelect-filter_V2_1_13.txt', 'r') as file:
+            version, head_lines, peptide_df, protein_df, tail_lines = from_dta_select_filter_to_df(file)
+        with open('data/DTASelect-filter_V2_1_13.txt', 'r') as file:
+            _, _, dta_select_filter_results, _ = from_dta_select_filter(file)
+
+        peptide_lines = [line for result in dta_select_filter_results for line in result.peptide_lines]
+        protein_lines = [line for result in dta_select_filter_results for line in result.protein_lines]
+        self.assertEqual(len(peptide_df), len(peptide_lines))
+        self.assertEqual(len(protein_df), len(protein_lines))
+        self.assertNotIn('FileName', peptide_df.columns)
+        self.assertEqual(list(peptide_df.columns[-5:]), ['protein_group', 'file_name', 'low_scan', 'high_scan',
+                                                         'charge'])
+
+        self.assertEqual(peptide_df['XCorr'].dtype, np.float64)
+        self.assertEqual(peptide_df['SpR'].dtype, np.int64)
+        self.assertEqual(peptide_df['low_scan'].dtype, np.int64)
+        self.assertEqual(peptide_df['XCorr'].tolist(), [line.x_corr for line in peptide_lines])
+        self.assertEqual(peptide_df['Predicted_IM_Value'].tolist()[0], 1.1519999504089355)
+        self.assertEqual(peptide_df['file_name'].tolist(), [line.file_path for line in peptide_lines])
+        self.assertEqual(peptide_df['low_scan'].tolist(), [line.low_scan for line in peptide_lines])
+        self.assertEqual(peptide_df['charge'].tolist(), [line.charge for line in peptide_lines])
+        self.assertEqual(protein_df['Sequence Coverage'].tolist(), [line.sequence_coverage for line in protein_lines])
+        self.assertEqual(protein_df['Locus'].tolist(), [line.locus_name for line in protein_lines])
+
+        # proteins and peptides of one result share a protein group
+        peptide_groups = [k for k, result in enumerate(dta_select_filter_results) for _ in result.peptide_lines]
+        protein_groups = [k for k, result in enumerate(dta_select_filter_results) for _ in result.protein_lines]
+        self.assertEqual(peptide_df['protein_group'].tolist(), peptide_groups)
+        self.assertEqual(protein_df['protein_group'].tolist(), protein_groups)
+
+        # the scans and charge are the last three FileName components, file names can have dots
+        with open('data/DTASelect-filter_V2_1_13.txt', 'r') as file:
+            dta_select_filter_str = file.read().replace('190806_300ng_180m_03_Slot2-3_1_646_nopd.357198.',
+                                                        'run.v2.357198.', 1)
+        _, _, peptide_df, _, _ = from_dta_select_filter_to_df(dta_select_filter_str)
+        _, _, dta_select_filter_results, _ = from_dta_select_filter(dta_select_filter_str)
+        peptide_line = dta_select_filter_results[0].peptide_lines[0]
+        self.assertEqual(peptide_df['file_name'][0], 'run.v2')
+        self.assertEqual(peptide_line.file_path, 'run.v2')
+        self.assertEqual((peptide_df['low_scan'][0], peptide_df['high_scan'][0], peptide_df['charge'][0]),
+                         (peptide_line.low_scan, peptide_line.high_scan, peptide_line.charge))
+        self.assertEqual(peptide_df['low_scan'].dtype, np.int64)
+
+        # a missing FileName leaves the scans missing (float64 columns)
+        _, _, peptide_df, _, _ = from_dta_select_filter_to_df(
+            dta_select_filter_str.replace('\trun.v2.357198.357198.2\t', '\tNA\t', 1))
+        self.assertTrue(peptide_df['file_name'].isna()[0])
+        self.assertEqual(peptide_df['low_scan'].dtype, np.float64)
+        self.assertTrue(np.isnan(peptide_df['charge'][0]))
+        self.assertEqual(peptide_df['charge'][1], 3)
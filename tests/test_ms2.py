@@ -1,6 +1,23 @@
+import gzip
+import importlib.util
+import os
+import shutil
+import tempfile
 import unittest
+from functools import partial
+from pathlib import Path
+from io import StringIO
 
-from serenipy.ms2 import to_ms2, from_ms2
+import numpy as np
+
+from serenipy.ms2 import to_ms2, from_ms2, from_ms2_arrays, Ms2Spectra, _deserialize_ms2_spectra, _split_ms2_bytes, \
+    Ms2ScanReader, Ms2ScanIndex, get_ms2_scan_index, MS2_SCAN_INDEX_SUFFIX, get_lazy_spectra, \
+    Ms2Writer, Ms2Cache, get_ms2_cache, from_ms2_cache, to_ms2_cache, MS2_CACHE_SUFFIX, \
+    get_info_column, ILineKeywords, get_info_arrays, from_ms2_to_df, \
+    Ms2PrecursorIndex, get_ms2_precursor_index, build_ms2_precursor_index, MS2_PRECURSOR_INDEX_SUFFIX, \
+    Ms2SpectraArrays, filter_top_n, \
+    filter_relative_intensity, merge_peaks, deisotope, preprocess, preprocess_spectra, ISOTOPE_MASS_DIFFERENCE, \
+    get_spectra, get_header, Ms2Follower
 
 
 class TestMs2(unittest.TestCase):
@@ -32,3 +49,524 @@ class TestMs2(unittest.TestCase):
         self.assertEqual(ms2_spectras[0].charge, 1)
         self.assertEqual(ms2_spectras[0].info['TIMSTOF_Parent_ID'], '1')
         self.assertEqual(ms2_spectras[0].info['RetTime'], '0.6534')
+
+    def test_load_ms2_array_backed(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            array_header, array_ms2_spectras = from_ms2(file, array_backed=True)
+
+        self.assertEqual(header, array_header)
+        self.assertEqual(len(ms2_spectras), len(array_ms2_spectras))
+        for spectra, array_spectra in zip(ms2_spectras, array_ms2_spectras):
+            self.assertIsInstance(array_spectra.mz_spectra, np.ndarray)
+            self.assertEqual(array_spectra.mz_spectra.dtype, np.float64)
+            self.assertEqual(array_spectra.intensity_spectra.dtype, np.float32)
+            self.assertEqual(array_spectra.charge_spectra.dtype, np.int8)
+            self.assertEqual(spectra.low_scan, array_spectra.low_scan)
+            self.assertEqual(spectra.mz_spectra, list(array_spectra.mz_spectra))
+            self.assertEqual(spectra.intensity_spectra, list(array_spectra.intensity_spectra))
+            self.assertEqual(spectra.mz_spectra[10], array_spectra.mz_spectra[10])
+
+        self.assertEqual(to_ms2(header, ms2_spectras), to_ms2(array_header, array_ms2_spectras))
+
+        # array backed spectra compare by value, also with list backed spectra
+        self.assertEqual(array_ms2_spectras[0], array_ms2_spectras[0])
+        self.assertEqual(array_ms2_spectras[0], from_ms2(to_ms2(header, ms2_spectras), array_backed=True)[1][0])
+        self.assertEqual(array_ms2_spectras[0], ms2_spectras[0])
+        self.assertNotEqual(array_ms2_spectras[0], array_ms2_spectras[1])
+        self.assertIn(array_ms2_spectras[1], array_ms2_spectras)
+        self.assertEqual(array_ms2_spectras.index(array_ms2_spectras[2]), 2)
+
+        charged_spectra = Ms2Spectra.deserialize('S\t1\t1\t500.0\nZ\t2\t999.0\n100.5 10.0 1\n200.25 20.0 2\n')
+        self.assertEqual(charged_spectra.charge_spectra, [1.0, 2.0])
+        charged_spectra = _deserialize_ms2_spectra(
+            'S\t1\t1\t500.0\nZ\t2\t999.0\n100.5 10.0 1\n200.25 20.0 2\n', array_backed=True)
+        self.assertEqual(list(charged_spectra.charge_spectra), [1, 2])
+        self.assertEqual(charged_spectra.serialize(), 'S\t1\t1\t500.0\nZ\t2\t999.0\n100.5 10.0 1\n200.25 20.0 2\n')
+
+    def test_load_ms2_arrays(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            array_header, ms2_arrays = from_ms2_arrays(file)
+
+        self.assertEqual(len(array_header), 15)
+        self.assertEqual(len(ms2_arrays), 3)
+        self.assertEqual(list(ms2_arrays.low_scan), [2, 4, 5])
+        self.assertEqual(ms2_arrays.offsets[0], 0)
+        self.assertEqual(ms2_arrays.offsets[-1], len(ms2_arrays.mz_spectra))
+        self.assertEqual(list(ms2_arrays.peak_counts), [len(s.mz_spectra) for s in ms2_spectras])
+
+        for i, spectra in enumerate(ms2_spectras):
+            array_spectra = ms2_arrays[i]
+            self.assertTrue(np.shares_memory(array_spectra.mz_spectra, ms2_arrays.mz_spectra))
+            self.assertEqual(spectra.mz_spectra, list(array_spectra.mz_spectra))
+            self.assertEqual(spectra.intensity_spectra, list(array_spectra.intensity_spectra))
+            self.assertEqual(spectra.info, array_spectra.info)
+            self.assertEqual(spectra.mz, array_spectra.mz)
+            self.assertEqual(spectra.charge, array_spectra.charge)
+
+        self.assertEqual(to_ms2(header, ms2_spectras), to_ms2(array_header, ms2_arrays))
+
+    def test_load_ms2_parallel(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            ms2_str = file.read()
+
+        for start, end in _split_ms2_bytes(ms2_str.encode(), 8)[1:]:
+            self.assertTrue(ms2_str.encode()[start:end].startswith(b'S\t'))
+
+        header, ms2_spectras = from_ms2(ms2_str)
+        parallel_header, parallel_ms2_spectras = from_ms2(ms2_str, processes=2)
+
+        self.assertEqual(header, parallel_header)
+        self.assertEqual(ms2_spectras, parallel_ms2_spectras)
+
+        array_header, ms2_arrays = from_ms2_arrays(ms2_str)
+        parallel_array_header, parallel_ms2_arrays = from_ms2_arrays(ms2_str, processes=2)
+
+        self.assertEqual(array_header, parallel_array_header)
+        self.assertEqual(list(ms2_arrays.offsets), list(parallel_ms2_arrays.offsets))
+        self.assertTrue(np.array_equal(ms2_arrays.mz_spectra, parallel_ms2_arrays.mz_spectra))
+
+        # empty input and a single spectrum are not split
+        for ms2_str in ['', ms2_str[:ms2_str.index('\nS', ms2_str.index('S\t') + 1) + 1]]:
+            self.assertEqual(from_ms2(ms2_str), from_ms2(ms2_str, processes=2))
+            array_header, ms2_arrays = from_ms2_arrays(ms2_str)
+            parallel_array_header, parallel_ms2_arrays = from_ms2_arrays(ms2_str, processes=2)
+            self.assertEqual(array_header, parallel_array_header)
+            self.assertEqual(len(ms2_arrays), len(parallel_ms2_arrays))
+            self.assertEqual(list(ms2_arrays.offsets), list(parallel_ms2_arrays.offsets))
+
+    def test_ms2_scan_reader(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ms2_path = os.path.join(tmp_dir, 'sample.ms2')
+            shutil.copy('data/sample.ms2', ms2_path)
+
+            with Ms2ScanReader(ms2_path) as reader:
+                self.assertTrue(os.path.exists(ms2_path + MS2_SCAN_INDEX_SUFFIX))
+                self.assertEqual(len(reader), 3)
+                self.assertEqual(list(reader.index.low_scan), [2, 4, 5])
+                self.assertEqual(list(reader.index.charge), [1, 1, 1])
+                self.assertIn(4, reader)
+                self.assertNotIn(3, reader)
+                self.assertEqual(reader.get_spectra(4), ms2_spectras[1])
+                self.assertEqual(reader.get_spectras([5, 2]), [ms2_spectras[2], ms2_spectras[0]])
+                self.assertRaises(ValueError, reader.get_spectra, 3)
+
+            index = get_ms2_scan_index(ms2_path)
+            self.assertTrue(index.is_current(ms2_path))
+            self.assertEqual(list(index.offsets), list(reader.index.offsets))
+            self.assertEqual(index.find(5), 2)
+
+        # lookups in a large index (scans out of file order) use the sorted scans built once
+        rng = np.random.default_rng(0)
+        n_spectra = 200000
+        low_scans = rng.permutation(n_spectra) * 2 + 1
+        index = Ms2ScanIndex(offsets=np.arange(n_spectra + 1), low_scan=low_scans, high_scan=low_scans,
+                             mz=np.zeros(n_spectra), charge=np.zeros(n_spectra, dtype=np.int64), file_size=n_spectra,
+                             file_mtime_ns=0)
+        sorted_low_scan = index._sorted_low_scan
+        for position in rng.integers(0, n_spectra, 500):
+            self.assertEqual(index.find(low_scans[position]), position)
+            self.assertIsNone(index.find(low_scans[position] + 1))
+        self.assertIsNone(index.find(0))
+        self.assertIsNone(index.find(n_spectra * 2 + 1))
+        self.assertIs(index._sorted_low_scan, sorted_low_scan)
+
+    def test_lazy_ms2_spectra(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            lazy_ms2_spectras = list(get_lazy_spectra(file))
+
+        self.assertEqual(len(lazy_ms2_spectras), 3)
+        for spectra, lazy_spectra in zip(ms2_spectras, lazy_ms2_spectras):
+            self.assertFalse(lazy_spectra.is_decoded)
+            self.assertEqual(spectra.low_scan, lazy_spectra.low_scan)
+            self.assertEqual(spectra.rt, lazy_spectra.rt)
+            self.assertEqual(spectra.info, lazy_spectra.info)
+            self.assertFalse(lazy_spectra.is_decoded)
+            self.assertEqual(spectra.mz_spectra, lazy_spectra.mz_spectra)
+            self.assertTrue(lazy_spectra.is_decoded)
+            self.assertEqual(spectra.intensity_spectra, lazy_spectra.intensity_spectra)
+            self.assertEqual(spectra.serialize(), lazy_spectra.serialize())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ms2_path = os.path.join(tmp_dir, 'sample.ms2')
+            shutil.copy('data/sample.ms2', ms2_path)
+
+            with Ms2ScanReader(ms2_path) as reader:
+                lazy_spectra = reader.get_spectra(5, lazy=True)
+                self.assertEqual(lazy_spectra.mz, ms2_spectras[2].mz)
+                self.assertEqual(list(lazy_spectra.mz_spectra), ms2_spectras[2].mz_spectra)
+                rts = [spectra.rt for spectra in reader.get_lazy_spectra()]
+                self.assertEqual(rts, [spectra.rt for spectra in ms2_spectras])
+
+    def test_ms2_writer(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            _, ms2_spectras_arrays = from_ms2(file, array_backed=True)
+
+        output = StringIO()
+        with Ms2Writer(output, buffer_size=100) as writer:
+            writer.write_header(header)
+            self.assertEqual(writer.write_spectras(iter(ms2_spectras)), 3)
+        self.assertEqual(output.getvalue(), to_ms2(header, ms2_spectras))
+
+        output = StringIO()
+        with Ms2Writer(output) as writer:
+            writer.write_header(header)
+            writer.write_spectras(ms2_spectras_arrays)
+        self.assertEqual(output.getvalue(), to_ms2(header, ms2_spectras))
+
+        ms2_str = to_ms2(header, ms2_spectras, mz_precision=2, intensity_precision=0)
+        self.assertEqual(ms2_str, to_ms2(header, ms2_spectras_arrays, mz_precision=2, intensity_precision=0))
+        _, rounded_ms2_spectras = from_ms2(ms2_str)
+        self.assertEqual(rounded_ms2_spectras[0].mz_spectra[0], round(ms2_spectras[0].mz_spectra[0], 2))
+        self.assertEqual(rounded_ms2_spectras[0].intensity_spectra[0],
+                         round(ms2_spectras[0].intensity_spectra[0], 0))
+
+    def test_ms2_cache(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras_arrays = from_ms2_arrays(file)
+        ms2_str = to_ms2(header, ms2_spectras_arrays)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ms2_path = os.path.join(tmp_dir, 'sample.ms2')
+            shutil.copy('data/sample.ms2', ms2_path)
+
+            cache = get_ms2_cache(ms2_path)
+            self.assertTrue(os.path.exists(ms2_path + MS2_CACHE_SUFFIX))
+            self.assertTrue(cache.is_current(ms2_path))
+
+            cache = Ms2Cache.load(ms2_path + MS2_CACHE_SUFFIX)
+            self.assertEqual(cache.h_lines, header)
+            self.assertEqual(cache.spectra_arrays.info, ms2_spectras_arrays.info)
+            with open('data/sample.ms2', 'r') as file:
+                self.assertEqual(to_ms2(cache.h_lines, cache.spectra_arrays), to_ms2(*from_ms2(file)))
+
+            for compression in [None, 'zlib', 'bz2', 'lzma']:
+                cache_path = os.path.join(tmp_dir, f'sample_{compression}.cache')
+                to_ms2_cache(cache_path, header, ms2_spectras_arrays, compression=compression)
+                cached_header, cached_spectras_arrays = from_ms2_cache(cache_path)
+                self.assertEqual(to_ms2(cached_header, cached_spectras_arrays), ms2_str)
+
+            with self.assertRaises(ValueError):
+                to_ms2_cache(os.path.join(tmp_dir, 'bad.cache'), header, ms2_spectras_arrays, compression='zip')
+
+            with self.assertRaises(ValueError):
+                from_ms2_cache(ms2_path)
+
+            # the cache keeps intensities with more than 7 significant digits (float64)
+            with open('data/sample.ms2', 'r') as file:
+                ms2_text = file.read().rstrip('\n') + '\n2000.0 1234567.89\n2001.0 0.123456789\n'
+            precise_path = os.path.join(tmp_dir, 'precise.ms2')
+            with open(precise_path, 'w') as file:
+                file.write(ms2_text)
+            with open(precise_path, 'r') as file:
+                precise_str = to_ms2(*from_ms2(file))
+            self.assertIn('1234567.89', precise_str)
+            self.assertIn('0.123456789', precise_str)
+
+            cache = get_ms2_cache(precise_path)
+            self.assertEqual(to_ms2(cache.h_lines, cache.spectra_arrays), precise_str)
+            cache = Ms2Cache.load(precise_path + MS2_CACHE_SUFFIX)
+            self.assertEqual(to_ms2(cache.h_lines, cache.spectra_arrays), precise_str)
+            cache = get_ms2_cache(precise_path, intensity_dtype=np.float32)
+            self.assertEqual(cache.spectra_arrays.intensity_spectra.dtype, np.float32)
+
+    def test_typed_info(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            _, ms2_spectras_arrays = from_ms2_arrays(file)
+
+        ms2_spectra = ms2_spectras[0]
+        self.assertEqual(ms2_spectra.rt, float(ms2_spectra.info[ILineKeywords.RETENTION_TIME_KEYWORD.value]))
+        self.assertIsInstance(ms2_spectra.parent_id, int)
+
+        ms2_spectra.rt = 10.5
+        self.assertEqual(ms2_spectra.rt, 10.5)
+        ms2_spectra.info[ILineKeywords.RETENTION_TIME_KEYWORD.value] = '11.25'
+        self.assertEqual(ms2_spectra.rt, 11.25)
+        del ms2_spectra.info[ILineKeywords.RETENTION_TIME_KEYWORD.value]
+        self.assertIsNone(ms2_spectra.rt)
+
+        rts = get_info_column(ms2_spectras_arrays, ILineKeywords.RETENTION_TIME_KEYWORD)
+        self.assertEqual(rts.tolist(), [spectra.rt for spectra in ms2_spectras_arrays])
+        self.assertTrue(np.isnan(ms2_spectras_arrays.ook0).all())
+        parent_ids = ms2_spectras_arrays.get_info_column(ILineKeywords.PARENT_ID_KEYWORD, dtype=np.int64)
+        self.assertEqual(parent_ids.tolist(), [spectra.parent_id for spectra in ms2_spectras_arrays])
+
+        rts = get_info_column(ms2_spectras, 'RetTime')
+        self.assertTrue(np.isnan(rts[0]))
+        self.assertEqual(rts[1:].tolist(), [spectra.rt for spectra in ms2_spectras[1:]])
+        parent_ids = get_info_column(ms2_spectras, ILineKeywords.PARENT_ID_KEYWORD, dtype=np.int64)
+        self.assertEqual(parent_ids.tolist(), [spectra.parent_id for spectra in ms2_spectras])
+
+    def test_info_arrays(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file, array_backed=True)
+
+        for i, ms2_spectra in enumerate(ms2_spectras[:2]):
+            self.assertIsNone(ms2_spectra.ook0_spectra)
+            ms2_spectra.ook0_spectra = np.linspace(0.6, 1.4, len(ms2_spectra.mz_spectra)).astype(np.float32)
+            ms2_spectra.ccs_spectra = [300.5] * len(ms2_spectra.mz_spectra)
+
+        ms2_str = to_ms2(header, ms2_spectras)
+        self.assertIn('I\tOOK0_Spectra\t0.6\t', ms2_str)
+        _, reloaded_ms2_spectras = from_ms2(ms2_str)
+        _, reloaded_ms2_spectras_arrays = from_ms2_arrays(ms2_str)
+
+        for ms2_spectra, reloaded_ms2_spectra in zip(ms2_spectras[:2], reloaded_ms2_spectras):
+            self.assertTrue(np.array_equal(ms2_spectra.ook0_spectra, reloaded_ms2_spectra.ook0_spectra))
+            self.assertEqual(reloaded_ms2_spectra.ccs_spectra.tolist(), [300.5] * len(ms2_spectra.mz_spectra))
+
+        ook0_values, offsets = get_info_arrays(reloaded_ms2_spectras_arrays, ILineKeywords.OOK0_SPECTRA_KEYWORD)
+        n_peaks = [len(spectra.mz_spectra) for spectra in ms2_spectras[:2]]
+        self.assertEqual(offsets.tolist(), [0, n_peaks[0], sum(n_peaks), sum(n_peaks)])
+        self.assertTrue(np.array_equal(ook0_values[offsets[1]:offsets[2]], ms2_spectras[1].ook0_spectra))
+        self.assertEqual(get_info_arrays(ms2_spectras, 'CCS_Spectra')[1].tolist(), offsets.tolist())
+
+        ms2_spectras[2].info[ILineKeywords.OOK0_SPECTRA_KEYWORD.value] = '0.1\tabc'
+        with self.assertRaises(ValueError):
+            ms2_spectras[2].ook0_spectra
+        with self.assertRaises(ValueError):
+            get_info_arrays(ms2_spectras, ILineKeywords.OOK0_SPECTRA_KEYWORD)
+
+    def test_ms2_to_df(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            df_header, spectra_df, peaks_df = from_ms2_to_df(file)
+
+        self.assertEqual(len(df_header), len(header))
+        self.assertEqual(spectra_df['low_scan'].tolist(), [spectra.low_scan for spectra in ms2_spectras])
+        self.assertEqual(spectra_df['RetTime'].tolist(), [spectra.rt for spectra in ms2_spectras])
+        self.assertEqual(spectra_df['TIMSTOF_Parent_ID'].tolist(), [spectra.parent_id for spectra in ms2_spectras])
+        self.assertEqual(len(peaks_df), sum(len(spectra.mz_spectra) for spectra in ms2_spectras))
+
+        scan_peaks_df = peaks_df[peaks_df['low_scan'] == ms2_spectras[1].low_scan]
+        self.assertEqual(scan_peaks_df['mz'].tolist(), ms2_spectras[1].mz_spectra)
+        self.assertEqual(scan_peaks_df['intensity'].tolist(), ms2_spectras[1].intensity_spectra)
+
+        ms2_spectras[0].ook0_spectra = np.full(len(ms2_spectras[0].mz_spectra), 0.9)
+        ms2_spectras[1].info['OOK0_Spectra'] = '0.8'
+        _, spectra_df, peaks_df = from_ms2_to_df(to_ms2(header, ms2_spectras))
+        self.assertEqual(spectra_df['OOK0_Spectra'].tolist()[1], '0.8')
+
+        ms2_spectras[1].ook0_spectra = np.full(len(ms2_spectras[1].mz_spectra), 0.8)
+        ms2_spectras[2].ook0_spectra = np.full(len(ms2_spectras[2].mz_spectra), 0.7)
+        _, spectra_df, peaks_df = from_ms2_to_df(to_ms2(header, ms2_spectras))
+        self.assertNotIn('OOK0_Spectra', spectra_df.columns)
+        self.assertEqual(sorted(set(peaks_df['OOK0_Spectra'])), [0.7, 0.8, 0.9])
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_ms2_to_df_nested(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'r') as file:
+            _, spectra_df, peaks_df = from_ms2_to_df(file, nested_peaks=True)
+
+        self.assertIsNone(peaks_df)
+        self.assertEqual(list(spectra_df['mz_spectra'][1]), ms2_spectras[1].mz_spectra)
+
+    def test_ms2_precursor_index(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        index = Ms2PrecursorIndex.from_spectra(ms2_spectras)
+        self.assertEqual(index.query(rt=(1.0, 2.0)).tolist(), [1, 2])
+        self.assertEqual(index.query_low_scans(mz=(0, ms2_spectras[1].mz), rt=(1.0, 2.0)).tolist(),
+                         [spectra.low_scan for spectra in ms2_spectras[1:] if spectra.mz <= ms2_spectras[1].mz])
+        self.assertEqual(index.query(ook0=(0.5, 1.5)).tolist(), [])
+        self.assertEqual(index.query().tolist(), [0, 1, 2])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ms2_path = os.path.join(tmp_dir, 'sample.ms2')
+            with open(ms2_path, 'w') as file:
+                file.write(to_ms2(header, ms2_spectras[:2]))
+
+            file_index = get_ms2_precursor_index(ms2_path)
+            self.assertTrue(os.path.exists(ms2_path + MS2_PRECURSOR_INDEX_SUFFIX))
+            self.assertEqual(len(file_index), 2)
+            previous_index = file_index
+            previous_index.query(mz=(0, 2000), rt=(0, 10))
+
+            for ms2_spectra in ms2_spectras[2:]:
+                ms2_spectra.ook0 = 0.95
+            with open(ms2_path, 'a') as file:
+                file.write(to_ms2([], ms2_spectras[2:]))
+
+            file_index = get_ms2_precursor_index(ms2_path)
+            self.assertTrue(file_index.is_current(ms2_path))
+            self.assertEqual(file_index.low_scan.tolist(), index.low_scan.tolist())
+            self.assertEqual(file_index.query(rt=(1.0, 2.0)).tolist(), [1, 2])
+            self.assertEqual(file_index.query_low_scans(ook0=(0.9, 1.0)).tolist(), [ms2_spectras[2].low_scan])
+
+            with Ms2ScanReader(ms2_path) as reader:
+                self.assertEqual(reader.get_spectra(ms2_spectras[2].low_scan).ook0, 0.95)
+
+            # the sorted dimensions of an in memory index are extended with the appended spectra
+            file_index = build_ms2_precursor_index(ms2_path, previous_index)
+            for dimension in ('mz', 'rt'):
+                sort_order, values = file_index._sorted[dimension]
+                self.assertEqual(sort_order.tolist(),
+                                 np.argsort(getattr(file_index, dimension), kind='stable').tolist())
+                self.assertTrue(np.array_equal(values, getattr(file_index, dimension)[sort_order], equal_nan=True))
+            self.assertEqual(file_index.query(rt=(1.0, 2.0)).tolist(), [1, 2])
+
+        # repeated queries of a large index search the cached sorted values
+        rng = np.random.default_rng(0)
+        n_spectra = 200000
+        rt = rng.uniform(0, 120, n_spectra)
+        rt[::100] = np.nan
+        index = Ms2PrecursorIndex(low_scan=np.arange(n_spectra), mz=rng.uniform(300, 1500, n_spectra), rt=rt,
+                                  ook0=rng.uniform(0.6, 1.6, n_spectra))
+        for low_mz in rng.uniform(300, 1500, 200):
+            low_rt = low_mz / 15
+            positions = index.query(mz=(low_mz, low_mz + 0.5), rt=(low_rt, low_rt + 30))
+            expected = np.flatnonzero((index.mz >= low_mz) & (index.mz <= low_mz + 0.5)
+                                      & (index.rt >= low_rt) & (index.rt <= low_rt + 30))
+            self.assertEqual(positions.tolist(), expected.tolist())
+        sorted_rt = index._sorted['rt'][1]
+        self.assertEqual(index.query(rt=(0, 120)).tolist(), np.flatnonzero(~np.isnan(rt)).tolist())
+        self.assertIs(index._sorted['rt'][1], sorted_rt)
+
+    def test_preprocess(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            _, ms2_spectras_arrays = from_ms2_arrays(file)
+
+        top_n_arrays = filter_top_n(ms2_spectras_arrays, 10)
+        self.assertEqual(top_n_arrays.peak_counts.tolist(), [10, 10, 10])
+        for spectra, top_n_spectra in zip(ms2_spectras_arrays, top_n_arrays):
+            top_intensities = sorted(spectra.intensity_spectra, reverse=True)[:10]
+            self.assertEqual(sorted(top_n_spectra.intensity_spectra, reverse=True), top_intensities)
+            self.assertTrue(np.all(np.diff(top_n_spectra.mz_spectra) > 0))
+
+        relative_arrays = filter_relative_intensity(ms2_spectras_arrays, 0.5)
+        for spectra, relative_spectra in zip(ms2_spectras_arrays, relative_arrays):
+            keep = spectra.intensity_spectra >= spectra.intensity_spectra.max() * 0.5
+            self.assertEqual(relative_spectra.mz_spectra.tolist(), spectra.mz_spectra[keep].tolist())
+
+        ms2_spectra = Ms2Spectra(low_scan=1, high_scan=1, mz=500.0, mass=999.0, charge=2, info={},
+                                 mz_spectra=[100.0, 100.0005, 200.0, 200.0 + ISOTOPE_MASS_DIFFERENCE / 2, 300.0],
+                                 intensity_spectra=[10.0, 30.0, 50.0, 40.0, 5.0],
+                                 charge_spectra=[1, 1, 2, 2, 1])
+        spectra_arrays = Ms2SpectraArrays.from_spectra([ms2_spectra, ms2_spectra])
+
+        merged_arrays = merge_peaks(spectra_arrays, ppm=10)
+        self.assertEqual(merged_arrays.peak_counts.tolist(), [4, 4])
+        self.assertAlmostEqual(merged_arrays.mz_spectra[0], 100.000375)
+        self.assertEqual(merged_arrays.intensity_spectra[0], 40.0)
+
+        deisotoped_arrays = deisotope(spectra_arrays, ppm=10)
+        self.assertEqual(deisotoped_arrays[1].mz_spectra.tolist(), [100.0, 100.0005, 200.0, 300.0])
+
+        steps = [partial(merge_peaks, ppm=10), deisotope, partial(filter_top_n, n=2)]
+        processed_arrays = preprocess(spectra_arrays, steps)
+        self.assertEqual(processed_arrays[0].mz_spectra[1], 200.0)
+        self.assertAlmostEqual(processed_arrays[0].mz_spectra[0], 100.000375)
+
+        with open('data/sample.ms2', 'r') as file:
+            processed_spectras = list(preprocess_spectra(get_spectra(file), steps, batch_size=2))
+        processed_arrays = preprocess(ms2_spectras_arrays, steps)
+        self.assertEqual(len(processed_spectras), 3)
+        for processed_spectra, spectra in zip(processed_spectras, processed_arrays):
+            self.assertEqual(processed_spectra.low_scan, spectra.low_scan)
+            self.assertEqual(processed_spectra.mz_spectra.tolist(), spectra.mz_spectra.tolist())
+
+    def test_compressed_ms2(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+        ms2_str = to_ms2(header, ms2_spectras)
+
+        suffixes = ['.gz', '.bz2', '.xz']
+        if importlib.util.find_spec('zstandard'):
+            suffixes.append('.zst')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for suffix in suffixes:
+                ms2_path = Path(tmp_dir) / f'sample.ms2{suffix}'
+                with Ms2Writer.open(ms2_path, level=1, threads=2 if suffix == '.zst' else 0) as writer:
+                    writer.write_header(header)
+                    writer.write_spectras(ms2_spectras)
+
+                self.assertNotEqual(ms2_path.read_bytes()[:2], b'H\t')
+                self.assertEqual(get_header(ms2_path), header)
+                self.assertEqual(from_ms2(ms2_path)[1], ms2_spectras)
+                self.assertEqual(list(get_spectra(ms2_path)), ms2_spectras)
+                self.assertEqual(to_ms2(*from_ms2_arrays(ms2_path)), ms2_str)
+
+            ms2_path = os.path.join(tmp_dir, 'sample.ms2.gz')
+            with gzip.open(ms2_path, 'rb') as file:
+                self.assertEqual(list(get_spectra(file)), ms2_spectras)
+                self.assertFalse(file.closed)
+
+            with gzip.open(ms2_path, 'rb') as file:
+                self.assertEqual(from_ms2(file), (header, ms2_spectras))
+
+            with gzip.open(ms2_path, 'rt') as file:
+                self.assertEqual(to_ms2(*from_ms2_arrays(file)), ms2_str)
+
+    def test_ms2_follower(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            header, ms2_spectras = from_ms2(file)
+
+        with open('data/sample.ms2', 'rb') as file:
+            ms2_bytes = file.read()
+        second_start = ms2_bytes.index(b'\nS\t', ms2_bytes.index(b'\nS\t') + 1) + 1
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ms2_path = os.path.join(tmp_dir, 'sample.ms2')
+            with open(ms2_path, 'wb') as file:
+                file.write(ms2_bytes[:second_start - 20])
+
+            with Ms2Follower(ms2_path) as follower:
+                self.assertEqual(follower.poll(), [])
+                self.assertEqual(follower.header, header)
+
+                # the first spectrum is complete once the second S line is written
+                with open(ms2_path, 'ab') as file:
+                    file.write(ms2_bytes[second_start - 20:second_start + 3])
+                self.assertEqual(follower.poll(), [])
+
+                with open(ms2_path, 'ab') as file:
+                    file.write(ms2_bytes[second_start + 3:-10])
+                self.assertEqual(follower.poll(), ms2_spectras[:2])
+                self.assertEqual(follower.poll(), [])
+
+                with open(ms2_path, 'ab') as file:
+                    file.write(ms2_bytes[-10:])
+                self.assertEqual(follower.poll(final=True), ms2_spectras[2:])
+                self.assertEqual(follower.offset, len(ms2_bytes))
+
+            followed_ms2_spectras = list(get_spectra(ms2_path, follow=True, poll_interval=0.01, idle_timeout=0.05))
+            self.assertEqual(followed_ms2_spectras, ms2_spectras)
@@ -1,26 +1,150 @@
 import time
 
-from serenipy.ms2 import from_ms2
+from io import StringIO
+
+from serenipy.dtaselectfilter import from_dta_select_filter, from_dta_select_filter_to_df
+from serenipy.ms2 import from_ms2, from_ms2_arrays
+from serenipy.utils import ColumnSpec, decode_columns, deserialize_val, make_row_decoder
+from serenipy.sqt import from_sqt, from_sqt_to_tables, to_sqt, SqtWriter, _serialize_s_line, _serialize_m_line, \
+    _serialize_l_line
 
 if __name__ == '__main__':
-    start_time = time.time()
 
     with open("C://data//169.ms2", 'r') as file:
     #with open("data/sample.ms2", 'r') as file:
+        ms2_str = file.read()
+
+    for processes in [1, 5, 10]:
+        start_time = time.time()
+        header, ms2_spectras = from_ms2(ms2_str, processes=processes)
+        print(f"from_ms2 processes={processes}: {time.time() - start_time}s ({len(ms2_spectras)})")
+
+    for processes in [1, 5, 10]:
+        start_time = time.time()
+        header, ms2_arrays = from_ms2_arrays(ms2_str, processes=processes)
+        print(f"from_ms2_arrays processes={processes}: {time.time() - start_time}s ({len(ms2_arrays)})")
+
+    with open("C://data//169.sqt", 'r') as file:
+    #with open("data/sqt_V2_1_0_ext.sqt", 'r') as file:
+        sqt_version, h_lines, s_lines = from_sqt(file)
+    sqt_tables = from_sqt_to_tables(to_sqt(sqt_version, h_lines, s_lines))
+
+    # line by line serializers (to_sqt before SqtWriter)
+    start_time = time.time()
+    lines = []
+    for s_line in s_lines:
+        lines.append(_serialize_s_line(s_line, sqt_version))
+        for m_line in s_line.m_lines:
+            lines.append(_serialize_m_line(m_line, sqt_version))
+            for l_line in m_line.l_lines:
+                lines.append(_serialize_l_line(l_line, sqt_version))
+        lines.append("\n")
+    sqt_str = "".join(lines[:-1]).rstrip("\n")
+    elapsed = time.time() - start_time
+    print(f"serialize lines: {elapsed}s ({len(sqt_str) / elapsed / 1e6:.1f} MB/s)")
+
+    start_time = time.time()
+    with SqtWriter(StringIO(), sqt_version) as writer:
+        writer.write_s_lines(s_lines)
+    elapsed = time.time() - start_time
+    print(f"SqtWriter.write_s_lines: {elapsed}s ({len(sqt_str) / elapsed / 1e6:.1f} MB/s)")
+
+    start_time = time.time()
+    with SqtWriter(StringIO(), sqt_version) as writer:
+        writer.write_tables(sqt_tables)
+    elapsed = time.time() - start_time
+    print(f"SqtWriter.write_tables: {elapsed}s ({len(sqt_str) / elapsed / 1e6:.1f} MB/s)")
+
+    # per line decoding of sqt M lines, DTASelect-filter peptide lines and census experiment columns
+    with open("data/sqt_V2_1_0_ext.sqt", 'r') as file:
+        m_lines = [line.rstrip('\n').split('\t')[1:] for line in file if line.startswith('M')]
+    with open("data/DTASelect-filter_V2_1_13.txt", 'r') as file:
+        peptide_lines = [line.rstrip('\n').split('\t') for line in file if line.startswith('*\t')]
+    with open("data/census.txt", 'r') as file:
+        experiment_lines = [line.rstrip('\n').split('\t')[1:22] for line in file if line.startswith('S\t')]
 
-        header, ms2_spectras = from_ms2(file.read(), processes=5)
-        print(len(ms2_spectras))
-        print(ms2_spectras[-1])
+    benchmarks = {
+        'sqt M line': (m_lines, [int, int, float, float, float, float, int, int, str, str, float, float, float,
+                                 float], {}),
+        'DTASelect-filter peptide line': (peptide_lines, [str, str, float, float, float, float, float, float,
+                                                          float, int, float, float, float, int, float, float,
+                                                          float, str], {}),
+        'census experiment line': (experiment_lines, [int, str, str, int, int, float, int, float, float, float,
+                                                      float, float, float, float, int, float, int, float, float,
+                                                      float, float], {0: '[]'}),
+    }
+    for name, (rows, types, strips) in benchmarks.items():
+        rows = (rows * (200000 // len(rows) + 1))[:200000]
+        lines = ['\t'.join(row) for row in rows]
+        specs = [ColumnSpec(t, strip=strips.get(i)) for i, t in enumerate(types)]
+        converters = [t if i not in strips else (lambda x, c=strips[i], t=t: t(x.strip(c)))
+                      for i, t in enumerate(types)]
 
-    print(time.time() - start_time)
+        start_time = time.time()
+        for line in lines:
+            row = line.split('\t')
+            [deserialize_val(val, f) for val, f in zip(row, converters)]
+        deserialize_time = time.time() - start_time
 
-# 2021806_ANL-1
+        decode_row = make_row_decoder(specs)
+        start_time = time.time()
+        for line in lines:
+            decode_row(line.split('\t'))
+        row_decoder_time = time.time() - start_time
+
+        start_time = time.time()
+        decode_columns(lines, specs)
+        columns_time = time.time() - start_time
+
+        start_time = time.time()
+        for i in range(0, len(lines), 100):
+            decode_columns(lines[i:i + 100], specs)
+        small_columns_time = time.time() - start_time
+
+        print(f"{name}: deserialize_val {deserialize_time / len(rows) * 1e6:.2f}us/line, "
+              f"make_row_decoder {row_decoder_time / len(rows) * 1e6:.2f}us/line, "
+              f"decode_columns {columns_time / len(rows) * 1e6:.2f}us/line, "
+              f"decode_columns (100 lines) {small_columns_time / len(rows) * 1e6:.2f}us/line")
+
+    with open("C://data//DTASelect-filter.txt", 'r') as file:
+    #with open("data/DTASelect-filter_V2_1_13.txt", 'r') as file:
+        dta_select_filter_str = file.read()
+
+    start_time = time.time()
+    from_dta_select_filter(dta_select_filter_str)
+    print(f"from_dta_select_filter: {time.time() - start_time}s")
+
+    start_time = time.time()
+    _, _, peptide_df, protein_df, _ = from_dta_select_filter_to_df(dta_select_filter_str)
+    print(f"from_dta_select_filter_to_df: {time.time() - start_time}s ({len(peptide_df)} peptides)")
+
+# 2021806_ANL-1 (line parser, ms2_spectra_consumer queue)
 # multi_process=1: 19s
 # multi_process=5: 26s
 
-# 169
+# 169 (line parser, ms2_spectra_consumer queue)
 # multi_process=1: 30s (48009)
 # multi_process=5: 32s (48009)
 # multi_process=10: 30s (48009)
 
+# 85MB ms2 (sample.ms2 x10000, 30000 spectra), measured on a single core machine so
+# the pool only adds overhead there, rerun on a multi core machine for the scaling
+# from_ms2 processes=1: 7.7s, processes=5: 7.3s, processes=10: 4.2s
+# from_ms2_arrays processes=1: 1.7s, processes=5: 2.9s, processes=10: 3.2s
+
+# 46MB V2_1_0_ext sqt (116000 S lines, 296000 M lines)
+# serialize lines: 4.3s (10.8 MB/s)
+# SqtWriter.write_s_lines: 2.7s (17.3 MB/s)
+# SqtWriter.write_tables: 2.0s (22.7 MB/s)
+
+# 200000 lines (split + decode, decode_columns includes tokenizing the lines), noisy single core machine
+# sqt M line: deserialize_val 2.2-2.7us, make_row_decoder 2.2-2.8us, decode_columns 1.7-2.9us, 100 line batches 1.4-1.9us
+# DTASelect-filter peptide line: deserialize_val 2.7-3.5us, make_row_decoder 2.4-3.4us, decode_columns 2.6-4.0us,
+#   100 line batches 1.9-2.6us
+# census experiment line: deserialize_val 2.7-3.7us, make_row_decoder 2.5-3.4us, decode_columns 2.2-3.7us,
+#   100 line batches 2.3-3.0us
+# the pandas tokenizer only pays off on large numeric batches (sqt M lines), it costs ~1ms per call
 
+# 67MB V2_1_13 DTASelect-filter (339000 peptide lines)
+# from_dta_select_filter_to_df (cell lists, convert_to_best_datatype): 7.5s, peak 569 MB
+# from_dta_select_filter_to_df (columnar, schema types): 2.0-2.3s, peak 221 MB (DataFrames 85 MB)
@@ -0,0 +1,102 @@
+import unittest
+
+import numpy as np
+
+from serenipy.ms2 import from_ms2, from_ms2_arrays, Ms2Spectra
+from serenipy.similarity import bin_spectra, score_spectra, cosine_similarity
+
+
+def _cosine(spectra_1, spectra_2, bin_width):
+    vectors = []
+    for spectra in (spectra_1, spectra_2):
+        vector = {}
+        for mz, intensity in zip(spectra.mz_spectra, spectra.intensity_spectra):
+            mz_bin = int(np.floor(mz / bin_width))
+            vector[mz_bin] = vector.get(mz_bin, 0.0) + intensity ** 0.5
+        vectors.append(vector)
+    dot = sum(value * vectors[1].get(mz_bin, 0.0) for mz_bin, value in vectors[0].items())
+    norms = [sum(value ** 2 for value in vector.values()) ** 0.5 for vector in vectors]
+    return dot / (norms[0] * norms[1])
+
+
+class TestSimilarity(unittest.TestCase):
+
+    def test_bin_spectra(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            _, ms2_spectras_arrays = from_ms2_arrays(file)
+
+        binned_spectra = bin_spectra(ms2_spectras_arrays, bin_width=1.0)
+        self.assertEqual(len(binned_spectra), 3)
+        for k in range(3):
+            bins = binned_spectra.bins[binned_spectra.offsets[k]:binned_spectra.offsets[k + 1]]
+            weights = binned_spectra.weights[binned_spectra.offsets[k]:binned_spectra.offsets[k + 1]]
+            self.assertTrue(np.all(np.diff(bins) > 0))
+            self.assertAlmostEqual(float(np.sum(weights.astype(np.float64) ** 2)), 1.0, places=5)
+        self.assertEqual(binned_spectra.precursor_mass.tolist(), ms2_spectras_arrays.mass.tolist())
+
+    def test_cosine_similarity(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            _, ms2_spectras = from_ms2(file)
+
+        query_index, library_index, scores = cosine_similarity(ms2_spectras, bin_width=0.5)
+        self.assertEqual(sorted(zip(query_index.tolist(), library_index.tolist())), [(0, 1), (0, 2), (1, 2)])
+        self.assertGreaterEqual(scores[0], scores[1])
+        for i, j, score in zip(query_index, library_index, scores):
+            self.assertAlmostEqual(score, _cosine(ms2_spectras[i], ms2_spectras[j], 0.5), places=5)
+
+        query_index, library_index, scores = cosine_similarity(ms2_spectras, ms2_spectras, bin_width=0.5, top_k=1)
+        self.assertEqual(query_index.tolist(), [0, 1, 2])
+        self.assertEqual(library_index.tolist(), [0, 1, 2])
+        self.assertTrue(np.allclose(scores, 1.0))
+
+        shifted_spectra = Ms2Spectra(low_scan=1, high_scan=1, mz=100.0, mass=199.0, charge=2, info={},
+                                     mz_spectra=ms2_spectras[0].mz_spectra,
+                                     intensity_spectra=ms2_spectras[0].intensity_spectra,
+                                     charge_spectra=[])
+        query_index, library_index, scores = cosine_similarity([shifted_spectra], ms2_spectras, bin_width=0.5,
+                                                               precursor_tolerance=1.0)
+        self.assertEqual(len(scores), 0)
+
+    def test_score_spectra_blocks(self):
+
+        with open('data/sample.ms2', 'r') as file:
+            _, ms2_spectras_arrays = from_ms2_arrays(file)
+
+        binned_spectra = bin_spectra(ms2_spectras_arrays, bin_width=0.5)
+        expected = score_spectra(binned_spectra, binned_spectra)
+        for block_size, processes in [(1, 1), (2, 1), (2, 2)]:
+            result = score_spectra(binned_spectra, binned_spectra, block_size=block_size, processes=processes)
+            for expected_column, column in zip(expected, result):
+                self.assertTrue(np.allclose(expected_column, column))
+
+        with self.assertRaises(ValueError):
+            score_spectra(binned_spectra, block_size=0)
+
+    def test_score_spectra_top_k(self):
+
+        # 0 and 1 share two peaks, 2 only matches 0 and 3 matches nothing
+        peaks = [[100.0, 200.0, 300.0], [100.0, 200.0, 350.0], [300.0, 600.0, 700.0], [900.0, 1000.0]]
+        ms2_spectras = [Ms2Spectra(low_scan=k, high_scan=k, mz=500.0, mass=999.0, charge=2, info={},
+                                   mz_spectra=mz_spectra, intensity_spectra=[1.0] * len(mz_spectra),
+                                   charge_spectra=[])
+                        for k, mz_spectra in enumerate(peaks * 3)]
+        binned_spectra = bin_spectra(ms2_spectras[:4], bin_width=1.0)
+
+        # every spectrum keeps its own best neighbour, 2 is not dropped because 0 prefers 1
+        for block_size, processes in [(1000, 1), (1, 1), (2, 1), (2, 2)]:
+            query_index, library_index, scores = score_spectra(binned_spectra, top_k=1, block_size=block_size,
+                                                               processes=processes)
+            self.assertEqual(list(zip(query_index.tolist(), library_index.tolist())), [(0, 1), (1, 0), (2, 0)])
+            self.assertTrue(np.allclose(scores, [2 / 3, 2 / 3, 1 / 3]))
+
+        # the same neighbours as the top_k of the full query x library scores without the self matches
+        binned_spectra = bin_spectra(ms2_spectras, bin_width=1.0)
+        query_index, library_index, scores = score_spectra(binned_spectra, top_k=2, block_size=5)
+        all_query_index, all_library_index, all_scores = score_spectra(binned_spectra, binned_spectra)
+        not_self = all_query_index != all_library_index
+        for k in range(len(ms2_spectras)):
+            expected = np.sort(all_scores[not_self & (all_query_index == k)])[::-1][:2]
+            self.assertTrue(np.allclose(scores[query_index == k], expected))
+            self.assertNotIn(k, library_index[query_index == k].tolist())
@@ -1,7 +1,28 @@
+import os
+import shutil
+import tempfile
 import unittest
+from io import StringIO
+from pathlib import Path
 
+import numpy as np
 
-from serenipy.sqt import from_sqt, to_sqt
+from serenipy.ms2 import Ms2Spectra, to_ms2, Ms2ScanReader, MS2_SCAN_INDEX_SUFFIX
+from serenipy.sqt import from_sqt, to_sqt, from_sqt_to_tables, SqtVersion, get_header, get_s_lines, \
+    get_sqt_version, from_sqt_files, SqtWriter, _serialize_s_line, _serialize_m_line, _serialize_l_line, \
+    join_sqt_ms2, compute_q_values, get_q_values, get_decoy_matches, _m_line_rank_above
+
+
+def _to_sqt_lines(sqt_version, h_lines, s_lines):
+    lines = [h_line if h_line.endswith('\n') else h_line + '\n' for h_line in h_lines]
+    for s_line in s_lines:
+        lines.append(_serialize_s_line(s_line, sqt_version))
+        for m_line in s_line.m_lines:
+            lines.append(_serialize_m_line(m_line, sqt_version))
+            for l_line in m_line.l_lines:
+                lines.append(_serialize_l_line(l_line, sqt_version))
+        lines.append('\n')
+    return ''.join(lines[:-1]).rstrip('\n')
 
 
 class TestSqt(unittest.TestCase):
@@ -153,3 +174,208 @@ class TestSqt(unittest.TestCase):
 
         sqt_str = to_sqt(sqt_version, h_lines, s_lines)
         sqt_version, h_lines, s_lines = from_sqt(sqt_str)
+
+    def test_sqt_tables(self):
+
+        for sqt_path in ['data/sqt_V1_4_0.sqt', 'data/sqt_V2_1_0.sqt', 'data/sqt_V2_1_0_ext.sqt']:
+            with open(sqt_path, 'r') as file:
+                sqt_version, h_lines, s_lines = from_sqt(file)
+
+            sqt_tables = from_sqt_to_tables(Path(sqt_path))
+            self.assertEqual(sqt_tables.version, sqt_version)
+            self.assertEqual(len(sqt_tables.h_lines), len(h_lines))
+            self.assertEqual(len(sqt_tables), len(s_lines))
+            self.assertEqual(sqt_tables.to_s_lines(), s_lines)
+
+        with open('data/sqt_V2_1_0.sqt', 'r') as file:
+            sqt_tables = from_sqt_to_tables(file)
+
+        self.assertEqual(sqt_tables.version, SqtVersion.V2_1_0)
+        self.assertEqual(sqt_tables.spectra['low_scan'].dtype, np.int64)
+        self.assertEqual(sqt_tables.spectra['experimental_ook0'][0], 1.0633)
+        self.assertEqual(sqt_tables.matches['spectrum_index'].tolist(), [0] * 5 + [1] * 5)
+        self.assertEqual(sqt_tables.matches['sequence'][0], 'R.TALLESDEHTCPTCHQNDVSPDALIANK.F')
+        self.assertTrue(np.isnan(sqt_tables.matches['predicted_ook0'][2]))
+        self.assertNotIn('tims_b_score_m2', sqt_tables.matches)
+        self.assertEqual(sqt_tables.loci['match_index'].tolist(), list(range(10)))
+        self.assertEqual(sqt_tables.loci['locus_name'][0], 'sp|Q7Z6E9|RBBP6_HUMAN')
+
+        spectra_df, matches_df, loci_df = sqt_tables.to_df()
+        self.assertEqual(len(spectra_df), 3)
+        self.assertEqual(len(matches_df), 10)
+        self.assertEqual(len(loci_df), 10)
+
+        with self.assertRaises(ValueError):
+            from_sqt_to_tables('S\t1\t1\t2\t1\tserver\t1000.0\t1.0\t0.0\t1\nM\t1\t1\n')
+
+    def test_get_s_lines(self):
+
+        with open('data/sqt_V2_1_0_ext.sqt', 'r') as file:
+            sqt_version, h_lines, s_lines = from_sqt(file)
+
+        self.assertEqual(get_header(Path('data/sqt_V2_1_0_ext.sqt')), h_lines)
+        self.assertEqual(get_sqt_version(Path('data/sqt_V2_1_0_ext.sqt')), sqt_version)
+
+        with open('data/sqt_V2_1_0_ext.sqt', 'rb') as file:
+            s_line_iter = get_s_lines(file)
+            self.assertEqual(next(s_line_iter), s_lines[0])
+            self.assertEqual(list(s_line_iter), s_lines[1:])
+
+        sqt_str = to_sqt(sqt_version, h_lines, s_lines[:2])
+        self.assertEqual(list(get_s_lines(sqt_str)), from_sqt(sqt_str)[2])
+
+        with self.assertRaises(ValueError):
+            list(get_s_lines('M\t1\t1\n'))
+
+    def test_sqt_projection(self):
+
+        with open('data/sqt_V2_1_0.sqt', 'r') as file:
+            sqt_version, h_lines, s_lines = from_sqt(file)
+
+        sqt_version, h_lines, top_s_lines = from_sqt(Path('data/sqt_V2_1_0.sqt'), max_rank=2)
+        self.assertEqual(len(top_s_lines), len(s_lines))
+        for s_line, top_s_line in zip(s_lines, top_s_lines):
+            self.assertEqual(top_s_line.m_lines, [m_line for m_line in s_line.m_lines if m_line.xcorr_rank <= 2])
+
+        top_s_lines = list(get_s_lines(Path('data/sqt_V2_1_0.sqt'), max_rank=1, include_l_lines=False,
+                                       m_line_columns=['xcorr', 'sequence']))
+        self.assertEqual([len(s_line.m_lines) for s_line in top_s_lines], [1, 1, 0])
+        m_line = top_s_lines[0].m_lines[0]
+        self.assertEqual(m_line.xcorr, 0.9294)
+        self.assertEqual(m_line.sequence, 'R.TALLESDEHTCPTCHQNDVSPDALIANK.F')
+        self.assertIsNone(m_line.xcorr_rank)
+        self.assertEqual(m_line.l_lines, [])
+
+        sqt_tables = from_sqt_to_tables(Path('data/sqt_V2_1_0.sqt'), max_rank=2, m_line_columns=['xcorr'])
+        self.assertEqual(sorted(sqt_tables.matches), ['spectrum_index', 'xcorr'])
+        self.assertEqual(sqt_tables.matches['spectrum_index'].tolist(), [0, 0, 1, 1])
+        self.assertEqual(sqt_tables.loci['match_index'].tolist(), [0, 1, 2, 3])
+        self.assertEqual(sqt_tables.loci['locus_name'][3], 'Reverse_sp|Q96F46|I17RA_HUMAN')
+
+        # the rank is read without converting the line, also when it is the last token
+        self.assertTrue(_m_line_rank_above('M\t12', 2))
+        self.assertTrue(_m_line_rank_above('M\t12\n', 2))
+        self.assertFalse(_m_line_rank_above('M\t2\t5\t1.0', 2))
+        self.assertFalse(_m_line_rank_above('M\tNA\n', 2))
+
+        with self.assertRaises(ValueError):
+            from_sqt(Path('data/sqt_V2_1_0.sqt'), m_line_columns=['xcor'])
+
+    def test_from_sqt_files(self):
+
+        sqt_tables = from_sqt_to_tables(Path('data/sqt_V2_1_0.sqt'))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ['run_1.sqt', 'run_2.sqt']:
+                shutil.copy('data/sqt_V2_1_0.sqt', Path(tmp_dir) / name)
+
+            for processes in [1, 2]:
+                merged_tables, file_infos = from_sqt_files(tmp_dir, processes=processes)
+                self.assertEqual([Path(file_info.path).name for file_info in file_infos], ['run_1.sqt', 'run_2.sqt'])
+                self.assertEqual([file_info.n_matches for file_info in file_infos], [10, 10])
+                self.assertEqual(file_infos[1].h_lines, sqt_tables.h_lines)
+                self.assertGreater(file_infos[0].parse_time, 0)
+
+                self.assertEqual(merged_tables.spectra['file_index'].tolist(), [0, 0, 0, 1, 1, 1])
+                self.assertEqual(merged_tables.matches['spectrum_index'].tolist(),
+                                 sqt_tables.matches['spectrum_index'].tolist() +
+                                 (sqt_tables.matches['spectrum_index'] + 3).tolist())
+                self.assertEqual(merged_tables.loci['match_index'].tolist(), list(range(20)))
+                self.assertEqual(merged_tables.to_s_lines()[3:], sqt_tables.to_s_lines())
+
+        merged_tables, file_infos = from_sqt_files(['data/sqt_V2_1_0.sqt'], max_rank=1)
+        self.assertEqual(merged_tables.matches['xcorr_rank'].tolist(), [1, 1])
+
+        with self.assertRaises(ValueError):
+            from_sqt_files(['data/sqt_V1_4_0.sqt', 'data/sqt_V2_1_0.sqt'])
+
+    def test_sqt_writer(self):
+
+        for sqt_path in ['data/sqt_V1_4_0.sqt', 'data/sqt_V2_1_0.sqt', 'data/sqt_V2_1_0_ext.sqt']:
+            with open(sqt_path, 'r') as file:
+                sqt_version, h_lines, s_lines = from_sqt(file)
+
+            expected = _to_sqt_lines(sqt_version, h_lines, s_lines)
+            self.assertEqual(to_sqt(sqt_version, h_lines, s_lines), expected)
+
+            output = StringIO()
+            with SqtWriter(output, sqt_version, buffer_size=100, batch_size=3) as writer:
+                writer.write_header(h_lines)
+                self.assertEqual(writer.write_s_lines(s_lines), len(s_lines))
+            self.assertEqual(output.getvalue(), expected)
+
+            output = StringIO()
+            with SqtWriter(output, sqt_version, batch_size=2) as writer:
+                writer.write_header(h_lines)
+                writer.write_tables(from_sqt_to_tables(Path(sqt_path)))
+            self.assertEqual(output.getvalue(), expected)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sqt_path = Path(tmp_dir) / 'out.sqt.gz'
+            with SqtWriter.open(sqt_path, sqt_version) as writer:
+                writer.write_header(h_lines)
+                writer.write_s_lines(s_lines)
+            self.assertEqual(from_sqt(sqt_path)[2], from_sqt(expected)[2])
+
+    def test_join_sqt_ms2(self):
+
+        sqt_version, h_lines, s_lines = from_sqt(Path('data/sqt_V2_1_0.sqt'))
+
+        ms2_spectras = [Ms2Spectra(low_scan=scan, high_scan=scan, mz=1046.5, mass=3136.4, charge=charge, info={},
+                                   mz_spectra=[100.0, 200.0], intensity_spectra=[10.0, 20.0], charge_spectra=[])
+                        for scan, charge in [(1, 2), (194118, 3), (236068, 2)]]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ms2_path = str(Path(tmp_dir) / 'run.ms2')
+            with open(ms2_path, 'w') as file:
+                file.write(to_ms2(['H\tExtractor\tMakeMS2'], ms2_spectras))
+
+            with self.assertRaises(ValueError):
+                list(join_sqt_ms2(Path('data/sqt_V2_1_0.sqt'), ms2_path))
+
+            pairs = list(join_sqt_ms2(Path('data/sqt_V2_1_0.sqt'), ms2_path, skip_missing=True))
+            self.assertEqual([(ms2_spectra.low_scan, s_line) for ms2_spectra, s_line in pairs],
+                             [(194118, s_lines[0]), (236068, s_lines[1])])
+            self.assertEqual(os.listdir(tmp_dir), ['run.ms2'])
+            list(join_sqt_ms2(Path('data/sqt_V2_1_0.sqt'), ms2_path, skip_missing=True, save_index=True))
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['run.ms2', 'run.ms2' + MS2_SCAN_INDEX_SUFFIX])
+            self.assertEqual(list(pairs[0][0].mz_spectra), [100.0, 200.0])
+
+            with Ms2ScanReader(ms2_path) as reader:
+                pairs = list(join_sqt_ms2(Path('data/sqt_V2_1_0.sqt'), reader, skip_missing=True,
+                                          match_charge=True, max_rank=1, lazy=True))
+                self.assertEqual([s_line.low_scan for _, s_line in pairs], [194118])
+                self.assertEqual(len(pairs[0][1].m_lines), 1)
+
+    def test_q_values(self):
+
+        scores = np.array([10.0, 9.0, 8.0, 8.0, 7.0, 6.0, np.nan, 5.0])
+        decoys = np.array([False, False, True, False, False, True, False, True])
+        q_values = compute_q_values(scores, decoys)
+        self.assertTrue(np.allclose(q_values, [0, 0, 0.25, 0.25, 0.25, 0.5, np.nan, 0.75], equal_nan=True))
+        self.assertTrue(np.allclose(compute_q_values(-scores, decoys, higher_is_better=False), q_values,
+                                    equal_nan=True))
+
+        groups = np.array([1, 2, 1, 2, 1, 2, 1, 2])
+        q_values = compute_q_values(scores, decoys, groups)
+        self.assertTrue(np.allclose(q_values, [0, 0, 0.5, 0, 0.5, 0.5, np.nan, 1], equal_nan=True))
+
+        sqt_tables = from_sqt_to_tables(Path('data/sqt_V2_1_0.sqt'))
+        decoy_matches = get_decoy_matches(sqt_tables)
+        self.assertEqual(np.flatnonzero(decoy_matches).tolist(), [6, 9])
+
+        q_values = get_q_values(sqt_tables, max_rank=None, by_charge=False)
+        self.assertTrue(np.allclose(q_values, compute_q_values(sqt_tables.matches['xcorr'], decoy_matches)))
+        q_values = get_q_values(sqt_tables, 'tims_score')
+        self.assertEqual(np.flatnonzero(~np.isnan(q_values)).tolist(), [0, 5])
+
+        with self.assertRaises(ValueError):
+            get_q_values(from_sqt_to_tables(Path('data/sqt_V2_1_0.sqt'), include_l_lines=False))
+
+        projected_tables = from_sqt_to_tables(Path('data/sqt_V2_1_0.sqt'), m_line_columns=['xcorr'])
+        with self.assertRaisesRegex(ValueError, 'xcorr_rank'):
+            get_q_values(projected_tables)
+        with self.assertRaisesRegex(ValueError, 'tims_score'):
+            get_q_values(projected_tables, 'tims_score', max_rank=None)
+        q_values = get_q_values(projected_tables, max_rank=None, by_charge=False)
+        self.assertTrue(np.allclose(q_values, compute_q_values(sqt_tables.matches['xcorr'], decoy_matches)))
@@ -0,0 +1,133 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from serenipy.utils import ColumnSpec, decode_column, decode_columns, deserialize_val, make_row_decoder, \
+    make_line_decoder, make_line_encoder, make_column_encoder, make_value_encoder, line_template, serialize_val, \
+    iter_text_lines, read_bytes, read_text
+
+
+@dataclass
+class _Line:
+    name: str
+    count: int
+    score: float
+    coverage: float
+    children: List = field(default_factory=list)
+
+
+class TestUtils(unittest.TestCase):
+
+    def test_decode_columns(self):
+        specs = [ColumnSpec(int), ColumnSpec(float), ColumnSpec(str), ColumnSpec(float, strip='%'),
+                 ColumnSpec(int, strip='[]'), None]
+        lines = ['1\t0.1\tPEPTIDE\t50.0%\t[3]\tskip',
+                 '2\tNA\tNA\t1.5%\t[NA]\tskip',
+                 '3\t1.1519999504089355\tK.PEP.R\tNA\t[7]\tskip']
+        rows = [line.split('\t') for line in lines]
+
+        columns = decode_columns(lines, specs)
+        self.assertIsNone(columns[5])
+        self.assertEqual(columns[0].dtype, np.int64)
+        self.assertEqual(columns[0].tolist(), [1, 2, 3])
+        self.assertEqual(columns[1][0], 0.1)
+        self.assertTrue(np.isnan(columns[1][1]))
+        self.assertEqual(columns[1][2], float('1.1519999504089355'))
+        self.assertEqual(columns[2].tolist(), ['PEPTIDE', None, 'K.PEP.R'])
+        self.assertEqual(columns[3][:2].tolist(), [50.0, 1.5])
+        self.assertEqual(columns[4].dtype, np.float64)
+        self.assertEqual(columns[4][[0, 2]].tolist(), [3.0, 7.0])
+
+        for i, spec in enumerate(specs[:5]):
+            column = decode_column([row[i] for row in rows], spec)
+            self.assertEqual(column.dtype, columns[i].dtype)
+            self.assertTrue(all(a == b or (a is None and b is None) or (np.isnan(a) and np.isnan(b))
+                                for a, b in zip(column.tolist(), columns[i].tolist())))
+
+        # large batches go through the pandas tokenizer, the values are the same
+        many_columns = decode_columns(lines * 2000, specs)
+        self.assertIsNone(many_columns[5])
+        for i in range(5):
+            self.assertEqual(many_columns[i].dtype, columns[i].dtype)
+            self.assertTrue(all(a == b or (a is None and b is None) or (np.isnan(a) and np.isnan(b))
+                                for a, b in zip(many_columns[i][-3:].tolist(), columns[i].tolist())))
+
+        with self.assertRaises(ValueError):
+            decode_columns(lines + ['4\t0.1'], specs)
+        with self.assertRaises(ValueError):
+            decode_columns(['a\t0.1\tP\t1%\t[1]\tskip'], specs)
+
+    def test_make_row_decoder(self):
+        specs = [ColumnSpec(int), ColumnSpec(float), ColumnSpec(str), ColumnSpec(float, strip='%')]
+        decode_row = make_row_decoder(specs)
+        self.assertEqual(decode_row(['1', '0.5', 'PEPTIDE', '25.0%']), (1, 0.5, 'PEPTIDE', 25.0))
+        self.assertEqual(decode_row(['NA', 'NA', 'NA', 'NA']), (None, None, None, None))
+        self.assertEqual(decode_row(['1', '0.5', 'P', '1%', 'extra']),
+                         tuple(deserialize_val(val, f) for val, f in zip(['1', '0.5', 'P'], [int, float, str])) + (1.0,))
+        with self.assertRaises(ValueError):
+            decode_row(['1', '0.5'])
+
+    def test_line_codec(self):
+        schema = {'score': ColumnSpec(float, precision=2), 'name': ColumnSpec(str), 'count': ColumnSpec(int),
+                  'coverage': ColumnSpec(float, strip='%', precision=1, suffix='%')}
+        decode = make_line_decoder(_Line, schema, skip=1, n_required=3)
+        encode = make_line_encoder(schema, 'X\t')
+
+        line = decode('X\t1.256\tPEPTIDE\t3\t50.25%\n')
+        self.assertEqual(line, _Line(name='PEPTIDE', count=3, score=1.256, coverage=50.25))
+        self.assertEqual(encode(line), 'X\t1.26\tPEPTIDE\t3\t50.2%\n')
+        self.assertEqual(encode(line), line_template(schema, 'X\t').format(
+            score=serialize_val(1.256, 2), name='PEPTIDE', count=3, coverage=serialize_val(50.25, 1) + '%'))
+        self.assertEqual(encode(_Line(None, None, None, None)), 'X\tNA\tNA\tNA\tNA%\n')
+
+        # column encoders give the same text as the value encoders of the line encoder
+        columns = {'score': [1.256, None], 'name': ['PEPTIDE', None], 'count': [3, None], 'coverage': [50.25, None]}
+        for column, spec in list(schema.items()) + [('name', ColumnSpec(str, na='-', suffix='!'))]:
+            self.assertEqual(make_column_encoder(spec)(columns[column]),
+                             [make_value_encoder(spec)(value) for value in columns[column]])
+
+        self.assertEqual(decode('X\tNA\tNA\t3'), _Line(name=None, count=3, score=None, coverage=None))
+        self.assertEqual(decode('X\t1.0\tP\t3\t1%\textra').coverage, 1.0)
+        self.assertEqual(decode('X\t1.0\tP\t3').children, [])
+        with self.assertRaises(ValueError):
+            decode('X\t1.0\tP')
+
+        projected = make_line_decoder(_Line, {'score': None, 'name': ColumnSpec(str)}, skip=1)
+        self.assertEqual(projected('X\tNot a float\tPEPTIDE'), _Line(name='PEPTIDE', count=None, score=None,
+                                                                     coverage=None))
+
+        with self.assertRaises(ValueError):
+            make_line_decoder(_Line, {'unknown': ColumnSpec(str)})
+
+    def test_read_text_inputs(self):
+        text = 'H\tline\nS\t1\t1\t500.0\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'text.txt.gz')
+            with gzip.open(path, 'wt') as file:
+                file.write(text)
+
+            for text_input in [text, text.encode(), io.StringIO(text), io.BytesIO(text.encode()),
+                               Path(path)]:
+                if hasattr(text_input, 'seek'):
+                    text_input.seek(0)
+                self.assertEqual(''.join(line.rstrip('\n') + '\n' for line in iter_text_lines(text_input)
+                                         if line), text)
+                if hasattr(text_input, 'seek'):
+                    text_input.seek(0)
+                self.assertEqual(read_text(text_input), text)
+                if hasattr(text_input, 'seek'):
+                    text_input.seek(0)
+                self.assertEqual(read_bytes(text_input), text.encode())
+
+        binary_handle = io.BytesIO(text.encode())
+        list(iter_text_lines(binary_handle))
+        self.assertFalse(binary_handle.closed)
+        with self.assertRaises(ValueError):
+            read_text(1)